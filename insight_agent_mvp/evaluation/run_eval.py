@@ -2,14 +2,19 @@
 """
 LangGraph评测脚本
 评估自然语言理解准确率、端到端准确率、响应时间等指标
+
+测试用例按--concurrency并发执行（同一进程内共享SEC、财报事实和意图缓存），
+报告中的用例顺序始终与数据集一致。设置--min-nlu-accuracy/--min-e2e-accuracy后，
+低于阈值时以非零状态码退出，可作为合并前的检查。
 """
 
 import json
+import argparse
 import asyncio
 import time
 import sys
 import os
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from dataclasses import dataclass
 from datetime import datetime
 
@@ -17,8 +22,13 @@ from datetime import datetime
 project_root = os.path.dirname(os.path.dirname(__file__))
 sys.path.insert(0, project_root)
 
-from src.langgraph_orchestrator import process_query_with_langgraph
-from src.config import OPENAI_API_KEY
+from src.langgraph_orchestrator import process_query_with_langgraph, clear_caches
+from src.config import OPENAI_API_KEY, LLM_BACKEND, RECORDING_MODE
+
+# 默认并发用例数；上游的准入控制和SEC限速仍然生效
+DEFAULT_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "4"))
+# 查询因上游过载被拒绝（结果带retry_after）时的最大重试次数
+MAX_OVERLOAD_RETRIES = 3
 
 @dataclass
 class EvalResult:
@@ -37,11 +47,13 @@ class EvalResult:
 class LangGraphEvaluator:
     """LangGraph评测器"""
     
-    def __init__(self, dataset_path: str):
+    def __init__(self, dataset_path: str, concurrency: int = DEFAULT_CONCURRENCY):
         self.dataset_path = dataset_path
+        self.concurrency = max(1, concurrency)
         self.results: List[EvalResult] = []
         self.start_time = None
         self.end_time = None
+        self.wall_time = 0.0
         
     def load_dataset(self) -> List[Dict]:
         """加载测试数据集"""
@@ -125,14 +137,18 @@ class LangGraphEvaluator:
         category = test_case.get("category", "")
         description = test_case.get("description", "")
         
-        print(f"📋 测试 {test_id}: {query}")
-        
         # 测量响应时间
         start_time = time.time()
         
         try:
             # 使用LangGraph处理查询
-            actual_result = await process_query_with_langgraph(query)
+            for attempt in range(MAX_OVERLOAD_RETRIES + 1):
+                start_time = time.time()
+                actual_result = await process_query_with_langgraph(query)
+                # 并发过高时查询可能被准入控制拒绝，按建议时间等待后重试，不算作用例失败
+                if "retry_after" not in actual_result or attempt == MAX_OVERLOAD_RETRIES:
+                    break
+                await asyncio.sleep(actual_result["retry_after"])
             response_time = time.time() - start_time
             
             # 检查NLU准确率
@@ -154,8 +170,9 @@ class LangGraphEvaluator:
                 description=description
             )
             
-            # 输出结果
+            # 输出结果（并发执行时两行连续打印，不会与其他用例交错）
             status = "✅" if nlu_correct and end_to_end_correct else "❌"
+            print(f"📋 测试 {test_id}: {query}")
             print(f"  {status} NLU: {nlu_correct}, E2E: {end_to_end_correct}, 耗时: {response_time:.2f}s")
             
             return result
@@ -177,6 +194,7 @@ class LangGraphEvaluator:
                 description=description
             )
             
+            print(f"📋 测试 {test_id}: {query}")
             print(f"  ❌ 执行失败: {error_message}")
             return result
     
@@ -185,8 +203,8 @@ class LangGraphEvaluator:
         print("🧪 开始LangGraph评测")
         print("=" * 60)
         
-        # 检查API密钥
-        if not OPENAI_API_KEY:
+        # 检查API密钥（离线的fake后端和回放模式不需要）
+        if LLM_BACKEND.lower() == "openai" and RECORDING_MODE != "replay" and not OPENAI_API_KEY:
             print("❌ 缺少OPENAI_API_KEY环境变量")
             return {"error": "缺少OPENAI_API_KEY环境变量"}
         
@@ -195,19 +213,23 @@ class LangGraphEvaluator:
         if not dataset:
             return {"error": "数据集加载失败"}
         
-        print(f"📊 数据集大小: {len(dataset)}个测试用例")
+        print(f"📊 数据集大小: {len(dataset)}个测试用例, 并发数: {self.concurrency}")
         print("=" * 60)
         
         self.start_time = datetime.now()
+        wall_start = time.perf_counter()
         
-        # 运行所有测试用例
-        for test_case in dataset:
-            result = await self.evaluate_single_query(test_case)
-            self.results.append(result)
-            
-            # 添加延迟以避免API限制
-            await asyncio.sleep(0.5)
+        # 用信号量限制同时执行的用例数
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def run_case(test_case: Dict) -> EvalResult:
+            async with semaphore:
+                return await self.evaluate_single_query(test_case)
+        
+        # gather按输入顺序返回，报告顺序与数据集一致，与完成先后无关
+        self.results = list(await asyncio.gather(*(run_case(test_case) for test_case in dataset)))
         
+        self.wall_time = time.perf_counter() - wall_start
         self.end_time = datetime.now()
         
         # 生成报告
@@ -226,6 +248,8 @@ class LangGraphEvaluator:
         e2e_accuracy = e2e_correct / total_tests * 100
         
         avg_response_time = sum(r.response_time for r in self.results) / total_tests
+        response_times = sorted(r.response_time for r in self.results)
+        p95_response_time = response_times[min(total_tests - 1, int(total_tests * 0.95))]
         
         # 按类别统计
         category_stats = {}
@@ -260,6 +284,9 @@ class LangGraphEvaluator:
                 "nlu_accuracy": nlu_accuracy,
                 "e2e_accuracy": e2e_accuracy,
                 "avg_response_time": avg_response_time,
+                "p95_response_time": p95_response_time,
+                "concurrency": self.concurrency,
+                "wall_time": self.wall_time,
                 "evaluation_time": str(self.end_time - self.start_time)
             },
             "category_stats": category_stats,
@@ -300,7 +327,8 @@ class LangGraphEvaluator:
         print(f"  • NLU准确率: {summary['nlu_accuracy']:.1f}%")
         print(f"  • 端到端准确率: {summary['e2e_accuracy']:.1f}%")
         print(f"  • 平均响应时间: {summary['avg_response_time']:.2f}s")
-        print(f"  • 评测耗时: {summary['evaluation_time']}")
+        print(f"  • P95响应时间: {summary['p95_response_time']:.2f}s")
+        print(f"  • 评测耗时: {summary['evaluation_time']} (并发数: {summary['concurrency']})")
         
         print(f"\n📈 分类统计:")
         for category, stats in category_stats.items():
@@ -332,11 +360,35 @@ class LangGraphEvaluator:
         except Exception as e:
             print(f"❌ 保存报告失败: {e}")
 
-async def main():
-    """主函数"""
+def check_thresholds(report: Dict[str, Any], min_nlu_accuracy: Optional[float] = None,
+                     min_e2e_accuracy: Optional[float] = None) -> List[str]:
+    """检查准确率阈值（百分比），返回未达标项的说明，全部达标时为空列表"""
+    if "error" in report:
+        return [report["error"]]
+    
+    summary = report["summary"]
+    failures = []
+    for name, key, threshold in (
+        ("NLU准确率", "nlu_accuracy", min_nlu_accuracy),
+        ("端到端准确率", "e2e_accuracy", min_e2e_accuracy),
+    ):
+        if threshold is not None and summary[key] < threshold:
+            failures.append(f"{name} {summary[key]:.1f}% 低于阈值 {threshold:.1f}%")
+    return failures
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    """主函数，返回进程退出码"""
     # 设置路径
     current_dir = os.path.dirname(__file__)
-    dataset_path = os.path.join(current_dir, "eval_dataset.json")
+    
+    parser = argparse.ArgumentParser(description="LangGraph评测")
+    parser.add_argument("--dataset", default=os.path.join(current_dir, "eval_dataset.json"), help="测试数据集路径")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同时执行的用例数，1为顺序执行")
+    parser.add_argument("--cold-cache", action="store_true", help="评测前清空进程内缓存")
+    parser.add_argument("--min-nlu-accuracy", type=float, help="NLU准确率下限（百分比），低于时退出码为1")
+    parser.add_argument("--min-e2e-accuracy", type=float, help="端到端准确率下限（百分比），低于时退出码为1")
+    parser.add_argument("--output", help="报告路径，默认为reports/下带时间戳的文件")
+    args = parser.parse_args(argv)
     
     # 创建reports子文件夹
     reports_dir = os.path.join(current_dir, "reports")
@@ -344,10 +396,13 @@ async def main():
     
     # 生成带时间戳的报告文件名
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    report_path = os.path.join(reports_dir, f"eval_report_{timestamp}.json")
+    report_path = args.output or os.path.join(reports_dir, f"eval_report_{timestamp}.json")
+    
+    if args.cold_cache:
+        clear_caches()
     
     # 创建评测器
-    evaluator = LangGraphEvaluator(dataset_path)
+    evaluator = LangGraphEvaluator(args.dataset, concurrency=args.concurrency)
     
     # 运行评测
     report = await evaluator.run_evaluation()
@@ -358,6 +413,11 @@ async def main():
     # 保存报告
     if "error" not in report:
         evaluator.save_report(report, report_path)
+    
+    failures = check_thresholds(report, args.min_nlu_accuracy, args.min_e2e_accuracy)
+    for failure in failures:
+        print(f"❌ 未通过: {failure}")
+    return 1 if failures else 0
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    sys.exit(asyncio.run(main()))
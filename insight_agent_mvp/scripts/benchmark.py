@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+离线压测脚本
+使用离线LLM后端（LLM_BACKEND=fake）和本地财报文档跑完整的LangGraph工作流，
+不需要网络和OpenAI密钥，测得的是我们自己的处理耗时和吞吐量。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+# 必须在导入src之前选择离线LLM后端
+os.environ.setdefault("LLM_BACKEND", "fake")
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src import sec_retriever
+from src.langgraph_orchestrator import get_llm, process_query_with_langgraph, clear_caches
+from src.llm_backends import rule_based_intent
+from src.metrics_manager import list_metrics
+
+DEFAULT_QUERIES = [
+    "What was Apple's revenue in 2023?",
+    "苹果公司2022年的净利润是多少？",
+    "MSFT 2022 net income",
+    "谷歌2022年的总资产有多少？",
+    "Amazon total liabilities 2023",
+    "特斯拉2023年的股东权益",
+    "NVIDIA revenue 2021-2023",
+    "Netflix net income and total assets 2022",
+]
+
+def build_synthetic_filing() -> str:
+    """生成一份包含知识库中所有指标标签的最小iXBRL文档，作为每份财报的内容"""
+    facts = []
+    for index, definition in enumerate(list_metrics().values(), start=1):
+        for tag in definition["tags"]:
+            facts.append(
+                f'<ix:nonFraction name="{tag}" contextRef="FY" unitRef="usd" '
+                f'decimals="-6" scale="6">{index * 1000}</ix:nonFraction>'
+            )
+    return (
+        '<html xmlns="http://www.w3.org/1999/xhtml" '
+        'xmlns:ix="http://www.xbrl.org/2013/inlineXBRL"><body>'
+        + "".join(facts)
+        + "</body></html>"
+    )
+
+def seed_filings(queries, html: str) -> int:
+    """把查询会用到的每份财报预先放进SEC文档缓存，工作流因此不会访问网络"""
+    filings = set()
+    for query in queries:
+        intent = rule_based_intent(query)
+        if "error" in intent:
+            continue
+        years = intent.get("years") or [intent["year"]]
+        for year in years:
+            filings.add((intent["ticker"], int(year), intent["form_type"]))
+
+    # 文档缓存默认只保留少量财报，压测时放大到能容纳全部预置财报
+    sec_retriever._filing_cache.maxsize = max(sec_retriever._filing_cache.maxsize, len(filings))
+    for key in filings:
+        sec_retriever._filing_cache.set(key, html)
+    return len(filings)
+
+def percentile(values, pct: float) -> float:
+    """最近秩百分位数"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+async def run_benchmark(queries, total: int, concurrency: int):
+    """以固定并发数执行total次查询，返回每次的耗时（毫秒）、成功数和意图解析的token用量"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    successes = 0
+    tokens = {"input_tokens": 0, "output_tokens": 0}
+
+    async def run_one(query):
+        nonlocal successes
+        async with semaphore:
+            start = time.perf_counter()
+            result = await process_query_with_langgraph(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if result.get("success"):
+                successes += 1
+            for key in tokens:
+                tokens[key] += (result.get("llm_usage") or {}).get(key, 0)
+
+    await asyncio.gather(*(run_one(queries[i % len(queries)]) for i in range(total)))
+    return latencies, successes, tokens
+
+def main():
+    parser = argparse.ArgumentParser(description="离线压测LangGraph工作流")
+    parser.add_argument("--requests", type=int, default=200, help="总查询次数")
+    parser.add_argument("--concurrency", type=int, default=32, help="同时进行的查询数")
+    parser.add_argument("--queries", help="查询列表文件（JSON数组，元素为字符串或含query字段的对象）")
+    parser.add_argument("--filing", help="用作每份财报内容的本地iXBRL文档，默认使用合成文档")
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            queries = [item["query"] if isinstance(item, dict) else item for item in json.load(f)]
+
+    if args.filing:
+        with open(args.filing, 'r', encoding='utf-8') as f:
+            html = f.read()
+    else:
+        html = build_synthetic_filing()
+
+    clear_caches()
+    filings = seed_filings(queries, html)
+
+    print(f"🚀 LLM后端: {type(get_llm()).__name__}，预置财报: {filings} 份")
+    print(f"   查询次数: {args.requests}，并发数: {args.concurrency}")
+
+    start = time.perf_counter()
+    latencies, successes, tokens = asyncio.run(run_benchmark(queries, args.requests, args.concurrency))
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "llm_backend": type(get_llm()).__name__,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "successes": successes,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_qps": round(args.requests / elapsed, 2),
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies), 2),
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(max(latencies), 2),
+        },
+        "llm_tokens_per_query": {key: round(value / args.requests, 1) for key, value in tokens.items()},
+    }
+
+    print(f"✅ 成功: {successes}/{args.requests}，总耗时: {report['elapsed_s']}s，吞吐量: {report['throughput_qps']} QPS")
+    latency = report["latency_ms"]
+    print(f"   延迟(ms) mean={latency['mean']} p50={latency['p50']} p95={latency['p95']} p99={latency['p99']} max={latency['max']}")
+    usage = report["llm_tokens_per_query"]
+    print(f"   每次查询token: 输入={usage['input_tokens']} 输出={usage['output_tokens']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📄 结果已保存到: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Admission control for work bound to rate-limited upstreams (SEC EDGAR, the LLM API).
+
+Each upstream gets an UpstreamLimiter: at most max_concurrency calls run at once, the
+rest wait in a bounded FIFO queue. The limiter keeps a moving average of how long a
+call holds its slot, so it can estimate how long a newcomer would wait. A call is
+rejected with Overloaded, which the API turns into 429 + Retry-After, when the queue
+is full or the estimated wait exceeds the time left before the query's deadline. An
+overloaded upstream therefore sheds excess load quickly instead of making every
+request time out.
+
+Limiters are per process: with several API workers, each enforces its own limits.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from .config import (
+    SEC_MAX_CONCURRENCY,
+    SEC_MAX_QUEUE,
+    SEC_INITIAL_SERVICE_TIME,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_QUEUE,
+    LLM_INITIAL_SERVICE_TIME
+)
+from .deadline import current_deadline
+from .telemetry import annotate
+
+class Overloaded(Exception):
+    """Raised when an upstream is too busy to serve the call in time."""
+
+    def __init__(self, upstream: str, retry_after: float, reason: str):
+        super().__init__(f"{upstream} is overloaded ({reason}); retry after {retry_after:.1f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+        self.reason = reason
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After value in whole seconds (at least 1)."""
+        return str(max(1, math.ceil(self.retry_after)))
+
+class UpstreamLimiter:
+    """Concurrency limit plus bounded FIFO wait queue for one upstream. Thread-safe."""
+
+    # Weight of the newest observation in the service time moving average
+    SMOOTHING = 0.2
+    # While a deadline is active, queued callers wake up this often to notice cancellation
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, initial_service_time: float):
+        """
+        Args:
+            name: Upstream name used in errors and stats
+            max_concurrency: Calls allowed to run at once
+            max_queue: Calls allowed to wait for a slot; more are rejected immediately
+            initial_service_time: Seconds a call is assumed to take before any were observed
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._service_time = initial_service_time
+        self._active = 0
+        self._waiting: deque = deque()
+        self._rejected = 0
+        self._cond = threading.Condition()
+
+    def _estimate(self, ahead: int) -> float:
+        """Expected seconds until a caller with `ahead` callers in front of it gets a slot. Caller holds _cond."""
+        if self._active < self.max_concurrency and ahead == 0:
+            return 0.0
+        return (ahead + 1) * self._service_time / self.max_concurrency
+
+    def estimated_wait(self) -> float:
+        """Expected seconds a new call would wait for a slot right now."""
+        with self._cond:
+            return self._estimate(len(self._waiting))
+
+    def _reject(self, reason: str, estimate: float) -> Overloaded:
+        """Caller holds _cond."""
+        self._rejected += 1
+        return Overloaded(self.name, max(estimate, self._service_time), reason)
+
+    def check(self) -> None:
+        """
+        Raises Overloaded if a call made now would be rejected (queue full, or the
+        estimated wait exceeds the current deadline). Does not take a slot.
+        """
+        deadline = current_deadline()
+        remaining = deadline.remaining() if deadline is not None else None
+        with self._cond:
+            if len(self._waiting) >= self.max_queue:
+                raise self._reject("queue full", self._estimate(len(self._waiting)))
+            estimate = self._estimate(len(self._waiting))
+            if remaining is not None and estimate > remaining:
+                raise self._reject("estimated wait exceeds deadline", estimate)
+
+    def acquire(self) -> float:
+        """
+        Takes a slot, waiting in FIFO order if none is free.
+
+        Returns:
+            Seconds spent waiting
+
+        Raises:
+            Overloaded: The queue is full or the wait would outlast the current deadline
+            DeadlineExceeded: The deadline passed or the query was cancelled while queued
+        """
+        deadline = current_deadline()
+        start = time.monotonic()
+        with self._cond:
+            if self._active < self.max_concurrency and not self._waiting:
+                self._active += 1
+                return 0.0
+
+            ahead = len(self._waiting)
+            if ahead >= self.max_queue:
+                raise self._reject("queue full", self._estimate(ahead))
+            estimate = self._estimate(ahead)
+            remaining = deadline.remaining() if deadline is not None else None
+            if remaining is not None and estimate > remaining:
+                raise self._reject("estimated wait exceeds deadline", estimate)
+
+            ticket = object()
+            self._waiting.append(ticket)
+            try:
+                while self._waiting[0] is not ticket or self._active >= self.max_concurrency:
+                    if deadline is not None:
+                        deadline.check()
+                        self._cond.wait(timeout=min(self.POLL_INTERVAL, deadline.remaining() or self.POLL_INTERVAL))
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+                raise
+            self._waiting.popleft()
+            self._active += 1
+            # The next caller in line may be able to proceed too
+            self._cond.notify_all()
+        return time.monotonic() - start
+
+    def release(self, service_time: float) -> None:
+        """Frees a slot and records how long it was held."""
+        with self._cond:
+            self._active -= 1
+            self._service_time += self.SMOOTHING * (service_time - self._service_time)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Holds a slot for the enclosed call (see acquire())."""
+        waited = self.acquire()
+        if waited:
+            annotate(queue_wait_ms=round(waited * 1000, 1))
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> Dict[str, float]:
+        """Current load: active and queued calls, average service time, rejections so far."""
+        with self._cond:
+            return {
+                "active": self._active,
+                "queued": len(self._waiting),
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "service_time_s": round(self._service_time, 4),
+                "rejected": self._rejected,
+            }
+
+_limiters: Dict[str, UpstreamLimiter] = {
+    "sec": UpstreamLimiter("sec", SEC_MAX_CONCURRENCY, SEC_MAX_QUEUE, SEC_INITIAL_SERVICE_TIME),
+    "llm": UpstreamLimiter("llm", LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_INITIAL_SERVICE_TIME),
+}
+
+def get_limiter(upstream: str) -> UpstreamLimiter:
+    return _limiters[upstream]
+
+def upstream_slot(upstream: str):
+    """Context manager holding a slot of the named upstream ('sec' or 'llm') for one call."""
+    return _limiters[upstream].slot()
+
+def check_admission(*upstreams: str) -> None:
+    """
+    Fast-fails a query up front: raises Overloaded if any of the named upstreams
+    would reject a call made now.
+    """
+    for upstream in upstreams:
+        _limiters[upstream].check()
+
+def admission_stats() -> Dict[str, Dict[str, float]]:
+    """Load of every upstream limiter, keyed by upstream name."""
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
@@ -0,0 +1,514 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence
+
+from .config import (
+    SHARED_CACHE,
+    SHARED_CACHE_PATH,
+    SHARED_CACHE_MAX_BYTES,
+    SHARED_CACHE_LOCK_LEASE,
+    REDIS_URL,
+    REDIS_KEY_PREFIX,
+    REDIS_COMPRESS_MIN_BYTES
+)
+from .deadline import check_deadline
+
+_MISSING = object()
+
+class CacheBackend:
+    """
+    A cache store shared with other processes, behind LRUCache. Keys are strings,
+    values bytes. Implementations must be thread-safe.
+    """
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the stored value, or None if missing or expired."""
+        raise NotImplementedError
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        """Looks up several keys, in one round trip where the store allows it."""
+        return [self.get(key) for key in keys]
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        """Stores value under key (expiring after ttl seconds, if given), replacing any previous value atomically."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self, prefix: str = "") -> None:
+        """Removes all entries whose key starts with prefix."""
+        raise NotImplementedError
+
+    def acquire(self, key: str, lease: float) -> Optional[str]:
+        """
+        Takes the lock named key unless another holder's lease is still running.
+
+        Returns:
+            A token for release(), or None if the lock is held elsewhere
+        """
+        raise NotImplementedError
+
+    def release(self, key: str, token: str) -> None:
+        """Releases a lock taken with acquire(); does nothing if the lease already passed to someone else."""
+        raise NotImplementedError
+
+class SQLiteCache(CacheBackend):
+    """
+    Key/value store shared by all processes on one host, kept in a SQLite database in
+    WAL mode so readers never block the writer. Keys are strings, values bytes.
+
+    Every write is a single statement, so other processes see either the old or the new
+    value, never a partial one. acquire()/release() provide a per-key lock with a lease,
+    used for cross-process single flight: a lock whose holder died expires on its own.
+    """
+
+    # Trim expired and excess entries after this many writes
+    TRIM_EVERY = 32
+
+    def __init__(self, path: str = SHARED_CACHE_PATH, max_bytes: int = SHARED_CACHE_MAX_BYTES):
+        """
+        Args:
+            path: Database file, created if missing
+            max_bytes: Total value size above which the oldest entries are dropped
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL,
+                stored_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_by_age ON entries (stored_at);
+            CREATE TABLE IF NOT EXISTS locks (
+                key TEXT PRIMARY KEY,
+                token TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        """)
+
+    def _connection(self) -> sqlite3.Connection:
+        """This thread's connection, in autocommit mode."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._connection().execute(
+            "SELECT value FROM entries WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        found: Dict[str, bytes] = {}
+        now = time.time()
+        # SQLite limits the number of bound parameters per statement
+        for start in range(0, len(keys), 500):
+            chunk = list(keys[start:start + 500])
+            rows = self._connection().execute(
+                f"SELECT key, value FROM entries WHERE key IN ({', '.join('?' * len(chunk))}) "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                (*chunk, now)
+            )
+            found.update(rows)
+        return [found.get(key) for key in keys]
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO entries (key, value, expires_at, stored_at) VALUES (?, ?, ?, ?)",
+            (key, value, now + ttl if ttl is not None else None, now)
+        )
+        self._writes += 1
+        if self._writes % self.TRIM_EVERY == 0:
+            self.trim()
+
+    def delete(self, key: str) -> None:
+        self._connection().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self, prefix: str = "") -> None:
+        self._connection().execute("DELETE FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def trim(self) -> None:
+        """Drops expired entries, then the oldest ones until the total size is within max_bytes."""
+        conn = self._connection()
+        conn.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+        excess = conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM entries").fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        doomed = []
+        for key, size in conn.execute("SELECT key, LENGTH(value) FROM entries ORDER BY stored_at"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+
+    def acquire(self, key: str, lease: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        now = time.time()
+        cursor = self._connection().execute(
+            "INSERT INTO locks (key, token, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET token = excluded.token, expires_at = excluded.expires_at "
+            "WHERE locks.expires_at <= ?",
+            (key, token, now + lease, now)
+        )
+        return token if cursor.rowcount == 1 else None
+
+    def release(self, key: str, token: str) -> None:
+        self._connection().execute("DELETE FROM locks WHERE key = ? AND token = ?", (key, token))
+
+def _glob_escape(text: str) -> str:
+    """Escapes Redis glob metacharacters so text matches literally in SCAN MATCH."""
+    return "".join(f"\\{char}" if char in "*?[]\\" else char for char in text)
+
+class RedisCache(CacheBackend):
+    """
+    Cache store shared by a fleet of hosts through a Redis server (or anything speaking
+    its protocol), using a redis-py compatible client.
+
+    Values of REDIS_COMPRESS_MIN_BYTES or more are zlib-compressed; a one-byte header
+    tells the two encodings apart. get_many() sends all GETs in one pipeline. Locks are
+    keys set with NX and a millisecond expiry, released only by the token holder.
+    Eviction is left to the server's maxmemory policy.
+    """
+
+    _RAW = b"r"
+    _COMPRESSED = b"z"
+
+    def __init__(self, client, prefix: str = REDIS_KEY_PREFIX, compress_min_bytes: int = REDIS_COMPRESS_MIN_BYTES):
+        """
+        Args:
+            client: A redis.Redis (or fakeredis.FakeRedis) client, not decoding responses
+            prefix: Prepended to every key, so several applications can share one server
+            compress_min_bytes: Values at least this large are stored compressed
+        """
+        self.client = client
+        self.prefix = prefix
+        self.compress_min_bytes = compress_min_bytes
+
+    @classmethod
+    def from_url(cls, url: str = REDIS_URL, **kwargs) -> "RedisCache":
+        """Connects to the server at url (redis://host:port/db). Requires the redis package."""
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("SHARED_CACHE=redis requires the redis package: pip install redis") from e
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _encode(self, value: bytes) -> bytes:
+        if len(value) >= self.compress_min_bytes:
+            return self._COMPRESSED + zlib.compress(value)
+        return self._RAW + value
+
+    def _decode(self, data: Optional[bytes]) -> Optional[bytes]:
+        if data is None:
+            return None
+        if data[:1] == self._COMPRESSED:
+            return zlib.decompress(data[1:])
+        return data[1:]
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._decode(self.client.get(self.prefix + key))
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(self.prefix + key)
+        return [self._decode(data) for data in pipe.execute()]
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        if ttl is not None and ttl <= 0:
+            self.delete(key)
+            return
+        self.client.set(self.prefix + key, self._encode(value), px=int(ttl * 1000) if ttl is not None else None)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def clear(self, prefix: str = "") -> None:
+        pattern = _glob_escape(self.prefix + prefix) + "*"
+        pipe = self.client.pipeline(transaction=False)
+        for key in self.client.scan_iter(match=pattern, count=1000):
+            pipe.delete(key)
+        pipe.execute()
+
+    def _lock_key(self, key: str) -> str:
+        return f"{self.prefix}lock:{key}"
+
+    def acquire(self, key: str, lease: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        acquired = self.client.set(self._lock_key(key), token, nx=True, px=max(1, int(lease * 1000)))
+        return token if acquired else None
+
+    def release(self, key: str, token: str) -> None:
+        # Check-and-delete in a WATCH transaction so a lock that expired and was taken
+        # by another process is left alone
+        from redis.exceptions import WatchError
+
+        lock_key = self._lock_key(key)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(lock_key)
+                held = pipe.get(lock_key)
+                if held is not None and held.decode() == token:
+                    pipe.multi()
+                    pipe.delete(lock_key)
+                    pipe.execute()
+                else:
+                    pipe.unwatch()
+            except WatchError:
+                # The lock changed hands meanwhile, so it is no longer ours to delete
+                pass
+
+_shared_backend: Optional[CacheBackend] = None
+_shared_backend_lock = threading.Lock()
+
+def shared_backend() -> Optional[CacheBackend]:
+    """
+    The cross-process cache store selected by SHARED_CACHE ("sqlite" for one host,
+    "redis" for a fleet), created on first use; None when sharing is disabled.
+    """
+    global _shared_backend
+    if SHARED_CACHE == "none":
+        return None
+    with _shared_backend_lock:
+        if _shared_backend is None:
+            if SHARED_CACHE == "sqlite":
+                _shared_backend = SQLiteCache()
+            elif SHARED_CACHE == "redis":
+                _shared_backend = RedisCache.from_url()
+            else:
+                raise ValueError(f"Unknown SHARED_CACHE backend: {SHARED_CACHE}")
+        return _shared_backend
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU cache with an optional time-to-live.
+
+    get_or_compute() coalesces concurrent misses for the same key, so only one
+    caller runs the (usually network-bound) compute function while the others wait
+    for its result.
+
+    With a backend (see CacheBackend), the in-process cache is the L1 in front of a store
+    shared with other processes or hosts: misses are looked up there, writes go to both, and
+    get_or_compute() takes the backend's per-key lock so that only one process computes
+    a value while the others wait for it to appear. Values stored in a backend must be
+    JSON-serializable. A failing backend is skipped with a warning; the cache then
+    behaves as if it had none.
+    """
+
+    # Seconds between backend checks while another process computes a value
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None, backend=None, namespace: str = ""):
+        """
+        Args:
+            maxsize: Maximum number of entries kept before evicting the least recently used one
+            ttl: Seconds an entry stays valid, None means entries never expire
+            backend: Shared store behind this cache, or None for an in-process cache only
+            namespace: Prefix separating this cache's keys from other caches in the backend
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.namespace = namespace
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def _get_local(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def _set_local(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def _backend_key(self, key: Hashable) -> str:
+        return f"{self.namespace}:{json.dumps(key)}"
+
+    def _load(self, key: Hashable) -> Any:
+        """Reads key from the backend; _MISSING if absent or the backend fails."""
+        try:
+            data = self.backend.get(self._backend_key(key))
+            return _MISSING if data is None else json.loads(data)
+        except Exception as e:
+            print(f"Warning: shared cache read failed for {self.namespace}: {e}")
+            return _MISSING
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        try:
+            self.backend.set(self._backend_key(key), json.dumps(value, ensure_ascii=False).encode("utf-8"), self.ttl)
+        except Exception as e:
+            print(f"Warning: shared cache write failed for {self.namespace}: {e}")
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the cached value for key, or default if missing or expired."""
+        value = self._get_local(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.backend is not None:
+            value = self._load(key)
+            if value is not _MISSING:
+                self._set_local(key, value)
+                return value
+        return default
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        """
+        Returns the cached values of those keys that are present. Keys missing locally are
+        fetched from the backend in one round trip and kept locally.
+        """
+        found: Dict[Hashable, Any] = {}
+        missing = []
+        for key in keys:
+            value = self._get_local(key, _MISSING)
+            if value is not _MISSING:
+                found[key] = value
+            else:
+                missing.append(key)
+        if self.backend is None or not missing:
+            return found
+
+        try:
+            stored = self.backend.get_many([self._backend_key(key) for key in missing])
+        except Exception as e:
+            print(f"Warning: shared cache read failed for {self.namespace}: {e}")
+            return found
+        for key, data in zip(missing, stored):
+            if data is not None:
+                found[key] = json.loads(data)
+                self._set_local(key, found[key])
+        return found
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Stores value under key, evicting the least recently used entry if full."""
+        self._set_local(key, value)
+        if self.backend is not None:
+            self._store(key, value)
+
+    def delete(self, key: Hashable) -> None:
+        """Removes key from the cache if present."""
+        with self._lock:
+            self._data.pop(key, None)
+        if self.backend is not None:
+            try:
+                self.backend.delete(self._backend_key(key))
+            except Exception as e:
+                print(f"Warning: shared cache delete failed for {self.namespace}: {e}")
+
+    def clear(self) -> None:
+        """Removes all entries (including this cache's entries in the backend)."""
+        with self._lock:
+            self._data.clear()
+        if self.backend is not None:
+            try:
+                self.backend.clear(f"{self.namespace}:")
+            except Exception as e:
+                print(f"Warning: shared cache clear failed for {self.namespace}: {e}")
+
+    def __len__(self) -> int:
+        """Number of entries held in this process."""
+        with self._lock:
+            return len(self._data)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value for key, calling compute() to fill it on a miss.
+
+        Exceptions raised by compute() propagate to the caller and nothing is cached.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                inflight = self._inflight[key] = [threading.Lock(), 0]
+            inflight[1] += 1
+
+        try:
+            with inflight[0]:
+                # Another caller may have filled the entry while we were waiting.
+                value = self.get(key, _MISSING)
+                if value is _MISSING:
+                    if self.backend is not None:
+                        value = self._compute_shared(key, compute)
+                    else:
+                        value = compute()
+                        self.set(key, value)
+                return value
+        finally:
+            with self._lock:
+                inflight[1] -= 1
+                if inflight[1] == 0:
+                    self._inflight.pop(key, None)
+
+    def _compute_shared(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Computes and stores a value while holding the backend's lock for key, or waits for
+        the process holding it to store the value. If the holder fails (or its lease runs
+        out), the next waiter takes the lock and computes the value itself.
+        """
+        backend_key = self._backend_key(key)
+        while True:
+            try:
+                token = self.backend.acquire(backend_key, SHARED_CACHE_LOCK_LEASE)
+            except Exception as e:
+                print(f"Warning: shared cache lock failed for {self.namespace}: {e}")
+                value = compute()
+                self.set(key, value)
+                return value
+
+            if token is not None:
+                try:
+                    value = self._load(key)
+                    if value is _MISSING:
+                        value = compute()
+                        self._store(key, value)
+                    self._set_local(key, value)
+                    return value
+                finally:
+                    try:
+                        self.backend.release(backend_key, token)
+                    except Exception as e:
+                        print(f"Warning: shared cache unlock failed for {self.namespace}: {e}")
+
+            # Another process is computing the value
+            check_deadline()
+            time.sleep(self.POLL_INTERVAL)
+            value = self._load(key)
+            if value is not _MISSING:
+                self._set_local(key, value)
+                return value
@@ -14,6 +14,21 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = "gpt-3.5-turbo"
 OPENAI_TEMPERATURE = 0.0
 
+# LLM backend used for intent parsing: "openai" or "fake" (offline, for load tests and benchmarks)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+FAKE_LLM_LATENCY_MEDIAN_MS = float(os.getenv("FAKE_LLM_LATENCY_MEDIAN_MS", "0"))  # median synthetic latency
+FAKE_LLM_LATENCY_SIGMA = float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5"))  # lognormal spread, 0 = fixed latency
+FAKE_LLM_RESPONSES_PATH = os.getenv("FAKE_LLM_RESPONSES_PATH")  # optional JSON file of recorded {query: response}
+FAKE_LLM_SEED = os.getenv("FAKE_LLM_SEED")  # seed for reproducible latency samples
+
+# Record/replay of upstream traffic (see src/recording.py): "off"; "record" (live SEC and LLM calls, responses
+# saved under RECORDING_PATH); or "replay" (responses served from RECORDING_PATH, no network or API key needed)
+RECORDING_MODE = os.getenv("RECORDING_MODE", "off").lower()
+RECORDING_PATH = os.getenv("RECORDING_PATH", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "recordings"
+))
+REPLAY_LATENCY = os.getenv("REPLAY_LATENCY", "0")  # injected per replayed call: milliseconds, or "recorded"
+
 # SEC API Configuration
 SEC_BASE_URL = "https://data.sec.gov"
 SEC_EDGAR_URL = "https://www.sec.gov/Archives/edgar/data"
@@ -22,6 +37,58 @@ SEC_USER_AGENT = "InsightAgent MVP Project agent@insightagent.com"
 # Rate limiting configuration
 SEC_REQUEST_DELAY = 0.2  # seconds between requests to respect SEC rate limits (10 req/sec)
 
+# Admission control: concurrent calls per upstream, callers allowed to queue, and the assumed duration
+# of a call until real ones are observed. Calls that would wait past their deadline are rejected (HTTP 429).
+SEC_MAX_CONCURRENCY = 4
+SEC_MAX_QUEUE = 64
+SEC_INITIAL_SERVICE_TIME = 0.5
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = 256
+LLM_INITIAL_SERVICE_TIME = 2.0
+
+# Timeouts (each is further capped by the time left before the query deadline)
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "30"))  # end-to-end deadline for one query, seconds
+SEC_HTTP_TIMEOUT = 10.0  # connect / per-read timeout for SEC requests
+SEC_DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes read between deadline checks while downloading
+LLM_TIMEOUT = 15.0  # timeout for one LLM request
+
+# Cache configuration
+SUBMISSIONS_CACHE_TTL = 3600  # seconds a company's submissions index is reused before refetching
+FILING_CACHE_SIZE = 8  # filing documents kept in memory (a 10-K is typically several MB)
+FACTS_CACHE_SIZE = 256  # parsed filings (XBRL facts) kept in memory
+RESULT_CACHE_SIZE = 10000  # (ticker, metric, year, form_type) answers kept in memory
+COMPANY_FACTS_CACHE_SIZE = 16  # companyfacts documents kept in memory (several MB each for large filers)
+# Cache tier shared with other processes (see src/cache.py), behind the in-memory caches of submissions
+# indexes, filings, company facts, parsed XBRL facts and parsed intents:
+# "none", "sqlite" (all processes on one host) or "redis" (all hosts using the same Redis server)
+SHARED_CACHE = os.getenv("SHARED_CACHE", "none")
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "shared_cache.sqlite"
+))
+SHARED_CACHE_MAX_BYTES = 2 * 1024 ** 3  # oldest entries are dropped beyond this size
+SHARED_CACHE_LOCK_LEASE = 120.0  # seconds one process may hold a key's compute lock before others take over
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "insight:")
+REDIS_COMPRESS_MIN_BYTES = 1024  # values at least this large are stored zlib-compressed (filings shrink ~10x)
+
+# Batch query configuration
+BATCH_MAX_CONCURRENCY = 8  # max concurrent LLM calls / downloads / parses within one batch
+FAN_OUT_MAX_CONCURRENCY = 4  # max concurrent sub-requests for one multi-year / multi-metric query
+BULK_MAX_ITEMS = 10000  # max lookups accepted by one bulk API request
+FAN_OUT_MAX_REQUESTS = 50  # upper bound on sub-requests a single query may expand into
+
+# Intent parsing micro-batching: queries arriving within the window share one LLM call (0 disables)
+INTENT_BATCH_WINDOW_MS = float(os.getenv("INTENT_BATCH_WINDOW_MS", "0"))
+INTENT_BATCH_MAX_SIZE = 16  # max queries parsed by one LLM call
+
+# Reuse the intent of a previously parsed paraphrase (same company/year/metric in the text) instead of calling the LLM
+INTENT_INDEX_ENABLED = os.getenv("INTENT_INDEX", "1") != "0"
+INTENT_INDEX_THRESHOLD = float(os.getenv("INTENT_INDEX_THRESHOLD", "0.8"))  # min cosine similarity of char n-gram TF-IDF vectors
+INTENT_INDEX_SIZE = 2048  # parsed queries kept in the index
+
+# Start loading a company's SEC submissions as soon as the raw query names it, while the LLM is still parsing
+SPECULATIVE_PREFETCH = os.getenv("SPECULATIVE_PREFETCH", "1") != "0"
+
 # Supported tickers and their CIK mappings
 # CIKs must be 10 digits, padded with leading zeros
 TICKER_TO_CIK = {
@@ -35,11 +102,66 @@ TICKER_TO_CIK = {
     "NFLX": "0001065280"
 }
 
+# Company names (English and Chinese) recognized in free-text queries
+COMPANY_ALIASES = {
+    "AAPL": ["Apple", "苹果"],
+    "MSFT": ["Microsoft", "微软"],
+    "GOOGL": ["Google", "Alphabet", "谷歌"],
+    "AMZN": ["Amazon", "亚马逊"],
+    "TSLA": ["Tesla", "特斯拉"],
+    "META": ["Meta", "Facebook", "脸书"],
+    "NVDA": ["NVIDIA", "英伟达"],
+    "NFLX": ["Netflix", "奈飞", "网飞"]
+}
+
 # XBRL Configuration
 TARGET_XBRL_TAG = "us-gaap:Revenues"
 XBRL_PARSER = "lxml"  # BeautifulSoup parser
 
+# Workflow checkpointing: a query run with a request ID that fails or times out resumes at the failed node on retry
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "memory")  # "memory" or "sqlite"
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "checkpoints.sqlite"
+))
+# Memory backend only: checkpoints of failed queries are kept for retries up to this many request IDs and this long
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "1000"))
+CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", "3600"))  # seconds
+
+# Node-level retry of transient SEC errors (connection failures, timeouts, 429/5xx), with exponential backoff
+SEC_RETRY_MAX_ATTEMPTS = 3
+SEC_RETRY_INITIAL_INTERVAL = 0.5  # seconds before the first retry, doubled for each further attempt
+SEC_RETRY_MAX_INTERVAL = 8.0
+
+# Background jobs for batches too large to finish within one HTTP request (see src/jobs.py)
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "jobs.sqlite"
+))
+JOBS_RESULTS_DIR = os.getenv("JOBS_RESULTS_DIR", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "job_results"
+))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # worker threads per API process, each working on one filing at a time
+JOB_MAX_ITEMS = 100000
+JOB_MAX_ATTEMPTS = 3  # attempts per filing before its items are recorded as failed
+JOB_RETRY_INTERVAL = 5.0  # seconds before the first retry of a filing, doubled for each further attempt
+JOB_CLAIM_LEASE = 120.0  # seconds after which a filing claimed by a crashed or stopped worker is picked up again
+JOB_POLL_INTERVAL = 1.0  # seconds idle workers wait before looking for new work
+
+# Metric knowledge base (metric aliases and candidate XBRL tags)
+METRICS_KNOWLEDGE_BASE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "metrics_knowledge_base.json"
+)
+
 # API Configuration
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_WORKERS = int(os.getenv("API_WORKERS", "4"))  # uvicorn worker processes; caches are shared by all requests within a worker
+# HTTP caching of /get-metric answers; a past fiscal year only changes if the company files an amendment
+METRIC_CACHE_MAX_AGE_PAST = 86400  # seconds clients/proxies may reuse an answer for a completed fiscal year
+METRIC_CACHE_MAX_AGE_CURRENT = 300  # seconds for the current fiscal year (filings may still arrive)
+# Prometheus-style /metrics endpoint fed by the query traces (see src/monitoring.py)
+METRICS_ENABLED = os.getenv("METRICS", "1") != "0"
+# Upper bounds (seconds) of the latency histogram buckets
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
 API_TITLE = "InsightAgent MVP"
 API_VERSION = "1.0.0"
 API_DESCRIPTION = """
@@ -0,0 +1,113 @@
+"""
+Per-query deadlines and cooperative cancellation.
+
+A Deadline is activated for the duration of a query with deadline_scope(). It travels
+in a context variable, which asyncio and LangGraph copy into the worker threads that
+run sync nodes, so HTTP requests, LLM calls and parses deep in the call stack can cap
+their own timeouts with remaining_time() and stop at safe points with check_deadline().
+Code running outside any scope behaves exactly as before: no limits, checks are no-ops.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the current query's deadline has passed or the query was cancelled."""
+
+class Deadline:
+    """A point in time after which the work of one query should stop, plus a cancel switch."""
+
+    def __init__(self, timeout: Optional[float] = None, parent: Optional["Deadline"] = None):
+        """
+        Args:
+            timeout: Seconds from now until the deadline, None for no time limit
+            parent: Enclosing deadline; it caps this one and its cancellation applies here too
+        """
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout if timeout is not None else None
+        self.parent = parent
+        self._cancelled = threading.Event()
+
+        if parent is not None and parent.expires_at is not None and (
+            self.expires_at is None or parent.expires_at < self.expires_at
+        ):
+            self.expires_at = parent.expires_at
+            self.timeout = parent.timeout
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left (never negative), or None if there is no time limit."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def cancel(self) -> None:
+        """Cancels the query, e.g. because the client disconnected. Safe to call from any thread."""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    def expired(self) -> bool:
+        """Whether the work should stop (deadline passed or cancelled)."""
+        return self.cancelled or (self.expires_at is not None and time.monotonic() >= self.expires_at)
+
+    def check(self) -> None:
+        """
+        Raises:
+            DeadlineExceeded: If the query was cancelled or its deadline has passed
+        """
+        if self.cancelled:
+            raise DeadlineExceeded("Query was cancelled")
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            raise DeadlineExceeded(f"Query exceeded its deadline of {self.timeout}s")
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("insight_agent_deadline", default=None)
+
+def current_deadline() -> Optional[Deadline]:
+    """The deadline active in this context, if any."""
+    return _current_deadline.get()
+
+@contextmanager
+def deadline_scope(timeout: Optional[float]) -> Iterator[Deadline]:
+    """
+    Activates a deadline for the enclosed block. A nested scope never extends an
+    enclosing deadline: the earlier of the two applies, and cancelling the enclosing
+    deadline cancels the nested one too.
+    """
+    deadline = Deadline(timeout, parent=_current_deadline.get())
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+def check_deadline() -> None:
+    """
+    Raises DeadlineExceeded if the current query's deadline has passed or it was
+    cancelled. Does nothing outside a deadline scope.
+    """
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+def remaining_time(default: Optional[float] = None) -> Optional[float]:
+    """
+    Caps a timeout at the time left before the current deadline.
+
+    Args:
+        default: The timeout to use without a deadline (None for no timeout)
+
+    Returns:
+        The smaller of default and the remaining time; default outside a deadline scope
+    """
+    deadline = _current_deadline.get()
+    remaining = deadline.remaining() if deadline is not None else None
+    if remaining is None:
+        return default
+    if default is None:
+        return remaining
+    return min(default, remaining)
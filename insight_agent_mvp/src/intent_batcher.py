@@ -0,0 +1,129 @@
+"""
+Micro-batching of blocking calls.
+
+Callers submit items from any thread and block until their result is ready. The
+first item to arrive in an idle period opens a short window; when it closes, every
+item that arrived meanwhile (up to max_batch_size) goes to the batch handler in a
+single call, and a full batch is flushed immediately. Under light load a lone caller
+pays the window once; under bursty load many callers share one upstream request.
+
+The handler runs on a flusher thread of its own, outside every caller's context, so
+one caller's deadline or cancellation never fails the other items in its batch. It
+runs under a deadline scope lasting as long as the member with the most time left;
+each caller enforces its own deadline only while waiting for its result.
+"""
+
+import contextvars
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+from .deadline import deadline_scope
+
+class MicroBatcher:
+    """
+    Collects items submitted within a short window and processes them with one handler call.
+
+    The handler receives the list of items and must return one result per item, in
+    order. A result that is an Exception instance is raised to that item's caller only;
+    an exception raised by the handler itself is raised to every caller in the batch.
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], List[Any]], window: float, max_batch_size: int = 16):
+        """
+        Args:
+            handler: Processes a batch of items, returning one result per item
+            window: Seconds the first caller waits for more items before flushing
+            max_batch_size: Maximum items per handler call
+        """
+        self.handler = handler
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        # (item, future, expires_at) - expires_at is the caller's monotonic deadline, None for no limit
+        self._pending: List[Tuple[Any, Future, Optional[float]]] = []
+        self._window_open = False
+
+    def submit(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """
+        Adds item to the current batch and blocks until its result is available.
+
+        Args:
+            item: The item to process
+            timeout: Seconds this caller waits for its result; also how long the batch
+                handler may take on its behalf (None for no limit)
+
+        Raises:
+            concurrent.futures.TimeoutError: If the result is not ready within timeout seconds
+        """
+        future: Future = Future()
+        expires_at = time.monotonic() + timeout if timeout is not None else None
+
+        with self._lock:
+            self._pending.append((item, future, expires_at))
+            if len(self._pending) >= self.max_batch_size:
+                self._start_flusher(self._run, self._take_batch())
+            elif not self._window_open:
+                self._window_open = True
+                self._start_flusher(self._flush_window)
+
+        return future.result(timeout)
+
+    def _start_flusher(self, target: Callable, *args: Any) -> None:
+        """Runs target on a new daemon thread, in an empty context (no caller's deadline or trace)."""
+        context = contextvars.Context()
+        threading.Thread(target=context.run, args=(target, *args), daemon=True).start()
+
+    def _flush_window(self) -> None:
+        """Waits for the window to close, then processes what arrived during it."""
+        time.sleep(self.window)
+        with self._lock:
+            self._window_open = False
+            batch = self._take_batch()
+        if batch:
+            self._run(batch)
+        # Items left over beyond max_batch_size, or that arrived after the window closed
+        # but found it still marked open, have no window of their own.
+        self._flush_leftovers()
+
+    def _take_batch(self) -> List[Tuple[Any, Future, Optional[float]]]:
+        """Removes up to max_batch_size pending items. Caller holds _lock."""
+        batch = self._pending[:self.max_batch_size]
+        del self._pending[:self.max_batch_size]
+        return batch
+
+    def _flush_leftovers(self) -> None:
+        """Processes items that arrived after a window closed but found it still marked open."""
+        while True:
+            with self._lock:
+                if self._window_open or not self._pending:
+                    return
+                batch = self._take_batch()
+            self._run(batch)
+
+    def _run(self, batch: List[Tuple[Any, Future, Optional[float]]]) -> None:
+        items = [item for item, _, _ in batch]
+        try:
+            with deadline_scope(self._batch_timeout(batch)):
+                results = self.handler(items)
+            if len(results) != len(items):
+                raise ValueError(f"Batch handler returned {len(results)} results for {len(items)} items")
+        except BaseException as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    def _batch_timeout(batch: List[Tuple[Any, Future, Optional[float]]]) -> Optional[float]:
+        """Time left for the member of the batch that can wait longest (None if one has no limit)."""
+        deadlines = [expires_at for _, _, expires_at in batch]
+        if any(expires_at is None for expires_at in deadlines):
+            return None
+        return max(0.0, max(deadlines) - time.monotonic())
@@ -0,0 +1,191 @@
+"""
+Nearest-neighbour lookup of previously parsed intents.
+
+Many queries are paraphrases of ones already parsed ("Apple revenue 2023" vs "What
+was Apple's revenue in 2023?"). IntentIndex keeps past (query, intent) pairs as
+character n-gram TF-IDF vectors and answers a new query with a stored intent when the
+cosine similarity clears a threshold, so those paraphrases skip the LLM.
+
+Similarity alone is not trusted with the slots that change the answer: every query is
+keyed by the company, year, metric and form type that query_hints finds in its text,
+and only entries with exactly the same slots are compared. An entry is only stored when
+its slots agree with the parsed intent, so a hit can never swap "Apple 2023" for
+"Apple 2022" however similar the wording. Queries whose company, year or metric cannot
+be found in the text are neither stored nor matched: for them, "Apple total debt 2023"
+and "Apple total tax 2023" would share a slot and differ only in wording.
+"""
+
+import copy
+import math
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+from .metrics_manager import resolve_metric
+from .query_hints import detect_tickers, detect_years, detect_metrics, detect_form_type
+
+def normalize_query(query: str) -> str:
+    """Folds full-width characters and case and collapses whitespace."""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+def char_ngrams(text: str, sizes: Tuple[int, ...] = (2, 3, 4)) -> Counter:
+    """Counts the character n-grams of a normalized, space-padded query."""
+    padded = f" {normalize_query(text)} "
+    grams = Counter()
+    for size in sizes:
+        for i in range(len(padded) - size + 1):
+            grams[padded[i:i + size]] += 1
+    return grams
+
+def query_slots(query: str) -> Optional[Tuple[Hashable, ...]]:
+    """
+    The slots found literally in query: (tickers, years, metrics, form type).
+    Returns None when no company, year or known metric alias is mentioned; such
+    queries are never stored or matched.
+    """
+    tickers = detect_tickers(query)
+    years = detect_years(query)
+    metrics = detect_metrics(query)
+    if not tickers or not years or not metrics:
+        return None
+    return (
+        frozenset(tickers),
+        frozenset(years),
+        frozenset(metrics),
+        detect_form_type(query),
+    )
+
+def intent_slots(intent: Dict) -> Tuple[frozenset, frozenset, frozenset]:
+    """The (tickers, years, metrics) an intent asks for, in the same form as query_slots()."""
+    tickers = intent.get("tickers") or ([intent["ticker"]] if intent.get("ticker") else [])
+    if intent.get("years"):
+        years = intent["years"]
+    elif intent.get("start_year") and intent.get("end_year"):
+        years = range(int(intent["start_year"]), int(intent["end_year"]) + 1)
+    else:
+        years = [intent["year"]] if intent.get("year") else []
+    metrics = intent.get("metrics") or ([intent["metric"]] if intent.get("metric") else [])
+    return (
+        frozenset(str(ticker).upper() for ticker in tickers),
+        frozenset(int(year) for year in years),
+        frozenset(resolve_metric(metric) or metric for metric in metrics),
+    )
+
+class _Entry:
+    __slots__ = ("query", "intent", "slots", "grams")
+
+    def __init__(self, query: str, intent: Dict, slots: Tuple, grams: Counter):
+        self.query = query
+        self.intent = intent
+        self.slots = slots
+        self.grams = grams
+
+class IntentIndex:
+    """
+    Thread-safe, size-bounded index of parsed intents. The least recently matched
+    (or added) entry is evicted first once max_entries is reached.
+
+    IDF weights are recomputed from live document frequencies at lookup time, so
+    vectors never go stale as entries come and go.
+    """
+
+    def __init__(self, threshold: float = 0.8, max_entries: int = 2048):
+        """
+        Args:
+            threshold: Minimum cosine similarity for a stored intent to be reused
+            max_entries: Maximum number of stored queries
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._by_slots: Dict[Tuple, set] = {}
+        self._doc_freq: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _idf(self, gram: str) -> float:
+        return math.log((1 + len(self._entries)) / (1 + self._doc_freq[gram])) + 1
+
+    def _vector(self, grams: Counter) -> Dict[str, float]:
+        vector = {gram: count * self._idf(gram) for gram, count in grams.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {gram: weight / norm for gram, weight in vector.items()} if norm else {}
+
+    def add(self, query: str, intent: Dict) -> bool:
+        """
+        Stores a parsed intent. Error intents and intents whose company, year or metric
+        disagree with what the query text mentions are ignored.
+
+        Returns:
+            Whether the pair was stored
+        """
+        if not intent or "error" in intent:
+            return False
+        slots = query_slots(query)
+        if slots is None:
+            return False
+        tickers, years, metrics, _ = slots
+        intent_tickers, intent_years, intent_metrics = intent_slots(intent)
+        if tickers != intent_tickers or years != intent_years or metrics != intent_metrics:
+            return False
+
+        key = normalize_query(query)
+        grams = char_ngrams(query)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(query, copy.deepcopy(intent), slots, grams)
+            self._by_slots.setdefault(slots, set()).add(key)
+            self._doc_freq.update(grams.keys())
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+        return True
+
+    def _remove(self, key: str) -> None:
+        """Drops one entry. Caller holds _lock."""
+        entry = self._entries.pop(key)
+        bucket = self._by_slots[entry.slots]
+        bucket.discard(key)
+        if not bucket:
+            del self._by_slots[entry.slots]
+        self._doc_freq.subtract(entry.grams.keys())
+        for gram in entry.grams:
+            if self._doc_freq[gram] <= 0:
+                del self._doc_freq[gram]
+
+    def lookup(self, query: str) -> Optional[Tuple[Dict, float]]:
+        """
+        Finds the most similar stored query with the same slots.
+
+        Returns:
+            (copy of its intent, similarity), or None if nothing clears the threshold
+        """
+        slots = query_slots(query)
+        if slots is None:
+            return None
+
+        with self._lock:
+            keys = self._by_slots.get(slots)
+            if not keys:
+                return None
+            query_vector = self._vector(char_ngrams(query))
+            best_key, best_score = None, 0.0
+            for key in keys:
+                candidate = self._vector(self._entries[key].grams)
+                score = sum(weight * candidate.get(gram, 0.0) for gram, weight in query_vector.items())
+                if score > best_score:
+                    best_key, best_score = key, score
+            if best_key is None or best_score < self.threshold:
+                return None
+            self._entries.move_to_end(best_key)
+            return copy.deepcopy(self._entries[best_key].intent), best_score
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_slots.clear()
+            self._doc_freq.clear()
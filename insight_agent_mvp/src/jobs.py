@@ -0,0 +1,348 @@
+"""
+Background jobs for batches too large to finish within one HTTP request.
+
+A job is a list of items (one structured lookup each) stored in SQLite. Items are
+grouped by the filing they need, and a filing group is the unit of work: a worker
+claims one group, downloads and parses the filing once, and records a result row
+for every item in it. Because all state lives in the database, any number of worker
+threads in any number of API processes can share the queue, and a job interrupted
+by a restart continues where it stopped: a claim not completed within
+JOB_CLAIM_LEASE seconds (the worker crashed or was stopped) is handed out again.
+
+Workers call the same retriever and extractor as the API, so SEC traffic from jobs
+goes through the shared throttle, caches and admission limiter. When the last item
+is done, the rows are written in input order to an NDJSON results file.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+from .config import (
+    JOBS_DB_PATH,
+    JOBS_RESULTS_DIR,
+    JOB_WORKERS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_INTERVAL,
+    JOB_CLAIM_LEASE,
+    JOB_POLL_INTERVAL
+)
+
+# Turns the items of one filing group into result rows. Receives the group key and
+# (index, item) pairs; returns one row per item. Exceptions it raises are retried.
+GroupHandler = Callable[[Tuple, List[Tuple[int, Dict[str, Any]]]], List[Dict[str, Any]]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    result_path TEXT
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    group_key TEXT NOT NULL,
+    item TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    claimed_at REAL,
+    success INTEGER,
+    result TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS job_items_by_group ON job_items (job_id, group_key);
+CREATE INDEX IF NOT EXISTS job_items_by_status ON job_items (status, available_at);
+"""
+
+# Job statuses: queued (nothing claimed yet), running, completed, cancelled.
+# Item statuses: pending, claimed (a worker is on it), done.
+UNFINISHED = ("queued", "running")
+
+class JobStore:
+    """SQLite-backed job queue. Thread-safe; several processes may share one database file."""
+
+    def __init__(self, path: str = JOBS_DB_PATH, results_dir: str = JOBS_RESULTS_DIR):
+        """
+        Args:
+            path: SQLite database file, created if missing
+            results_dir: Directory for the NDJSON result files of completed jobs
+        """
+        self.path = path
+        self.results_dir = results_dir
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """This thread's connection (autocommit mode; transactions are opened explicitly)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """A write transaction; BEGIN IMMEDIATE keeps two workers from claiming the same group."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def create(self, items: Sequence[Tuple[Hashable, Dict[str, Any]]]) -> str:
+        """
+        Queues a job.
+
+        Args:
+            items: (group key, item) pairs; items with equal group keys are processed together.
+                   Group keys must be JSON-serializable.
+
+        Returns:
+            The job ID
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, total, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, len(items), now, now)
+            )
+            conn.executemany(
+                "INSERT INTO job_items (job_id, idx, group_key, item) VALUES (?, ?, ?, ?)",
+                (
+                    (job_id, index, json.dumps(group_key), json.dumps(item, ensure_ascii=False))
+                    for index, (group_key, item) in enumerate(items)
+                )
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status and progress of a job, or None if it does not exist."""
+        conn = self._connection()
+        job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        counts = conn.execute(
+            "SELECT COUNT(*) AS done, COALESCE(SUM(success = 0), 0) AS failed "
+            "FROM job_items WHERE job_id = ? AND status = 'done'",
+            (job_id,)
+        ).fetchone()
+        return {
+            "job_id": job_id,
+            "status": job["status"],
+            "total": job["total"],
+            "done": counts["done"],
+            "failed": counts["failed"],
+            "progress": round(counts["done"] / job["total"], 4) if job["total"] else 1.0,
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+            "result_path": job["result_path"],
+        }
+
+    def cancel(self, job_id: str) -> bool:
+        """Stops handing out work for a job. Groups already being processed still finish."""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status IN (?, ?)",
+                (time.time(), job_id, *UNFINISHED)
+            )
+        return cursor.rowcount > 0
+
+    def claim(self, lease: float = JOB_CLAIM_LEASE) -> Optional[Tuple[str, Tuple, List[Tuple[int, Dict[str, Any]]]]]:
+        """
+        Claims the next filing group: the oldest unfinished job first, groups in input order.
+
+        Returns:
+            (job ID, group key, [(index, item), ...]), or None if there is no work available
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT i.job_id, i.group_key FROM job_items i JOIN jobs j ON j.id = i.job_id "
+                "WHERE j.status IN (?, ?) AND i.available_at <= ? "
+                "AND (i.status = 'pending' OR (i.status = 'claimed' AND i.claimed_at < ?)) "
+                "ORDER BY j.created_at, i.idx LIMIT 1",
+                (*UNFINISHED, now, now - lease)
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, group_key = row["job_id"], row["group_key"]
+            conn.execute(
+                "UPDATE job_items SET status = 'claimed', claimed_at = ? "
+                "WHERE job_id = ? AND group_key = ? AND status != 'done'",
+                (now, job_id, group_key)
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+                (now, job_id)
+            )
+            items = conn.execute(
+                "SELECT idx, item FROM job_items WHERE job_id = ? AND group_key = ? AND status = 'claimed' ORDER BY idx",
+                (job_id, group_key)
+            ).fetchall()
+        return job_id, tuple(json.loads(group_key)), [(item["idx"], json.loads(item["item"])) for item in items]
+
+    def complete(self, job_id: str, rows: Sequence[Dict[str, Any]]) -> None:
+        """Records result rows (each with the item's 'index' and a 'success' flag)."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE job_items SET status = 'done', success = ?, result = ? WHERE job_id = ? AND idx = ?",
+                (
+                    (int(bool(row.get("success"))), json.dumps(row, ensure_ascii=False), job_id, row["index"])
+                    for row in rows
+                )
+            )
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now, job_id))
+
+    def retry_later(self, job_id: str, group_key: Tuple, delay: float) -> None:
+        """Releases a claimed group after a failed attempt so it is retried after delay seconds."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE job_items SET status = 'pending', attempts = attempts + 1, available_at = ? "
+                "WHERE job_id = ? AND group_key = ? AND status = 'claimed'",
+                (time.time() + delay, job_id, json.dumps(list(group_key)))
+            )
+
+    def attempts(self, job_id: str, group_key: Tuple) -> int:
+        """Failed attempts made on a group so far."""
+        row = self._connection().execute(
+            "SELECT MAX(attempts) AS attempts FROM job_items WHERE job_id = ? AND group_key = ?",
+            (job_id, json.dumps(list(group_key)))
+        ).fetchone()
+        return row["attempts"] or 0
+
+    def finish_if_done(self, job_id: str) -> bool:
+        """
+        Writes the results file and marks the job completed once every item is done.
+
+        Returns:
+            Whether the job is completed
+        """
+        conn = self._connection()
+        remaining = conn.execute(
+            "SELECT COUNT(*) FROM job_items WHERE job_id = ? AND status != 'done'", (job_id,)
+        ).fetchone()[0]
+        if remaining:
+            return False
+
+        # Written to a temporary file and renamed, so a reader never sees a partial file;
+        # two workers finishing the same job at once write identical contents.
+        os.makedirs(self.results_dir, exist_ok=True)
+        path = os.path.join(self.results_dir, f"{job_id}.ndjson")
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row in conn.execute("SELECT result FROM job_items WHERE job_id = ? ORDER BY idx", (job_id,)):
+                f.write(row["result"] + "\n")
+        os.replace(tmp_path, path)
+
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'completed', result_path = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+                (path, time.time(), job_id)
+            )
+        return True
+
+class JobRunner:
+    """A pool of worker threads executing the filing groups of queued jobs."""
+
+    def __init__(self, store: JobStore, handler: GroupHandler, workers: int = JOB_WORKERS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, retry_interval: float = JOB_RETRY_INTERVAL,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        """
+        Args:
+            store: The job queue
+            handler: Produces the result rows of one filing group (see GroupHandler)
+            workers: Number of worker threads
+            max_attempts: Attempts per group before its items are recorded as failed
+            retry_interval: Seconds before the first retry of a group, doubled for each further attempt
+            poll_interval: Seconds idle workers wait before looking for new work
+        """
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_interval = retry_interval
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """Starts the worker threads (no-op if already running)."""
+        if self._threads:
+            return
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stops the workers after their current group. Unfinished jobs resume on the next start."""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, items: Sequence[Tuple[Hashable, Dict[str, Any]]]) -> str:
+        """Queues a job (see JobStore.create) and wakes idle workers. Returns the job ID."""
+        job_id = self.store.create(items)
+        self._wakeup.set()
+        return job_id
+
+    def run_once(self) -> bool:
+        """
+        Claims and processes one filing group in the calling thread.
+
+        Returns:
+            Whether there was work to do
+        """
+        claimed = self.store.claim()
+        if claimed is None:
+            return False
+        job_id, group_key, items = claimed
+        try:
+            rows = self.handler(group_key, items)
+        except Exception as e:
+            attempts = self.store.attempts(job_id, group_key) + 1
+            if attempts < self.max_attempts:
+                delay = getattr(e, "retry_after", None) or self.retry_interval * 2 ** (attempts - 1)
+                self.store.retry_later(job_id, group_key, delay)
+                return True
+            rows = [{"index": index, **item, "error": str(e), "success": False} for index, item in items]
+
+        self.store.complete(job_id, rows)
+        self.store.finish_if_done(job_id)
+        return True
+
+    def _work(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception as e:
+                # A broken database must not kill the worker; try again after the poll interval
+                print(f"Warning: job worker failed: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
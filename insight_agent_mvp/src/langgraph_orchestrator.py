@@ -3,74 +3,386 @@
 更好的状态管理和工作流控制
 """
 
-from typing import TypedDict, Optional, Dict, Any
+from typing import TypedDict, Optional, Dict, Any, List, Tuple, Callable, AsyncIterator
+from contextlib import nullcontext, asynccontextmanager
+from contextvars import ContextVar
+from collections import OrderedDict
 from langgraph.graph import StateGraph, END
+from langgraph.types import RetryPolicy
+from langgraph.checkpoint.memory import MemorySaver
 from langchain.schema import HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
+import copy
+import asyncio
+import functools
 import json
+import threading
+import time
 
-from .sec_retriever import get_filing_html
-from .xbrl_extractor import extract_metric_from_html
-from .config import OPENAI_API_KEY, OPENAI_MODEL, OPENAI_TEMPERATURE, TICKER_TO_CIK
+from .cache import LRUCache, shared_backend
+from .telemetry import span, annotate, start_trace, has_sinks
+from .metrics_manager import get_tags_for_metric, record_tag_hit, resolve_metric, list_metrics
+from .llm_backends import create_llm
+from .intent_batcher import MicroBatcher
+from .intent_index import IntentIndex, normalize_query
+from .query_hints import detect_ticker, detect_years, detect_form_type
+from .deadline import deadline_scope, check_deadline, remaining_time
+from .admission import Overloaded, upstream_slot, check_admission
+from .sec_retriever import (
+    get_filing_html,
+    get_cached_filing_metadata,
+    ensure_filing_metadata,
+    find_latest_amendment,
+    get_amendment_html,
+    prefetch_filing_metadata,
+    get_company_facts,
+    is_transient_error,
+    clear_cache as clear_sec_cache
+)
+from .xbrl_extractor import (
+    extract_metric_from_html,
+    extract_facts_from_html,
+    find_company_fact,
+    extract_company_fact_series
+)
+from .config import (
+    OPENAI_MODEL,
+    TICKER_TO_CIK,
+    COMPANY_ALIASES,
+    FACTS_CACHE_SIZE,
+    RESULT_CACHE_SIZE,
+    BATCH_MAX_CONCURRENCY,
+    FAN_OUT_MAX_CONCURRENCY,
+    FAN_OUT_MAX_REQUESTS,
+    INTENT_BATCH_WINDOW_MS,
+    INTENT_BATCH_MAX_SIZE,
+    INTENT_INDEX_ENABLED,
+    INTENT_INDEX_THRESHOLD,
+    INTENT_INDEX_SIZE,
+    SPECULATIVE_PREFETCH,
+    QUERY_TIMEOUT,
+    CHECKPOINT_BACKEND,
+    CHECKPOINT_DB_PATH,
+    CHECKPOINT_MAX_THREADS,
+    CHECKPOINT_TTL,
+    SEC_RETRY_MAX_ATTEMPTS,
+    SEC_RETRY_INITIAL_INTERVAL,
+    SEC_RETRY_MAX_INTERVAL
+)
 
 class WorkflowState(TypedDict):
     """工作流状态"""
     query: str                    # 用户查询
     parsed_intent: Optional[Dict] # 解析的意图
-    html_content: Optional[str]   # SEC HTML内容
+    filing: Optional[Dict]        # 财报元数据（accession号、申报日期、URL等）；文档本身不放进状态，提取时从缓存读取
     extracted_value: Optional[Dict] # 提取的值
+    cache_hit: Optional[bool]     # 是否命中结果缓存
+    llm_usage: Optional[Dict]     # 意图解析的token用量
     error: Optional[str]          # 错误信息
     success: bool                 # 是否成功
 
-# LLM配置
-llm = ChatOpenAI(
-    model=OPENAI_MODEL,
-    temperature=OPENAI_TEMPERATURE,
-    openai_api_key=OPENAI_API_KEY
+# 已解析财报的XBRL事实缓存，键为 (ticker, year, form_type)；配置了SHARED_CACHE时与同机的其他进程共享
+# 事实的格式变化时命名空间加版本号，共享缓存中旧格式（未按scale换算的显示值）的条目不会再被读到
+_facts_cache = LRUCache(maxsize=FACTS_CACHE_SIZE, backend=shared_backend(), namespace="facts_v2")
+
+# 查询结果缓存，键为 (ticker, metric, year, form_type)
+_result_cache = LRUCache(maxsize=RESULT_CACHE_SIZE)
+
+def clear_caches() -> None:
+    """清空工作流使用的所有缓存（结果缓存、意图索引、XBRL事实缓存和SEC数据缓存）"""
+    _result_cache.clear()
+    _intent_index.clear()
+    _intent_cache.clear()
+    _facts_cache.clear()
+    clear_sec_cache()
+
+# LLM配置，后端由LLM_BACKEND决定（openai或离线的fake）。首次解析意图时才创建：
+# 没有配置OpenAI密钥时服务照常启动，不需要LLM的接口（结构化查询、批量、后台任务）不受影响
+llm = None
+_llm_lock = threading.Lock()
+
+def get_llm():
+    """意图解析使用的LLM，第一次调用时创建"""
+    global llm
+    if llm is None:
+        with _llm_lock:
+            if llm is None:
+                llm = create_llm()
+    return llm
+
+def _traced_node(name: str):
+    """给工作流节点加上计时span，未开启追踪时几乎没有开销"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(state):
+                with span(name):
+                    new_state = await func(state)
+                    annotate(success=new_state["success"])
+                    return new_state
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(state):
+            with span(name):
+                new_state = func(state)
+                annotate(success=new_state["success"])
+                return new_state
+        return wrapper
+    return decorator
+
+# 意图的结构化输出格式（函数调用参数），字段尽量少，说明尽量短
+INTENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ticker": {"type": "string", "description": "股票代码"},
+        "tickers": {"type": "array", "items": {"type": "string"}, "description": "多家公司对比时使用，代替ticker"},
+        "metric": {"type": "string"},
+        "metrics": {"type": "array", "items": {"type": "string"}, "description": "多个指标时使用，代替metric"},
+        "year": {"type": "integer"},
+        "years": {"type": "array", "items": {"type": "integer"}, "description": "多个年份时使用，代替year"},
+        "start_year": {"type": "integer"},
+        "end_year": {"type": "integer"},
+        "form_type": {"type": "string", "enum": ["10-K", "10-Q"]},
+        "series": {"type": "string", "enum": ["annual", "quarterly"], "description": "单个指标的走势（财年）"},
+        "error": {"type": "string", "description": "无法解析时填写，其余字段留空"}
+    }
+}
+
+INTENT_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "record_intent",
+        "description": "记录解析出的查询意图",
+        "parameters": INTENT_SCHEMA
+    }
+}
+
+BATCH_INTENT_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "record_intents",
+        "description": "按顺序记录每条查询解析出的意图",
+        "parameters": {
+            "type": "object",
+            "properties": {"intents": {"type": "array", "items": INTENT_SCHEMA}},
+            "required": ["intents"]
+        }
+    }
+}
+
+INTENT_SYSTEM_PROMPT = f"""解析用户的财务数据查询，调用record_intent返回意图。
+公司: {", ".join(f"{ticker}({'/'.join(names)})" for ticker, names in COMPANY_ALIASES.items())}
+指标: {", ".join(list_metrics())}
+年份缺省form_type为10-K；区间用start_year/end_year。无法理解时只填error="无法理解查询"。"""
+
+BATCH_INTENT_SYSTEM_PROMPT = INTENT_SYSTEM_PROMPT.replace(
+    "调用record_intent返回意图。",
+    "用户消息是互相独立的查询组成的JSON数组，调用record_intents按相同顺序返回每条查询的意图。"
 )
 
-def parse_intent_node(state: WorkflowState) -> WorkflowState:
-    """解析用户意图的节点"""
-    query = state["query"]
+def _llm_call_options(tool: Dict) -> Dict[str, Any]:
+    """
+    LLM调用参数：强制以函数调用返回结构化意图；
+    处于查询截止时间内时，把请求超时限制在剩余时间以内
+    """
+    check_deadline()
+    options = {
+        "tools": [tool],
+        "tool_choice": {"type": "function", "function": {"name": tool["function"]["name"]}}
+    }
+    timeout = remaining_time()
+    if timeout is not None:
+        options["timeout"] = timeout
+    return options
+
+def _response_arguments(response) -> Any:
+    """
+    取出LLM回复中的函数调用参数；模型没有调用函数时退回解析回复正文的JSON
     
-    system_prompt = """你是一个财务数据助手。用户会用自然语言询问公司财务数据。
+    Raises:
+        json.JSONDecodeError: 回复正文也不是有效JSON
+    """
+    tool_calls = getattr(response, "tool_calls", None)
+    if isinstance(tool_calls, list) and tool_calls:
+        return tool_calls[0]["args"]
+    return json.loads(response.content.strip())
 
-请解析用户查询并返回JSON格式的结构化信息：
-{
-    "ticker": "股票代码 (如AAPL, MSFT等)",
-    "metric": "财务指标 (如Revenues, NetIncome等)",
-    "year": "年份 (如2023, 2022等)",
-    "form_type": "财报类型 (10-K或10-Q，默认10-K)"
-}
+def _response_usage(response) -> Optional[Dict[str, int]]:
+    """LLM回复的token用量 {"input_tokens", "output_tokens", "total_tokens"}，后端不提供时为None"""
+    usage = getattr(response, "usage_metadata", None)
+    if not isinstance(usage, dict):
+        return None
+    usage = {key: int(usage.get(key) or 0) for key in ("input_tokens", "output_tokens", "total_tokens")}
+    annotate(**usage)
+    return usage
 
-支持的公司：Apple(AAPL), Microsoft(MSFT), Google(GOOGL), Amazon(AMZN), Tesla(TSLA), Meta(META), NVIDIA(NVDA), Netflix(NFLX)
-支持的指标：Revenues(收入), NetIncome(净利润), TotalAssets(总资产), TotalLiabilities(总负债), StockholdersEquity(股东权益)
+def _invoke_intent_llm(query: str) -> Tuple[Dict, Optional[Dict[str, int]]]:
+    """用单条查询调用LLM，返回 (意图, token用量)"""
+    messages = [
+        SystemMessage(content=INTENT_SYSTEM_PROMPT),
+        HumanMessage(content=query)
+    ]
+    with span("llm.invoke", model=OPENAI_MODEL), upstream_slot("llm"):
+        response = get_llm().invoke(messages, **_llm_call_options(INTENT_TOOL))
+        return _response_arguments(response), _response_usage(response)
 
-如果无法解析，返回：{"error": "无法理解查询"}
-"""
+def _parse_intent_batch(queries: List[str]) -> List[Any]:
+    """
+    一次LLM调用解析一批查询，返回与queries一一对应的 (意图, token用量)，token用量按条数均摊
     
+    回复的意图数与查询数不一致时，退回逐条解析；单条失败只影响该条查询。
+    """
+    if len(queries) == 1:
+        return [_invoke_intent_llm(queries[0])]
+    
+    messages = [
+        SystemMessage(content=BATCH_INTENT_SYSTEM_PROMPT),
+        HumanMessage(content=json.dumps(queries, ensure_ascii=False))
+    ]
     try:
-        messages = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=query)
-        ]
-        
-        response = llm.invoke(messages)
-        parsed_content = response.content.strip()
+        with span("llm.invoke", model=OPENAI_MODEL, batch_size=len(queries)), upstream_slot("llm"):
+            response = get_llm().invoke(messages, **_llm_call_options(BATCH_INTENT_TOOL))
+            arguments = _response_arguments(response)
+            usage = _response_usage(response)
+        intents = arguments.get("intents") if isinstance(arguments, dict) else arguments
+        if isinstance(intents, list) and len(intents) == len(queries):
+            share = {key: value // len(queries) for key, value in usage.items()} if usage else None
+            return [(intent, share) for intent in intents]
+    except Overloaded:
+        # LLM排队已满时逐条重试只会被同样拒绝
+        raise
+    except Exception as e:
+        print(f"Warning: batched intent parsing failed, falling back to single queries: {e}")
+    
+    results = []
+    for query in queries:
+        try:
+            results.append(_invoke_intent_llm(query))
+        except Exception as e:
+            results.append(e)
+    return results
+
+# 意图解析微批处理：窗口内到达的查询合并成一次LLM调用；窗口为0时不启用
+_intent_batcher = (
+    MicroBatcher(_parse_intent_batch, INTENT_BATCH_WINDOW_MS / 1000, INTENT_BATCH_MAX_SIZE)
+    if INTENT_BATCH_WINDOW_MS > 0 else None
+)
+
+# 已解析查询的相似度索引：换个说法的重复查询直接复用意图，不再调用LLM
+_intent_index = IntentIndex(INTENT_INDEX_THRESHOLD, INTENT_INDEX_SIZE)
+
+# 按规范化查询文本精确匹配的意图缓存；配置了SHARED_CACHE时其他进程解析过的查询也能命中
+_intent_cache = LRUCache(maxsize=INTENT_INDEX_SIZE, backend=shared_backend(), namespace="intent")
+
+def _lookup_similar_intent(query: str) -> Optional[Dict]:
+    """查找同一查询或公司、年份、指标一致且足够相似的已解析查询，返回其意图"""
+    if not INTENT_INDEX_ENABLED:
+        return None
+    with span("intent_index.lookup"):
+        cached = _intent_cache.get(normalize_query(query))
+        if cached is not None:
+            annotate(hit=True, exact=True)
+            return copy.deepcopy(cached)
+        match = _intent_index.lookup(query)
+        annotate(hit=match is not None)
+        if match is None:
+            return None
+        intent, similarity = match
+        annotate(similarity=round(similarity, 3))
+        return intent
+
+# 当前查询的预取信息（由_start_prefetch设置，parse_intent_node据此判断预取是否有用）
+_current_prefetch: ContextVar[Optional[Dict]] = ContextVar("insight_agent_prefetch", default=None)
+
+# 仍在运行的后台预取任务，保留强引用以免被垃圾回收
+_prefetch_tasks = set()
+
+def _start_prefetch(query: str) -> Optional[Dict]:
+    """
+    从原始查询文本中猜测公司（以及唯一的年份和财报类型），在LLM解析意图的同时
+    后台预取该公司的submissions索引和财报元数据，让两段最大的延迟重叠。
+    猜不出公司或未开启预取时返回None。
+    """
+    if not SPECULATIVE_PREFETCH:
+        return None
+    
+    ticker = detect_ticker(query)
+    if ticker is None:
+        return None
+    
+    years = detect_years(query)
+    prefetch = {
+        "ticker": ticker,
+        "year": years[0] if len(years) == 1 else None,
+        "form_type": detect_form_type(query),
+        "cancelled": threading.Event()
+    }
+    task = asyncio.ensure_future(asyncio.to_thread(
+        prefetch_filing_metadata,
+        prefetch["ticker"],
+        prefetch["year"],
+        prefetch["form_type"],
+        prefetch["cancelled"].is_set
+    ))
+    _prefetch_tasks.add(task)
+    task.add_done_callback(_prefetch_tasks.discard)
+    return prefetch
+
+def _settle_prefetch(prefetch: Optional[Dict], intent: Optional[Dict]) -> None:
+    """意图解析完成后核对预取的猜测；与解析结果不一致（或解析失败）时放弃剩余的预取工作"""
+    if prefetch is None:
+        return
+    
+    matches = False
+    tickers = (intent.get("tickers") or [intent.get("ticker")]) if intent else []
+    if prefetch["ticker"] in [str(ticker or "").upper() for ticker in tickers]:
+        matches = prefetch["year"] is None or (
+            str(intent.get("year")) == str(prefetch["year"])
+            and intent.get("form_type", "10-K") == prefetch["form_type"]
+        )
+    if not matches:
+        prefetch["cancelled"].set()
+    annotate(prefetch="used" if matches else "discarded")
+
+@_traced_node("parse_intent")
+def parse_intent_node(state: WorkflowState) -> WorkflowState:
+    """解析用户意图的节点"""
+    query = state["query"]
+    
+    try:
+        cached_intent = _lookup_similar_intent(query)
+        if cached_intent is not None:
+            _settle_prefetch(_current_prefetch.get(), cached_intent)
+            return {
+                **state,
+                "parsed_intent": cached_intent,
+                "success": True
+            }
         
-        # 尝试解析JSON
+        # 结构化输出：意图直接来自函数调用参数
         try:
-            parsed_intent = json.loads(parsed_content)
+            if _intent_batcher is not None:
+                with span("intent_batch"):
+                    parsed_intent, llm_usage = _intent_batcher.submit(query, timeout=remaining_time())
+            else:
+                parsed_intent, llm_usage = _invoke_intent_llm(query)
+            
+            _settle_prefetch(_current_prefetch.get(), None if "error" in parsed_intent else parsed_intent)
             if "error" in parsed_intent:
                 return {
                     **state,
+                    "llm_usage": llm_usage,
                     "error": parsed_intent["error"],
                     "success": False
                 }
             else:
+                # 只缓存与查询文本中的公司、年份、指标一致的意图
+                if INTENT_INDEX_ENABLED and _intent_index.add(query, parsed_intent):
+                    _intent_cache.set(normalize_query(query), copy.deepcopy(parsed_intent))
                 return {
                     **state,
                     "parsed_intent": parsed_intent,
+                    "llm_usage": llm_usage,
                     "success": True
                 }
         except json.JSONDecodeError:
@@ -79,7 +391,10 @@ def parse_intent_node(state: WorkflowState) -> WorkflowState:
                 "error": "LLM返回的不是有效JSON格式",
                 "success": False
             }
-            
+    
+    except Overloaded:
+        # 交给调用方按限流处理（API返回429）
+        raise
     except Exception as e:
         return {
             **state,
@@ -87,6 +402,101 @@ def parse_intent_node(state: WorkflowState) -> WorkflowState:
             "success": False
         }
 
+def _get_filing_key(intent: Dict) -> Tuple[str, int, str]:
+    """从意图中取出定位财报所需的 (ticker, year, form_type)"""
+    ticker = intent["ticker"]
+    year = int(intent["year"])  # 确保年份是整数
+    form_type = intent.get("form_type", "10-K")
+    return ticker, year, form_type
+
+def _result_cache_key(intent: Dict) -> Tuple[str, str, int, str]:
+    """结果缓存的键 (ticker, metric, year, form_type)，指标的不同别名共用同一个键"""
+    ticker, year, form_type = _get_filing_key(intent)
+    metric = resolve_metric(intent["metric"]) or intent["metric"]
+    return ticker.upper(), metric, year, form_type
+
+def _latest_amendment_accession(ticker: str, year: int, form_type: str) -> Optional[str]:
+    """该财报当前最新修订版（如10-K/A）的accession号，没有修订版时为None"""
+    amendment = find_latest_amendment(ticker, year, form_type)
+    return amendment["accession_number"] if amendment else None
+
+def _find_amendment(ticker: str, year: int, form_type: str) -> Optional[Dict]:
+    """该财报最新修订版的元数据；没有修订版或暂时无法查询时为None（之后命中缓存时会再检查）"""
+    try:
+        return find_latest_amendment(ticker, year, form_type)
+    except Exception as e:
+        annotate(amendment_error=type(e).__name__)
+        return None
+
+def _get_cached_result(intent: Dict) -> Optional[Dict]:
+    """
+    查询结果缓存
+    
+    缓存条目记录了提取时该财报最新修订版的accession号（提取时已优先使用修订版中的数据）；
+    如果之后又出现了新的修订版，条目失效并返回None，重新提取时会读取新的修订版。
+    """
+    try:
+        ticker, metric, year, form_type = key = _result_cache_key(intent)
+    except Exception:
+        return None
+    
+    entry = _result_cache.get(key)
+    if entry is None:
+        return None
+    
+    try:
+        amendment = _latest_amendment_accession(ticker, year, form_type)
+    except Exception:
+        # 暂时无法确认是否有新的修订版时，继续使用缓存结果
+        return entry
+    
+    if amendment != entry["amendment"]:
+        _result_cache.delete(key)
+        return None
+    
+    return entry
+
+def _cache_result(intent: Dict, extracted_value: Dict, filing: Optional[Dict]) -> None:
+    """
+    缓存一次成功的提取结果；只有知道来源财报时才缓存，以便之后判断修订版
+    
+    filing["amendment"]是提取时读取的修订版，没有这一项表示提取时没有修订版。
+    """
+    if not filing or not filing.get("accession_number"):
+        return
+    
+    try:
+        key = _result_cache_key(intent)
+    except Exception:
+        return
+    
+    _result_cache.set(key, {
+        "extracted_value": extracted_value,
+        "filing": filing,
+        "amendment": (filing.get("amendment") or {}).get("accession_number")
+    })
+
+@_traced_node("check_result_cache")
+def check_result_cache_node(state: WorkflowState) -> WorkflowState:
+    """结果缓存节点：命中时直接写入结果，跳过SEC检索和XBRL提取"""
+    if not state["success"] or not state["parsed_intent"]:
+        return state
+    
+    entry = _get_cached_result(state["parsed_intent"])
+    annotate(cache="miss" if entry is None else "hit")
+    if entry is None:
+        return {**state, "cache_hit": False}
+    
+    return {
+        **state,
+        "filing": entry["filing"],
+        # 缓存键按规范指标名归一，返回时沿用本次查询的指标写法
+        "extracted_value": {**entry["extracted_value"], "metric": state["parsed_intent"]["metric"]},
+        "cache_hit": True,
+        "success": True
+    }
+
+@_traced_node("retrieve_sec_data")
 def retrieve_sec_data_node(state: WorkflowState) -> WorkflowState:
     """检索SEC数据的节点"""
     if not state["success"] or not state["parsed_intent"]:
@@ -95,9 +505,7 @@ def retrieve_sec_data_node(state: WorkflowState) -> WorkflowState:
     intent = state["parsed_intent"]
     
     try:
-        ticker = intent["ticker"]
-        year = int(intent["year"])  # 确保年份是整数
-        form_type = intent.get("form_type", "10-K")
+        ticker, year, form_type = _get_filing_key(intent)
         
         # 验证ticker
         if ticker not in TICKER_TO_CIK:
@@ -107,68 +515,94 @@ def retrieve_sec_data_node(state: WorkflowState) -> WorkflowState:
                 "success": False
             }
         
-        # 检索SEC数据
+        # 检索SEC数据；文档留在财报缓存中，状态（及检查点）里只保存财报元数据
         html_content = get_filing_html(ticker, year, form_type)
         
+        filing = {
+            "ticker": ticker,
+            "year": year,
+            "form_type": form_type,
+            **(get_cached_filing_metadata(ticker, year, form_type) or {}),
+            "size": len(html_content)
+        }
+        
+        # 有修订版（如10-K/A）时一并下载，提取时优先使用其中的数据
+        amendment = _find_amendment(ticker, year, form_type)
+        if amendment is not None:
+            get_amendment_html(ticker, amendment)
+            filing["amendment"] = amendment
+        
         return {
             **state,
-            "html_content": html_content,
+            "filing": filing,
             "success": True
         }
         
     except Exception as e:
+        # 网络抖动、限流等暂时性错误交给节点重试策略（SEC_RETRY_POLICY）；上游过载交给调用方
+        if is_transient_error(e) or isinstance(e, Overloaded):
+            raise
         return {
             **state,
             "error": f"SEC数据检索失败: {str(e)}",
             "success": False
         }
 
-def extract_xbrl_data_node(state: WorkflowState) -> WorkflowState:
-    """提取XBRL数据的节点"""
-    if not state["success"] or not state["html_content"] or not state["parsed_intent"]:
-        return state
+def _candidate_tags(metric_tags: List[str]) -> List[str]:
+    """候选标签补全命名空间：不带前缀的标签按us-gaap处理"""
+    return [tag if ":" in tag else f"us-gaap:{tag}" for tag in metric_tags]
+
+def _filing_sources(
+    filing: Optional[Dict],
+    original: Callable[[str], Optional[Tuple[str, str]]],
+    amended: Optional[Callable[[str], Optional[Tuple[str, str]]]] = None
+) -> List[Tuple[Optional[str], Callable[[str], Optional[Tuple[str, str]]]]]:
+    """
+    提取时依次查找的 (accession号, lookup)：先查修订版，修订版中没有该标签时退回原始财报
+    （10-K/A常常只修改部分章节，不含财务数据）
+    """
+    filing = filing or {}
+    sources = [(filing.get("accession_number"), original)]
+    if amended is not None and filing.get("amendment"):
+        sources.insert(0, (filing["amendment"]["accession_number"], amended))
+    return sources
+
+def _extract_metric_into_state(
+    state: WorkflowState,
+    sources: List[Tuple[Optional[str], Callable[[str], Optional[Tuple[str, str]]]]]
+) -> WorkflowState:
+    """
+    按指标知识库给出的候选XBRL标签依次尝试，把提取结果写回状态
+    sources是 (accession号, lookup) 列表，lookup负责在一份财报中按标签查找 (value, unit)；
+    同一标签按列表顺序查找，结果中的accession_number是命中的那份财报
     
+    候选标签按该公司过往财报中实际命中的次数排序，命中后记录下来供下次优先尝试。
+    """
     intent = state["parsed_intent"]
-    html_content = state["html_content"]
-    
-    # 指标映射 - 支持多种可能的标签
-    METRIC_TAG_MAPPING = {
-        "Revenues": ["us-gaap:Revenues", "us-gaap:RevenueFromContractWithCustomerExcludingAssessedTax"],
-        "Revenue": ["us-gaap:Revenues", "us-gaap:RevenueFromContractWithCustomerExcludingAssessedTax"], 
-        "NetIncome": ["us-gaap:NetIncomeLoss"],
-        "Net Income": ["us-gaap:NetIncomeLoss"],
-        "TotalAssets": ["us-gaap:Assets"],
-        "Total Assets": ["us-gaap:Assets"],
-        "TotalLiabilities": ["us-gaap:Liabilities"],
-        "Total Liabilities": ["us-gaap:Liabilities"],
-        "StockholdersEquity": ["us-gaap:StockholdersEquity"],
-        "Stockholders Equity": ["us-gaap:StockholdersEquity"],
-    }
     
     try:
         metric = intent["metric"]
-        metric_tags = METRIC_TAG_MAPPING.get(metric, [metric])
-        
-        # 如果是字符串，转换为列表
-        if isinstance(metric_tags, str):
-            metric_tags = [metric_tags]
+        metric_tags = get_tags_for_metric(metric, intent.get("ticker"))
         
         # 尝试所有可能的标签
         result = None
         used_tag = None
+        used_accession = None
+        tags_tried = []
         
-        for metric_tag in metric_tags:
-            # 如果不是标准XBRL标签，尝试添加前缀
-            if not metric_tag.startswith("us-gaap:"):
-                if ":" not in metric_tag:
-                    metric_tag = f"us-gaap:{metric_tag}"
-            
+        for metric_tag in _candidate_tags(metric_tags):
             # 提取数据
-            result = extract_metric_from_html(html_content, metric_tag)
+            tags_tried.append(metric_tag)
+            for accession_number, lookup in sources:
+                result = lookup(metric_tag)
+                if result is not None:
+                    used_tag, used_accession = metric_tag, accession_number
+                    break
             if result is not None:
-                used_tag = metric_tag
                 break
         
+        annotate(metric=metric, tags_tried=tags_tried, xbrl_tag=used_tag)
+        
         if result is None:
             attempted_tags = ", ".join(metric_tags)
             return {
@@ -178,6 +612,7 @@ def extract_xbrl_data_node(state: WorkflowState) -> WorkflowState:
             }
         
         value, unit = result
+        record_tag_hit(intent["ticker"], metric, used_tag)
         
         extracted_value = {
             "ticker": intent["ticker"],
@@ -186,7 +621,8 @@ def extract_xbrl_data_node(state: WorkflowState) -> WorkflowState:
             "year": intent["year"],
             "form_type": intent.get("form_type", "10-K"),
             "value": value,
-            "unit": unit
+            "unit": unit,
+            "accession_number": used_accession
         }
         
         return {
@@ -202,6 +638,441 @@ def extract_xbrl_data_node(state: WorkflowState) -> WorkflowState:
             "success": False
         }
 
+@_traced_node("extract_xbrl_data")
+def extract_xbrl_data_node(state: WorkflowState) -> WorkflowState:
+    """提取XBRL数据的节点"""
+    if not state["success"] or not state.get("filing") or not state["parsed_intent"]:
+        return state
+    
+    # 检索节点刚下载过，通常命中缓存；从检查点恢复时可能需要重新下载
+    filing = state["filing"]
+    html_content = get_filing_html(filing["ticker"], filing["year"], filing["form_type"])
+    amended_html = get_amendment_html(filing["ticker"], filing["amendment"]) if filing.get("amendment") else None
+    
+    new_state = _extract_metric_into_state(state, _filing_sources(
+        filing,
+        lambda metric_tag: extract_metric_from_html(html_content, metric_tag),
+        lambda metric_tag: extract_metric_from_html(amended_html, metric_tag)
+    ))
+    if new_state["success"]:
+        _cache_result(new_state["parsed_intent"], new_state["extracted_value"], new_state.get("filing"))
+    
+    return new_state
+
+def expand_intent(intent: Dict) -> List[Dict]:
+    """
+    把意图展开成单点子意图列表
+    
+    "tickers" 列表、"metrics" 列表与 "years" 列表（或 "start_year"/"end_year" 区间）做笛卡尔积，
+    单公司、单指标、单年份的意图原样返回一个元素。
+    """
+    tickers = intent.get("tickers") or [intent.get("ticker")]
+    metrics = intent.get("metrics") or [intent.get("metric")]
+    
+    if intent.get("years"):
+        years = intent["years"]
+    elif intent.get("start_year") is not None and intent.get("end_year") is not None:
+        start_year, end_year = int(intent["start_year"]), int(intent["end_year"])
+        if start_year > end_year:
+            start_year, end_year = end_year, start_year
+        years = list(range(start_year, end_year + 1))
+    else:
+        years = [intent.get("year")]
+    
+    sub_requests = len(tickers) * len(metrics) * len(years)
+    if sub_requests > FAN_OUT_MAX_REQUESTS:
+        raise ValueError(f"查询展开后的子请求过多: {sub_requests} (上限 {FAN_OUT_MAX_REQUESTS})")
+    
+    return [
+        {
+            "ticker": ticker,
+            "metric": metric,
+            "year": year,
+            "form_type": intent.get("form_type", "10-K")
+        }
+        for ticker in tickers
+        for metric in metrics
+        for year in years
+    ]
+
+def load_filing_facts(filing_key: Tuple[str, int, str]) -> Dict[str, Dict[str, Optional[str]]]:
+    """下载并解析一份财报，返回其全部XBRL事实（带缓存，同一财报的并发请求只加载一次）"""
+    with span("facts.load"):
+        loaded = []
+        
+        def load():
+            loaded.append(True)
+            return extract_facts_from_html(get_filing_html(*filing_key))
+        
+        facts = _facts_cache.get_or_compute(filing_key, load)
+        annotate(cache="miss" if loaded else "hit")
+        if not loaded:
+            # 共享缓存命中时本进程可能没有财报元数据，ETag和结果缓存都依赖它
+            ensure_filing_metadata(*filing_key)
+        return facts
+
+def load_amendment_facts(ticker: str, amendment: Dict) -> Dict[str, Dict[str, Optional[str]]]:
+    """下载并解析一份修订版，返回其全部XBRL事实（按accession号缓存，修订版发布后不会再变）"""
+    with span("facts.load_amendment", accession_number=amendment["accession_number"]):
+        return _facts_cache.get_or_compute(
+            (ticker.upper(), amendment["accession_number"]),
+            lambda: extract_facts_from_html(get_amendment_html(ticker, amendment))
+        )
+
+def warm_filing_facts(filing_keys: List[Tuple[str, int, str]]) -> None:
+    """把共享缓存中已有的多份财报的XBRL事实一次性取到进程内缓存（一次往返，而不是每份财报一次）"""
+    if len(filing_keys) > 1:
+        _facts_cache.get_many(filing_keys)
+
+async def _run_bounded(semaphore: asyncio.Semaphore, func, *args):
+    """在并发上限内把同步函数放到线程中执行"""
+    async with semaphore:
+        return await asyncio.to_thread(func, *args)
+
+async def _lookup_states(states: List[WorkflowState], semaphore: asyncio.Semaphore) -> List[WorkflowState]:
+    """
+    对一组已解析出单点意图的状态执行检索与提取
+    
+    按 (ticker, year, form_type) 分组，每份财报只加载一次，再把结果写回各自的状态；
+    未成功解析的状态原样返回。
+    """
+    # 1. 先查结果缓存
+    states = list(await asyncio.gather(*(
+        _run_bounded(semaphore, check_result_cache_node, state) for state in states
+    )))
+    
+    # 2. 未命中的按财报分组
+    groups: Dict[Tuple[str, int, str], List[int]] = {}
+    for index, state in enumerate(states):
+        if not state["success"] or not state["parsed_intent"] or state.get("cache_hit"):
+            continue
+        try:
+            filing_key = _get_filing_key(state["parsed_intent"])
+        except Exception as e:
+            states[index] = {**state, "error": f"SEC数据检索失败: {str(e)}", "success": False}
+            continue
+        if filing_key[0] not in TICKER_TO_CIK:
+            states[index] = {**state, "error": f"不支持的股票代码: {filing_key[0]}", "success": False}
+            continue
+        groups.setdefault(filing_key, []).append(index)
+    
+    # 3. 每份财报（及其最新修订版）只下载、解析一次
+    def load_with_amendment(filing_key):
+        facts = load_filing_facts(filing_key)
+        amendment = _find_amendment(*filing_key)
+        amended_facts = load_amendment_facts(filing_key[0], amendment) if amendment else {}
+        return facts, amendment, amended_facts
+    
+    async def load_facts(filing_key):
+        try:
+            return await _run_bounded(semaphore, load_with_amendment, filing_key), None
+        except Exception as e:
+            return None, f"SEC数据检索失败: {str(e)}"
+    
+    filing_keys = list(groups)
+    await asyncio.to_thread(warm_filing_facts, filing_keys)
+    loaded = await asyncio.gather(*(load_facts(filing_key) for filing_key in filing_keys))
+    
+    # 4. 把结果分发回各个状态
+    def fact_lookup(facts):
+        return lambda metric_tag: (
+            (facts[metric_tag]["value"], facts[metric_tag]["unit"])
+            if metric_tag in facts else None
+        )
+    
+    for filing_key, (result, error) in zip(filing_keys, loaded):
+        facts, amendment, amended_facts = result or ({}, None, {})
+        filing = get_cached_filing_metadata(*filing_key)
+        if filing is not None and amendment is not None:
+            filing = {**filing, "amendment": amendment}
+        for index in groups[filing_key]:
+            if error:
+                states[index] = {**states[index], "error": error, "success": False}
+                continue
+            states[index] = _extract_metric_into_state(
+                {**states[index], "filing": filing},
+                _filing_sources(filing, fact_lookup(facts), fact_lookup(amended_facts))
+            )
+            if states[index]["success"]:
+                _cache_result(states[index]["parsed_intent"], states[index]["extracted_value"], filing)
+    
+    return states
+
+def _row_from_company_facts(company_facts: Dict, sub_intent: Dict) -> Optional[Dict]:
+    """从公司事实数据中取出一个单点子意图的值，找不到时返回None"""
+    ticker, metric = sub_intent["ticker"], sub_intent["metric"]
+    year, form_type = int(sub_intent["year"]), sub_intent.get("form_type", "10-K")
+    
+    for metric_tag in _candidate_tags(get_tags_for_metric(metric, ticker)):
+        fact = find_company_fact(company_facts, metric_tag, year, form_type)
+        if fact is None:
+            continue
+        record_tag_hit(ticker, metric, metric_tag)
+        return {
+            "ticker": ticker,
+            "metric": metric,
+            "xbrl_tag": metric_tag,
+            "year": year,
+            "form_type": form_type,
+            "value": fact["value"],
+            "unit": fact["unit"],
+            "period_end": fact["end"],
+            "accession_number": fact["accession_number"],
+            "source": "companyfacts"
+        }
+    return None
+
+async def _compare_company(
+    query: str,
+    ticker: str,
+    sub_intents: List[Dict],
+    semaphore: asyncio.Semaphore
+) -> Tuple[List[Dict], float]:
+    """
+    对比模式下处理一家公司的全部子意图，返回 (各行结果, 耗时毫秒)
+    
+    优先用一次公司事实（companyfacts）请求回答该公司的所有指标和年份；
+    请求失败或其中缺少某个值时，这些子意图退回按财报下载解析。
+    """
+    start = time.perf_counter()
+    with span("compare.company", ticker=ticker):
+        company_facts = None
+        if ticker in TICKER_TO_CIK:
+            try:
+                company_facts = await _run_bounded(semaphore, get_company_facts, ticker)
+            except Exception as e:
+                annotate(company_facts_error=str(e))
+        
+        rows: List[Optional[Dict]] = [
+            _row_from_company_facts(company_facts, sub_intent) if company_facts else None
+            for sub_intent in sub_intents
+        ]
+        
+        pending = [index for index, row in enumerate(rows) if row is None]
+        annotate(from_company_facts=len(rows) - len(pending), from_filings=len(pending))
+        if pending:
+            sub_states = await _lookup_states(
+                [
+                    {**_create_initial_state(query), "parsed_intent": sub_intents[index], "success": True}
+                    for index in pending
+                ],
+                semaphore
+            )
+            for index, sub_state in zip(pending, sub_states):
+                if sub_state["success"]:
+                    rows[index] = sub_state["extracted_value"]
+                else:
+                    rows[index] = {**sub_intents[index], "error": sub_state["error"]}
+    
+    return rows, (time.perf_counter() - start) * 1000
+
+async def _fan_out(state: WorkflowState, semaphore: asyncio.Semaphore) -> WorkflowState:
+    """
+    把多公司/多指标/多年份意图展开成子请求并发执行，汇总成一张表写入extracted_value
+    
+    多家公司对比时各公司并行处理（共享SEC限速和缓存），表中另附按 (指标, 年份)
+    对齐的各公司数值 "comparison" 和每家公司的耗时 "timings_ms"。
+    """
+    intent = state["parsed_intent"]
+    
+    try:
+        sub_intents = expand_intent(intent)
+    except Exception as e:
+        return {**state, "error": f"意图展开失败: {str(e)}", "success": False}
+    
+    annotate(sub_requests=len(sub_intents))
+    tickers = list(dict.fromkeys(sub_intent["ticker"] for sub_intent in sub_intents))
+    timings_ms = None
+    
+    if len(tickers) > 1:
+        companies = await asyncio.gather(*(
+            _compare_company(
+                state["query"],
+                ticker,
+                [sub_intent for sub_intent in sub_intents if sub_intent["ticker"] == ticker],
+                semaphore
+            )
+            for ticker in tickers
+        ))
+        rows = [row for company_rows, _ in companies for row in company_rows]
+        timings_ms = {ticker: round(elapsed, 1) for ticker, (_, elapsed) in zip(tickers, companies)}
+    else:
+        sub_states = await _lookup_states(
+            [
+                {**_create_initial_state(state["query"]), "parsed_intent": sub_intent, "success": True}
+                for sub_intent in sub_intents
+            ],
+            semaphore
+        )
+        
+        rows = []
+        for sub_intent, sub_state in zip(sub_intents, sub_states):
+            if sub_state["success"]:
+                rows.append(sub_state["extracted_value"])
+            else:
+                rows.append({**sub_intent, "error": sub_state["error"]})
+    
+    if not any("error" not in row for row in rows):
+        return {**state, "error": rows[0]["error"], "success": False}
+    
+    metrics = list(dict.fromkeys(row["metric"] for row in rows))
+    years = list(dict.fromkeys(row["year"] for row in rows))
+    extracted_value = {
+        "ticker": intent.get("ticker"),
+        "tickers": tickers,
+        "form_type": intent.get("form_type", "10-K"),
+        "metrics": metrics,
+        "years": years,
+        "rows": rows
+    }
+    
+    if timings_ms is not None:
+        values = {(row["ticker"], row["metric"], row["year"]): row.get("value") for row in rows}
+        extracted_value["comparison"] = [
+            {
+                "metric": metric,
+                "year": year,
+                "values": {ticker: values.get((ticker, metric, year)) for ticker in tickers}
+            }
+            for metric in metrics
+            for year in years
+        ]
+        extracted_value["timings_ms"] = timings_ms
+    
+    return {
+        **state,
+        "extracted_value": extracted_value,
+        "success": True
+    }
+
+@_traced_node("fan_out")
+async def fan_out_node(state: WorkflowState) -> WorkflowState:
+    """扇出节点：并发执行多公司/多指标/多年份子请求（共享SEC限速和财报缓存），返回一张汇总表"""
+    if not state["success"] or not state["parsed_intent"]:
+        return state
+    
+    return await _fan_out(state, asyncio.Semaphore(FAN_OUT_MAX_CONCURRENCY))
+
+def get_metric_time_series(
+    ticker: str,
+    metric: str,
+    start_year: Optional[int] = None,
+    end_year: Optional[int] = None,
+    period: str = "annual"
+) -> Dict[str, Any]:
+    """
+    返回某公司某指标在一段财年内的时间序列
+    
+    只加载一次该公司的companyfacts数据再按财年/季度切片，因此10年的序列与单个数据点的开销相当。
+    公司在不同年份使用过不同的XBRL标签时，按指标知识库的候选标签顺序逐个财期合并，
+    每个数据点注明实际使用的标签。
+    
+    Args:
+        ticker: 股票代码
+        metric: 指标名称或别名
+        start_year: 起始财年（含），None表示不限
+        end_year: 结束财年（含），None表示不限
+        period: "annual"（按财年）或 "quarterly"（按季度）
+    
+    Raises:
+        ValueError: 不支持的股票代码或period
+        FileNotFoundError: 该范围内没有数据
+    """
+    ticker = ticker.upper()
+    if ticker not in TICKER_TO_CIK:
+        raise ValueError(f"不支持的股票代码: {ticker}")
+    if start_year is not None and end_year is not None and int(start_year) > int(end_year):
+        start_year, end_year = end_year, start_year
+    
+    company_facts = get_company_facts(ticker)
+    
+    points: Dict[Tuple[int, str], Dict] = {}
+    tags_used = []
+    for metric_tag in _candidate_tags(get_tags_for_metric(metric, ticker)):
+        for point in extract_company_fact_series(company_facts, metric_tag, period):
+            if start_year is not None and point["fiscal_year"] < int(start_year):
+                continue
+            if end_year is not None and point["fiscal_year"] > int(end_year):
+                continue
+            key = (point["fiscal_year"], point["fiscal_period"])
+            if key not in points:
+                points[key] = {**point, "xbrl_tag": metric_tag}
+                if metric_tag not in tags_used:
+                    tags_used.append(metric_tag)
+    
+    annotate(points=len(points), tags_used=tags_used)
+    if not points:
+        raise FileNotFoundError(f"没有找到 {ticker} 的 {metric} 数据 ({start_year}-{end_year})")
+    
+    for metric_tag in tags_used:
+        record_tag_hit(ticker, metric, metric_tag)
+    
+    return {
+        "ticker": ticker,
+        "metric": metric,
+        "period": period,
+        "start_year": start_year,
+        "end_year": end_year,
+        "points": [points[key] for key in sorted(points)]
+    }
+
+@_traced_node("time_series")
+def time_series_node(state: WorkflowState) -> WorkflowState:
+    """时间序列节点：用一次companyfacts加载回答某指标跨多个财年/季度的走势"""
+    if not state["success"] or not state["parsed_intent"]:
+        return state
+    
+    intent = state["parsed_intent"]
+    try:
+        years = [int(year) for year in intent.get("years") or []]
+        start_year = intent.get("start_year", min(years) if years else intent.get("year"))
+        end_year = intent.get("end_year", max(years) if years else intent.get("year"))
+        series = get_metric_time_series(
+            intent["ticker"],
+            intent["metric"],
+            start_year,
+            end_year,
+            "quarterly" if intent.get("series") == "quarterly" else "annual"
+        )
+    except Exception as e:
+        return {**state, "error": f"时间序列查询失败: {str(e)}", "success": False}
+    
+    return {
+        **state,
+        "extracted_value": series,
+        "success": True
+    }
+
+def _needs_time_series(intent: Optional[Dict]) -> bool:
+    """意图是否是单公司、单指标的时间序列查询"""
+    return bool(intent and intent.get("series") and intent.get("ticker") and intent.get("metric"))
+
+def _needs_fan_out(intent: Optional[Dict]) -> bool:
+    """意图是否包含多家公司、多个指标或多个年份"""
+    if not intent:
+        return False
+    try:
+        return len(expand_intent(intent)) > 1
+    except Exception:
+        # 展开失败也交给扇出节点，由它返回明确的错误
+        return True
+
+def route_after_parse(state: WorkflowState) -> str:
+    """意图解析后的路由：单点查询先查结果缓存，时间序列走time_series，多公司/多指标/多年份查询走扇出"""
+    if not state["success"]:
+        return END
+    if _needs_time_series(state["parsed_intent"]):
+        return "time_series"
+    if _needs_fan_out(state["parsed_intent"]):
+        return "fan_out"
+    return "continue"
+
+def route_after_cache(state: WorkflowState) -> str:
+    """结果缓存命中时直接结束，否则继续检索"""
+    if state.get("cache_hit"):
+        return END
+    return "continue"
+
 def should_continue(state: WorkflowState) -> str:
     """决定工作流是否继续"""
     if state["success"]:
@@ -209,21 +1080,49 @@ def should_continue(state: WorkflowState) -> str:
     else:
         return END
 
-def build_workflow() -> StateGraph:
-    """构建LangGraph工作流"""
+# SEC检索节点遇到暂时性网络错误时按指数退避自动重试，不影响已完成的节点
+SEC_RETRY_POLICY = RetryPolicy(
+    initial_interval=SEC_RETRY_INITIAL_INTERVAL,
+    max_interval=SEC_RETRY_MAX_INTERVAL,
+    max_attempts=SEC_RETRY_MAX_ATTEMPTS,
+    retry_on=is_transient_error
+)
+
+def build_workflow(checkpointer=None) -> StateGraph:
+    """
+    构建LangGraph工作流
+    
+    Args:
+        checkpointer: LangGraph检查点存储；传入后每个节点完成时保存状态，
+            同一thread_id的重试可以从失败的节点继续
+    """
     workflow = StateGraph(WorkflowState)
     
     # 添加节点
     workflow.add_node("parse_intent", parse_intent_node)
-    workflow.add_node("retrieve_sec_data", retrieve_sec_data_node)
+    workflow.add_node("check_result_cache", check_result_cache_node)
+    workflow.add_node("retrieve_sec_data", retrieve_sec_data_node, retry_policy=SEC_RETRY_POLICY)
     workflow.add_node("extract_xbrl_data", extract_xbrl_data_node)
+    workflow.add_node("fan_out", fan_out_node)
+    workflow.add_node("time_series", time_series_node)
     
     # 定义边
     workflow.set_entry_point("parse_intent")
     
     workflow.add_conditional_edges(
         "parse_intent",
-        should_continue,
+        route_after_parse,
+        {
+            "continue": "check_result_cache",
+            "fan_out": "fan_out",
+            "time_series": "time_series",
+            END: END
+        }
+    )
+    
+    workflow.add_conditional_edges(
+        "check_result_cache",
+        route_after_cache,
         {
             "continue": "retrieve_sec_data",
             END: END
@@ -240,44 +1139,304 @@ def build_workflow() -> StateGraph:
     )
     
     workflow.add_edge("extract_xbrl_data", END)
+    workflow.add_edge("fan_out", END)
+    workflow.add_edge("time_series", END)
     
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
 
 # 创建编译后的工作流
 compiled_workflow = build_workflow()
 
-async def process_query_with_langgraph(query: str) -> Dict[str, Any]:
-    """使用LangGraph处理查询"""
-    initial_state = WorkflowState(
+# 内存检查点（CHECKPOINT_BACKEND=memory），只保存带request_id且未正常结束的查询
+_memory_checkpointer = MemorySaver()
+
+# 内存检查点中保留的request_id及其保存时间（按保存先后排列），超过TTL或数量上限时删除最早的
+_memory_threads: "OrderedDict[str, float]" = OrderedDict()
+_memory_threads_lock = threading.Lock()
+
+def _keep_memory_checkpoint(request_id: str) -> None:
+    """记录一个未正常结束的请求的检查点，并删除过期或超出CHECKPOINT_MAX_THREADS的旧检查点"""
+    now = time.monotonic()
+    with _memory_threads_lock:
+        _memory_threads.pop(request_id, None)
+        _memory_threads[request_id] = now
+        while _memory_threads:
+            oldest, saved_at = next(iter(_memory_threads.items()))
+            if len(_memory_threads) <= CHECKPOINT_MAX_THREADS and now - saved_at <= CHECKPOINT_TTL:
+                break
+            del _memory_threads[oldest]
+            _memory_checkpointer.delete_thread(oldest)
+
+def _forget_memory_checkpoint(request_id: str) -> None:
+    """请求正常结束、检查点已删除后不再跟踪"""
+    with _memory_threads_lock:
+        _memory_threads.pop(request_id, None)
+
+@asynccontextmanager
+async def _open_checkpointer():
+    """打开CHECKPOINT_BACKEND指定的检查点存储（memory或sqlite）"""
+    if CHECKPOINT_BACKEND == "sqlite":
+        # 可选依赖：pip install langgraph-checkpoint-sqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        async with AsyncSqliteSaver.from_conn_string(CHECKPOINT_DB_PATH) as checkpointer:
+            yield checkpointer
+    elif CHECKPOINT_BACKEND == "memory":
+        yield _memory_checkpointer
+    else:
+        raise ValueError(f"未知的检查点后端: {CHECKPOINT_BACKEND}")
+
+async def _run_workflow(query: str, request_id: Optional[str], remaining: Optional[float]) -> WorkflowState:
+    """
+    执行工作流，返回最终状态
+    
+    没有request_id时直接执行。有request_id时按它保存检查点：该请求上次因异常或超时
+    中断时，从中断的节点继续（已解析的意图不再调用LLM）；正常结束后删除检查点。
+    """
+    if request_id is None:
+        prefetch = _start_prefetch(query)
+        token = _current_prefetch.set(prefetch)
+        try:
+            return await asyncio.wait_for(compiled_workflow.ainvoke(_create_initial_state(query)), timeout=remaining)
+        finally:
+            _current_prefetch.reset(token)
+    
+    config = {"configurable": {"thread_id": request_id}}
+    async with _open_checkpointer() as checkpointer:
+        workflow = compiled_workflow.copy(update={"checkpointer": checkpointer})
+        with span("checkpoint.load", request_id=request_id):
+            snapshot = await workflow.aget_state(config)
+            resume = bool(snapshot.next) and snapshot.values.get("query") == query
+            annotate(resumed_from=list(snapshot.next) if resume else None)
+        
+        prefetch = None if resume else _start_prefetch(query)
+        token = _current_prefetch.set(prefetch)
+        try:
+            final_state = await asyncio.wait_for(
+                workflow.ainvoke(None if resume else _create_initial_state(query), config),
+                timeout=remaining
+            )
+        except BaseException:
+            # 失败、超时或被取消：保留检查点供重试，但内存中的检查点有数量和时间上限
+            if checkpointer is _memory_checkpointer:
+                _keep_memory_checkpoint(request_id)
+            raise
+        finally:
+            _current_prefetch.reset(token)
+        
+        await checkpointer.adelete_thread(request_id)
+        if checkpointer is _memory_checkpointer:
+            _forget_memory_checkpoint(request_id)
+        return final_state
+
+def _create_initial_state(query: str) -> WorkflowState:
+    """创建工作流初始状态"""
+    return WorkflowState(
         query=query,
         parsed_intent=None,
-        html_content=None,
+        filing=None,
         extracted_value=None,
+        cache_hit=None,
+        llm_usage=None,
         error=None,
         success=False
     )
+
+def _format_result(query: str, state: WorkflowState) -> Dict[str, Any]:
+    """把工作流最终状态整理成对外返回的结果"""
+    if state["success"]:
+        formatted = {
+            "query": query,
+            "parsed_intent": state["parsed_intent"],
+            "result": state["extracted_value"],
+            "cached": bool(state.get("cache_hit")),
+            "success": True
+        }
+    else:
+        formatted = {
+            "query": query,
+            "error": state["error"],
+            "success": False
+        }
+    if state.get("llm_usage"):
+        formatted["llm_usage"] = state["llm_usage"]
+    return formatted
+
+def _overloaded_result(query: str, error: Overloaded) -> Dict[str, Any]:
+    """上游（SEC或LLM）过载、查询被拒绝时的结果，retry_after为建议的重试等待秒数"""
+    return {
+        "query": query,
+        "error": f"服务繁忙: {error.upstream}请求排队过多，请{error.retry_after_header}秒后重试",
+        "retry_after": error.retry_after,
+        "success": False
+    }
+
+def _timeout_result(query: str, timeout: Optional[float]) -> Dict[str, Any]:
+    """查询超过截止时间时的结果"""
+    return {
+        "query": query,
+        "error": f"查询超时: 超过{timeout}秒未完成",
+        "success": False
+    }
+
+async def process_query_with_langgraph(
+    query: str,
+    include_timings: bool = False,
+    timeout: Optional[float] = QUERY_TIMEOUT,
+    request_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    使用LangGraph处理查询
     
-    try:
-        # 执行工作流
-        result = await compiled_workflow.ainvoke(initial_state)
+    include_timings为True时，结果中附带 "timings"：各节点及其子步骤
+    （LLM调用、submissions查询、文档下载、XBRL解析等）的耗时和属性。
+    注册了指标导出sink（telemetry.add_sink）时，每次查询的追踪数据也会导出到sink。
+    
+    timeout是整个查询的截止时间（秒，None表示不限时），会传递给每个节点以及其中的
+    HTTP请求和LLM调用。超时或调用方取消（如客户端断开）时，仍在工作线程中进行的
+    下载和解析会在下一个检查点停止。
+    
+    request_id用于失败重试：SEC检索的暂时性错误在节点内按退避自动重试，仍然失败或
+    超时时，用同一个request_id再次调用会从失败的节点继续，不再重新解析意图。
+    """
+    tracing = include_timings or has_sinks()
+    
+    with (start_trace("process_query", query=query) if tracing else nullcontext()) as trace:
+        with deadline_scope(timeout) as deadline:
+            try:
+                # 预计排队时间已超过截止时间时直接拒绝，不占用上游
+                check_admission("llm", "sec")
+                # 执行工作流
+                result = await _run_workflow(query, request_id, deadline.remaining())
+                formatted = _format_result(query, result)
+            
+            except Overloaded as e:
+                formatted = _overloaded_result(query, e)
+            except asyncio.TimeoutError:
+                formatted = _timeout_result(query, timeout)
+            except Exception as e:
+                formatted = {
+                    "query": query,
+                    "error": f"SEC数据检索失败: {str(e)}" if is_transient_error(e) else f"工作流执行失败: {str(e)}",
+                    "success": False
+                }
+            finally:
+                # 让仍在运行的下载、解析和预取尽快停止
+                deadline.cancel()
         
-        if result["success"]:
-            return {
-                "query": query,
-                "parsed_intent": result["parsed_intent"],
-                "result": result["extracted_value"],
-                "success": True
-            }
-        else:
-            return {
-                "query": query,
-                "error": result["error"],
-                "success": False
+        if trace is not None:
+            trace.attributes["success"] = formatted["success"]
+    
+    if include_timings:
+        formatted["timings"] = trace.to_dict()
+    
+    return formatted
+
+async def stream_query_with_langgraph(
+    query: str,
+    timeout: Optional[float] = QUERY_TIMEOUT
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    流式处理查询，每个阶段完成后立即产出一个事件：
+    
+    - {"event": "parsed_intent", "data": 解析出的意图}
+    - {"event": "filing", "data": 财报元数据}（仅单点查询，命中结果缓存时同样产出）
+    - {"event": "result", "data": 与process_query_with_langgraph相同的最终结果}
+    
+    失败或超时时直接产出result事件，其中success为False。
+    调用方提前停止迭代（如客户端断开）时，剩余的工作会被取消。
+    """
+    final_state = _create_initial_state(query)
+    
+    with deadline_scope(timeout) as deadline:
+        # 先做准入检查：被拒绝的请求不预取，不占用SEC的上游名额
+        try:
+            check_admission("llm", "sec")
+        except Overloaded as e:
+            yield {"event": "result", "data": _overloaded_result(query, e)}
+            return
+
+        prefetch = _start_prefetch(query)
+        updates = compiled_workflow.astream(final_state, stream_mode="updates").__aiter__()
+
+        try:
+            while True:
+                try:
+                    update = await asyncio.wait_for(updates.__anext__(), timeout=deadline.remaining())
+                except StopAsyncIteration:
+                    break
+                
+                for node_name, node_state in update.items():
+                    final_state = {**final_state, **node_state}
+                    if node_name == "parse_intent":
+                        _settle_prefetch(prefetch, final_state["parsed_intent"] if final_state["success"] else None)
+                    if not final_state["success"]:
+                        continue
+                    if node_name == "parse_intent":
+                        yield {"event": "parsed_intent", "data": final_state["parsed_intent"]}
+                    elif node_name == "retrieve_sec_data" or (
+                        node_name == "check_result_cache" and final_state.get("cache_hit")
+                    ):
+                        yield {"event": "filing", "data": final_state["filing"]}
+        except Overloaded as e:
+            yield {"event": "result", "data": _overloaded_result(query, e)}
+            return
+        except asyncio.TimeoutError:
+            yield {"event": "result", "data": _timeout_result(query, timeout)}
+            return
+        except Exception as e:
+            yield {
+                "event": "result",
+                "data": {"query": query, "error": f"工作流执行失败: {str(e)}", "success": False}
             }
-            
-    except Exception as e:
-        return {
-            "query": query,
-            "error": f"工作流执行失败: {str(e)}",
-            "success": False
-        } 
\ No newline at end of file
+            return
+        finally:
+            deadline.cancel()
+            await updates.aclose()
+    
+    yield {"event": "result", "data": _format_result(query, final_state)}
+
+def _parse_intent_or_reject(state: WorkflowState) -> WorkflowState:
+    """批量查询中解析单条意图；LLM过载时只让这一条失败"""
+    try:
+        return parse_intent_node(state)
+    except Overloaded as e:
+        return {**state, "error": _overloaded_result(state["query"], e)["error"], "success": False}
+
+async def process_queries_with_langgraph(
+    queries: List[str],
+    max_concurrency: int = BATCH_MAX_CONCURRENCY
+) -> List[Dict[str, Any]]:
+    """
+    批量处理查询
+    
+    并发解析所有查询的意图，再按 (ticker, year, form_type) 分组，
+    每份财报只下载、解析一次，最后把结果按原顺序分发回各个查询。
+    同时进行的LLM调用、下载和解析总数不超过max_concurrency。
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    # 1. 并发解析意图
+    states = list(await asyncio.gather(*(
+        _run_bounded(semaphore, _parse_intent_or_reject, _create_initial_state(query))
+        for query in queries
+    )))
+    
+    # 2. 与工作流相同的路由：时间序列查询走time_series，多公司/多指标/多年份查询各自扇出，
+    #    单点查询（以及解析失败、原样返回的状态）统一按财报分组执行
+    routes = [route_after_parse(state) for state in states]
+    series_indexes = [index for index, route in enumerate(routes) if route == "time_series"]
+    fan_out_indexes = [index for index, route in enumerate(routes) if route == "fan_out"]
+    single_indexes = [index for index, route in enumerate(routes) if route not in ("time_series", "fan_out")]
+
+    series, fanned, looked_up = await asyncio.gather(
+        asyncio.gather(*(_run_bounded(semaphore, time_series_node, states[index]) for index in series_indexes)),
+        asyncio.gather(*(_fan_out(states[index], semaphore) for index in fan_out_indexes)),
+        _lookup_states([states[index] for index in single_indexes], semaphore)
+    )
+    for index, state in zip(
+        series_indexes + fan_out_indexes + single_indexes,
+        list(series) + list(fanned) + looked_up
+    ):
+        states[index] = state
+    
+    return [_format_result(query, state) for query, state in zip(queries, states)]
@@ -0,0 +1,308 @@
+"""
+LLM backends for intent parsing.
+
+The "openai" backend is the production ChatOpenAI model. The "fake" backend is an
+offline stand-in that answers from recorded responses or, failing that, from simple
+rules (see query_hints), after sleeping for a synthetic, configurable latency. It
+needs no network or API key, so the full workflow can be load-tested and benchmarked
+deterministically.
+
+With RECORDING_MODE=record the chosen backend is wrapped so that every completion is
+saved to the fixture store; with RECORDING_MODE=replay the completions are served from
+that store instead of any backend (see recording.py).
+"""
+
+import asyncio
+import json
+import math
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+from .config import (
+    LLM_BACKEND,
+    OPENAI_API_KEY,
+    OPENAI_MODEL,
+    OPENAI_TEMPERATURE,
+    LLM_TIMEOUT,
+    FAKE_LLM_LATENCY_MEDIAN_MS,
+    FAKE_LLM_LATENCY_SIGMA,
+    FAKE_LLM_RESPONSES_PATH,
+    FAKE_LLM_SEED,
+    RECORDING_MODE
+)
+from .recording import FixtureMissing, fixture_key, fixture_store, replay_delay
+from .query_hints import detect_tickers, detect_metrics, detect_years, detect_form_type
+
+class FakeIntentChatModel(BaseChatModel):
+    """
+    Offline chat model that answers intent-parsing prompts without calling an API.
+
+    The last human message is treated as the user query. Queries found in `responses`
+    get the recorded reply verbatim; anything else gets a rule-based intent JSON in the
+    same shape the real prompt asks for (an array of them for a batched prompt).
+
+    When the call passes `tools` (structured output), the reply is a call to the first
+    tool with the intent as its arguments, or {"intents": [...]} for a batched prompt;
+    a recorded reply that is not valid JSON is returned as plain content instead. Token
+    usage is estimated at roughly four characters per token.
+
+    Each call sleeps for a latency drawn from a lognormal distribution with the given
+    median (sigma 0 gives a fixed latency). A call given a `timeout` shorter than the
+    sampled latency fails with TimeoutError after `timeout` seconds, like a real client.
+    """
+
+    latency_median_ms: float = 0.0
+    latency_sigma: float = 0.5
+    responses: Dict[str, str] = {}
+    seed: Optional[int] = None
+
+    _rng: random.Random = PrivateAttr()
+
+    def model_post_init(self, __context: Any) -> None:
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-intent"
+
+    def sample_latency(self) -> float:
+        """Draws one synthetic latency in seconds."""
+        if self.latency_median_ms <= 0:
+            return 0.0
+        if self.latency_sigma <= 0:
+            return self.latency_median_ms / 1000
+        return self._rng.lognormvariate(math.log(self.latency_median_ms), self.latency_sigma) / 1000
+
+    def respond(self, query: str) -> str:
+        """
+        Returns the reply content for a query (recorded if available, rule-based otherwise).
+        A JSON array of queries (a batched prompt) gets a JSON array of replies.
+        """
+        if query in self.responses:
+            return self.responses[query]
+
+        batch = _parse_query_batch(query)
+        if batch is not None:
+            return json.dumps([json.loads(self.respond(item)) for item in batch], ensure_ascii=False)
+        return json.dumps(rule_based_intent(query), ensure_ascii=False)
+
+    def _reply(self, messages: List[BaseMessage], tools: Optional[List[Dict]] = None) -> ChatResult:
+        content = self.respond(_last_human_content(messages))
+        prompt_chars = sum(len(str(message.content)) for message in messages)
+        if tools:
+            prompt_chars += len(json.dumps(tools, ensure_ascii=False))
+        usage = {
+            "input_tokens": max(1, prompt_chars // 4),
+            "output_tokens": max(1, len(content) // 4),
+        }
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+
+        message = AIMessage(content=content, usage_metadata=usage)
+        if tools:
+            try:
+                args = json.loads(content)
+            except json.JSONDecodeError:
+                args = None
+            if args is not None:
+                if isinstance(args, list):
+                    args = {"intents": args}
+                message = AIMessage(
+                    content="",
+                    tool_calls=[{"name": _tool_name(tools[0]), "args": args, "id": "call_fake"}],
+                    usage_metadata=usage
+                )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, timeout=None, tools=None, **kwargs) -> ChatResult:
+        latency = self.sample_latency()
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Fake LLM request timed out after {timeout:.3f}s")
+        if latency:
+            time.sleep(latency)
+        return self._reply(messages, tools)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, timeout=None, tools=None, **kwargs) -> ChatResult:
+        latency = self.sample_latency()
+        if timeout is not None and latency > timeout:
+            await asyncio.sleep(timeout)
+            raise TimeoutError(f"Fake LLM request timed out after {timeout:.3f}s")
+        if latency:
+            await asyncio.sleep(latency)
+        return self._reply(messages, tools)
+
+def completion_key(messages: List[BaseMessage], tools: Optional[List[Dict]] = None) -> str:
+    """Fixture key of a completion: the prompt messages and the names of the tools offered."""
+    parts = [f"{message.type}:{message.content}" for message in messages]
+    parts += [f"tool:{_tool_name(tool)}" for tool in tools or []]
+    return fixture_key(*parts)
+
+def _last_human_content(messages: List[BaseMessage]) -> str:
+    return next(
+        (message.content for message in reversed(messages) if isinstance(message, HumanMessage)),
+        ""
+    )
+
+class RecordingChatModel(BaseChatModel):
+    """Passes calls through to `inner` and saves each reply to the fixture store."""
+
+    inner: BaseChatModel
+
+    @property
+    def _llm_type(self) -> str:
+        return f"recording-{self.inner._llm_type}"
+
+    def _save(self, messages: List[BaseMessage], tools: Optional[List[Dict]], reply: BaseMessage, elapsed: float) -> ChatResult:
+        fixture_store().save("llm", completion_key(messages, tools), {
+            "prompt": _last_human_content(messages),
+            "message": message_to_dict(reply),
+            "elapsed_ms": round(elapsed * 1000, 3),
+        })
+        return ChatResult(generations=[ChatGeneration(message=reply)])
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, tools=None, **kwargs) -> ChatResult:
+        if tools is not None:
+            kwargs["tools"] = tools
+        started = time.monotonic()
+        reply = self.inner.invoke(messages, stop=stop, **kwargs)
+        return self._save(messages, tools, reply, time.monotonic() - started)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, tools=None, **kwargs) -> ChatResult:
+        if tools is not None:
+            kwargs["tools"] = tools
+        started = time.monotonic()
+        reply = await self.inner.ainvoke(messages, stop=stop, **kwargs)
+        return self._save(messages, tools, reply, time.monotonic() - started)
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Answers from completions saved by RecordingChatModel, after the replay delay
+    (REPLAY_LATENCY). A call given a `timeout` shorter than the delay fails with
+    TimeoutError after `timeout` seconds; a prompt that was never recorded raises
+    FixtureMissing.
+    """
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _lookup(self, messages: List[BaseMessage], tools: Optional[List[Dict]]) -> Tuple[Dict[str, Any], float]:
+        record = fixture_store().load("llm", completion_key(messages, tools))
+        if record is None:
+            raise FixtureMissing(f"No recorded LLM completion for {_last_human_content(messages)!r}")
+        return record, replay_delay(record)
+
+    @staticmethod
+    def _result(record: Dict[str, Any]) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=messages_from_dict([record["message"]])[0])])
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, timeout=None, tools=None, **kwargs) -> ChatResult:
+        record, delay = self._lookup(messages, tools)
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Replayed LLM request timed out after {timeout:.3f}s")
+        if delay:
+            time.sleep(delay)
+        return self._result(record)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, timeout=None, tools=None, **kwargs) -> ChatResult:
+        record, delay = self._lookup(messages, tools)
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            raise TimeoutError(f"Replayed LLM request timed out after {timeout:.3f}s")
+        if delay:
+            await asyncio.sleep(delay)
+        return self._result(record)
+
+def _tool_name(tool: Dict) -> str:
+    """Name of a tool given in OpenAI function format or as a bare function schema."""
+    return tool.get("function", tool).get("name", "")
+
+def _parse_query_batch(content: str) -> Optional[List[str]]:
+    """Returns the queries if content is a JSON array of strings, None otherwise."""
+    if not content.startswith("["):
+        return None
+    try:
+        batch = json.loads(content)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(batch, list) and all(isinstance(item, str) for item in batch):
+        return batch
+    return None
+
+def rule_based_intent(query: str) -> Dict[str, Any]:
+    """
+    Builds an intent dict from literal tickers, metric aliases and years in query.
+    Returns {"error": ...} when the company, metric or year cannot be found.
+    """
+    tickers = detect_tickers(query)
+    metrics = detect_metrics(query)
+    years = detect_years(query)
+    if not tickers or not metrics or not years:
+        return {"error": "无法理解查询"}
+
+    intent: Dict[str, Any] = {"ticker": tickers[0]}
+    if len(metrics) > 1:
+        intent["metrics"] = metrics
+    else:
+        intent["metric"] = metrics[0]
+    if len(years) > 1:
+        intent["years"] = years
+    else:
+        intent["year"] = years[0]
+    intent["form_type"] = detect_form_type(query)
+    return intent
+
+def load_recorded_responses(path: str) -> Dict[str, str]:
+    """
+    Loads recorded replies from a JSON object mapping query -> reply. Replies may be
+    stored as strings or as JSON objects (serialized on load).
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        recorded = json.load(f)
+    return {
+        query: reply if isinstance(reply, str) else json.dumps(reply, ensure_ascii=False)
+        for query, reply in recorded.items()
+    }
+
+def create_llm(backend: Optional[str] = None, recording_mode: Optional[str] = None) -> BaseChatModel:
+    """
+    Creates the chat model used by parse_intent_node.
+
+    Args:
+        backend: 'openai' or 'fake'; defaults to the LLM_BACKEND setting
+        recording_mode: 'off', 'record' or 'replay'; defaults to the RECORDING_MODE setting
+    """
+    recording_mode = (recording_mode or RECORDING_MODE).lower()
+    if recording_mode == "replay":
+        return ReplayChatModel()
+    model = _create_backend((backend or LLM_BACKEND).lower())
+    if recording_mode == "record":
+        return RecordingChatModel(inner=model)
+    return model
+
+def _create_backend(backend: str) -> BaseChatModel:
+    if backend == "openai":
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(
+            model=OPENAI_MODEL,
+            temperature=OPENAI_TEMPERATURE,
+            openai_api_key=OPENAI_API_KEY,
+            timeout=LLM_TIMEOUT
+        )
+
+    if backend == "fake":
+        return FakeIntentChatModel(
+            latency_median_ms=FAKE_LLM_LATENCY_MEDIAN_MS,
+            latency_sigma=FAKE_LLM_LATENCY_SIGMA,
+            responses=load_recorded_responses(FAKE_LLM_RESPONSES_PATH) if FAKE_LLM_RESPONSES_PATH else {},
+            seed=int(FAKE_LLM_SEED) if FAKE_LLM_SEED is not None else None
+        )
+
+    raise ValueError(f"Unknown LLM backend: {backend}")
@@ -0,0 +1,122 @@
+"""
+Metric knowledge base.
+
+Loads data/metrics_knowledge_base.json once at import and precompiles a normalized
+alias index, so resolving "net income", "NetIncome" or "净利润" to the same metric is a
+single dict lookup no matter how many aliases are registered. Candidate XBRL tags are
+ranked per company by how often each tag actually matched in that company's filings.
+"""
+
+import json
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional
+
+from .config import METRICS_KNOWLEDGE_BASE_PATH
+
+_lock = threading.Lock()
+_metrics: Dict[str, Dict] = {}
+_alias_index: Dict[str, str] = {}
+# (TICKER, canonical metric) -> Counter of XBRL tags that produced a value
+_tag_hits: Dict[tuple, Counter] = {}
+
+def normalize_alias(name: str) -> str:
+    """
+    Normalizes a metric name for alias lookup: folds full-width characters and case,
+    and drops whitespace and separators, so "Net Income", "net_income" and "NetIncome"
+    share one key.
+    """
+    normalized = unicodedata.normalize("NFKC", name).casefold()
+    return "".join(ch for ch in normalized if ch.isalnum())
+
+def _index_metric(metric: str, definition: Dict) -> None:
+    """Registers a metric and all of its aliases. Caller holds _lock."""
+    _metrics[metric] = definition
+    for alias in [metric, *definition.get("aliases", [])]:
+        _alias_index[normalize_alias(alias)] = metric
+
+def load_metrics(path: str = METRICS_KNOWLEDGE_BASE_PATH) -> None:
+    """
+    (Re)loads the knowledge base from a JSON file, replacing all registered metrics.
+    Learned tag rankings are kept.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        definitions = json.load(f)
+
+    with _lock:
+        _metrics.clear()
+        _alias_index.clear()
+        for metric, definition in definitions.items():
+            _index_metric(metric, definition)
+
+def add_metric_mapping(
+    metric: str,
+    tags: List[str],
+    aliases: Optional[List[str]] = None,
+    description: str = "",
+    time_type: str = "duration"
+) -> None:
+    """
+    Registers a metric at runtime (or replaces an existing one).
+
+    Args:
+        metric: Canonical metric name (e.g. 'OperatingIncome')
+        tags: Candidate XBRL tags in default priority order
+        aliases: Additional names the metric may be asked for by
+        description: Human readable description
+        time_type: 'duration' or 'instant'
+    """
+    with _lock:
+        _index_metric(metric, {
+            "description": description,
+            "aliases": list(aliases or []),
+            "tags": list(tags),
+            "time_type": time_type,
+        })
+
+def resolve_metric(name: str) -> Optional[str]:
+    """Returns the canonical metric name for any registered alias, or None if unknown."""
+    if not name:
+        return None
+    return _alias_index.get(normalize_alias(name))
+
+def get_tags_for_metric(name: str, ticker: Optional[str] = None) -> List[str]:
+    """
+    Returns the candidate XBRL tags for a metric, most promising first.
+
+    With a ticker, tags that matched in that company's earlier filings come first
+    (most hits first); the remaining tags keep the knowledge base order. An unknown
+    metric is returned as its own single candidate so callers can pass raw XBRL tags.
+    """
+    metric = resolve_metric(name)
+    if metric is None:
+        return [name]
+
+    tags = list(_metrics[metric]["tags"])
+    if ticker:
+        hits = _tag_hits.get((ticker.upper(), metric))
+        if hits:
+            # sorted() is stable, so ties keep the knowledge base order
+            tags.sort(key=lambda tag: -hits[tag])
+    return tags
+
+def get_time_type(name: str) -> Optional[str]:
+    """Returns 'duration' or 'instant' for a known metric, None otherwise."""
+    metric = resolve_metric(name)
+    return _metrics[metric].get("time_type") if metric else None
+
+def record_tag_hit(ticker: str, name: str, tag: str) -> None:
+    """Records that tag produced the value of a metric in one of ticker's filings."""
+    metric = resolve_metric(name)
+    if metric is None:
+        return
+    with _lock:
+        _tag_hits.setdefault((ticker.upper(), metric), Counter())[tag] += 1
+
+def list_metrics() -> Dict[str, Dict]:
+    """Returns a copy of all registered metric definitions keyed by canonical name."""
+    with _lock:
+        return {metric: dict(definition) for metric, definition in _metrics.items()}
+
+load_metrics()
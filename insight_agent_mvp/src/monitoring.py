@@ -0,0 +1,232 @@
+"""
+Prometheus-style metrics derived from query traces.
+
+record_trace() is a telemetry sink (see enable()): every finished trace becomes
+end-to-end and per-stage latency observations, cache hit/miss, upstream error and
+retry counts, and downloaded bytes. render() returns them in the Prometheus text
+exposition format (version 0.0.4), which the API serves at /metrics.
+
+Recording takes no locks: each thread writes to its own shard of plain dicts and
+lists, and render() merges the shards. A scrape can therefore see a shard halfway
+through one update, which is off by at most one observation and corrected by the
+next scrape.
+
+Metrics are per process: with several API workers, each serves its own values.
+"""
+
+import threading
+from bisect import bisect_left
+from typing import Any, Dict, List, Tuple
+
+from .admission import admission_stats
+from .config import METRICS_LATENCY_BUCKETS
+from .telemetry import add_sink, remove_sink, sinks
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+BUCKETS = tuple(METRICS_LATENCY_BUCKETS)
+
+# name -> (help text, label names)
+HISTOGRAMS = {
+    "insight_request_duration_seconds": (
+        "End-to-end latency of traced operations (natural language queries, structured lookups)",
+        ("operation",),
+    ),
+    "insight_stage_duration_seconds": (
+        "Latency of one pipeline stage (LLM parse, submissions lookup, document download, extraction)",
+        ("stage",),
+    ),
+    "insight_node_duration_seconds": (
+        "Latency of one LangGraph workflow node run",
+        ("node",),
+    ),
+}
+COUNTERS = {
+    "insight_requests_total": ("Traced operations by outcome", ("operation", "success")),
+    "insight_cache_requests_total": ("Cache lookups by tier and result", ("tier", "result")),
+    "insight_upstream_errors_total": ("Failed SEC/LLM calls by exception type", ("upstream", "error")),
+    "insight_upstream_retries_total": ("Repeated SEC/LLM attempts within one operation", ("upstream",)),
+    "insight_sec_downloaded_bytes_total": ("Response bytes downloaded from SEC EDGAR", ()),
+}
+
+# Span name -> stage label of insight_stage_duration_seconds
+STAGE_SPANS = {
+    "llm.invoke": "llm_parse",
+    "sec.submissions": "submissions_lookup",
+    "sec.download": "document_download",
+    "xbrl.parse": "extraction",
+    "xbrl.parse_facts": "extraction",
+}
+# Span name -> cache tier, for spans annotated with cache="hit"/"miss"
+CACHE_SPANS = {
+    "check_result_cache": "result",
+    "sec.get_filing_html": "filing",
+    "sec.submissions": "submissions",
+    "sec.company_facts": "company_facts",
+    "facts.load": "facts",
+}
+# Span name -> upstream whose failures it records
+UPSTREAM_SPANS = {
+    "sec.http": "sec",
+    "llm.invoke": "llm",
+}
+# Span name -> upstream; each run after the first within one operation counts as a retry
+RETRIED_SPANS = {
+    "retrieve_sec_data": "sec",
+    "llm.invoke": "llm",
+}
+
+class _Shard:
+    """One thread's metric values: (name, label values) -> counts."""
+
+    __slots__ = ("histograms", "counters")
+
+    def __init__(self):
+        # Histogram series: non-cumulative bucket counts, then the +Inf overflow count, then the sum
+        self.histograms: Dict[Tuple[str, Tuple[str, ...]], List[float]] = {}
+        self.counters: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+
+_local = threading.local()
+_shards: List[_Shard] = []
+_shards_lock = threading.Lock()
+
+def _shard() -> _Shard:
+    """The calling thread's shard; the lock is only taken the first time a thread records."""
+    shard = getattr(_local, "shard", None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+def observe(name: str, labels: Tuple[str, ...], seconds: float) -> None:
+    """Adds one observation to a histogram in HISTOGRAMS."""
+    series_map = _shard().histograms
+    key = (name, labels)
+    series = series_map.get(key)
+    if series is None:
+        series = series_map[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+    series[bisect_left(BUCKETS, seconds)] += 1
+    series[-1] += seconds
+
+def increment(name: str, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+    """Adds amount to a counter in COUNTERS."""
+    counters = _shard().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + amount
+
+def record_trace(trace: Dict[str, Any]) -> None:
+    """Telemetry sink: turns one finished trace (Trace.to_dict()) into metric updates."""
+    operation = trace["name"]
+    observe("insight_request_duration_seconds", (operation,), trace["duration_ms"] / 1000)
+    success = trace["attributes"].get("success")
+    increment("insight_requests_total", (operation, "unknown" if success is None else str(bool(success)).lower()))
+
+    runs: Dict[str, int] = {}
+    for record in trace["spans"]:
+        name = record["name"]
+        attributes = record["attributes"]
+        seconds = (record["duration_ms"] or 0) / 1000
+
+        if record["parent_id"] is None:
+            observe("insight_node_duration_seconds", (name,), seconds)
+        if name in STAGE_SPANS:
+            observe("insight_stage_duration_seconds", (STAGE_SPANS[name],), seconds)
+
+        if name in CACHE_SPANS and attributes.get("cache") in ("hit", "miss"):
+            increment("insight_cache_requests_total", (CACHE_SPANS[name], attributes["cache"]))
+        elif name == "intent_index.lookup" and "hit" in attributes:
+            increment("insight_cache_requests_total", ("intent_index", "hit" if attributes["hit"] else "miss"))
+
+        if name in UPSTREAM_SPANS and "error" in attributes:
+            increment("insight_upstream_errors_total", (UPSTREAM_SPANS[name], attributes["error"]))
+        if name == "sec.http" and "bytes" in attributes:
+            increment("insight_sec_downloaded_bytes_total", (), attributes["bytes"])
+        if name in RETRIED_SPANS:
+            runs[name] = runs.get(name, 0) + 1
+
+    for name, count in runs.items():
+        if count > 1:
+            increment("insight_upstream_retries_total", (RETRIED_SPANS[name],), count - 1)
+
+def _merged() -> Tuple[Dict, Dict]:
+    """Sums all shards."""
+    histograms: Dict[Tuple[str, Tuple[str, ...]], List[float]] = {}
+    counters: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+    with _shards_lock:
+        shards = list(_shards)
+    for shard in shards:
+        # list() copies each dict in one step, so a thread adding a series meanwhile cannot break iteration
+        for key, series in list(shard.histograms.items()):
+            total = histograms.setdefault(key, [0] * len(series))
+            for i, value in enumerate(list(series)):
+                total[i] += value
+        for key, value in list(shard.counters.items()):
+            counters[key] = counters.get(key, 0) + value
+    return histograms, counters
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple[Any, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+def render() -> str:
+    """All metrics plus the current admission control load, in Prometheus text format."""
+    histograms, counters = _merged()
+    lines: List[str] = []
+
+    for name, (help_text, label_names) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for (series_name, values), series in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = bound if bound == "+Inf" else _number(bound)
+                lines.append(f"{name}_bucket{_labels(label_names + ('le',), values + (le,))} {_number(cumulative)}")
+            lines.append(f"{name}_sum{_labels(label_names, values)} {_number(series[-1])}")
+            lines.append(f"{name}_count{_labels(label_names, values)} {_number(cumulative)}")
+
+    for name, (help_text, label_names) in COUNTERS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for (series_name, values), value in sorted(counters.items()):
+            if series_name == name:
+                lines.append(f"{name}{_labels(label_names, values)} {_number(value)}")
+
+    stats = admission_stats()
+    for name, field, kind, help_text in (
+        ("insight_upstream_active", "active", "gauge", "Calls currently holding an upstream slot"),
+        ("insight_upstream_queued", "queued", "gauge", "Calls waiting for an upstream slot"),
+        ("insight_upstream_service_time_seconds", "service_time_s", "gauge", "Moving average of upstream call duration"),
+        ("insight_upstream_rejected_total", "rejected", "counter", "Calls rejected by admission control"),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for upstream, values in sorted(stats.items()):
+            lines.append(f"{name}{_labels(('upstream',), (upstream,))} {_number(values[field])}")
+
+    return "\n".join(lines) + "\n"
+
+def reset() -> None:
+    """Zeroes all recorded metrics (admission control stats are not affected)."""
+    with _shards_lock:
+        for shard in _shards:
+            shard.histograms.clear()
+            shard.counters.clear()
+
+def enable() -> None:
+    """Starts recording: registers record_trace() as a telemetry sink, so every query is traced."""
+    disable()
+    add_sink(record_trace)
+
+def disable() -> None:
+    remove_sink(record_trace)
+
+def enabled() -> bool:
+    return record_trace in sinks()
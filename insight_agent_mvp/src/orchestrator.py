@@ -0,0 +1,603 @@
+"""
+InsightAgent API服务
+基于FastAPI，把SEC检索、XBRL提取和LangGraph查询工作流作为网络服务提供
+
+所有处理函数都是异步的：SEC请求和XBRL解析放到线程中执行，不阻塞事件循环；
+同一个worker进程内的所有请求共享SEC数据缓存、结果缓存和意图索引；配置SHARED_CACHE=sqlite时
+（多worker启动时默认），下载的财报、submissions索引、解析出的XBRL事实和意图还会与同机的其他worker共享。
+
+启动:
+    uvicorn src.orchestrator:app --host 127.0.0.1 --port 8000 --workers 4
+    或 python -m src.orchestrator（按API_HOST、API_PORT、API_WORKERS配置启动）
+"""
+
+import asyncio
+import datetime
+import hashlib
+import json
+import math
+import os
+from contextlib import asynccontextmanager, nullcontext
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+
+from .config import (
+    API_TITLE,
+    API_VERSION,
+    API_DESCRIPTION,
+    API_HOST,
+    API_PORT,
+    API_WORKERS,
+    LLM_BACKEND,
+    OPENAI_API_KEY,
+    RECORDING_MODE,
+    TICKER_TO_CIK,
+    COMPANY_ALIASES,
+    QUERY_TIMEOUT,
+    BATCH_MAX_CONCURRENCY,
+    BULK_MAX_ITEMS,
+    METRIC_CACHE_MAX_AGE_PAST,
+    METRIC_CACHE_MAX_AGE_CURRENT,
+    METRICS_ENABLED,
+    JOB_MAX_ITEMS
+)
+from .deadline import deadline_scope
+from .telemetry import start_trace, has_sinks
+from .admission import Overloaded
+from .jobs import JobStore, JobRunner
+from . import monitoring
+from .sec_retriever import get_filing_html, get_latest_10k_html, get_cached_filing_metadata, is_transient_error
+from .xbrl_extractor import extract_metric_from_html, extract_revenue_from_html
+from .metrics_manager import list_metrics, resolve_metric, get_tags_for_metric, record_tag_hit
+from .langgraph_orchestrator import (
+    load_filing_facts,
+    warm_filing_facts,
+    process_query_with_langgraph,
+    stream_query_with_langgraph,
+    get_metric_time_series,
+    _candidate_tags
+)
+
+SUPPORTED_FORM_TYPES = ["10-K", "10-Q"]
+
+# 指标名 -> 首选XBRL标签，来自指标知识库
+METRIC_TAG_MAPPING = {
+    metric: _candidate_tags(definition["tags"])[0]
+    for metric, definition in list_metrics().items()
+    if definition.get("tags")
+}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动时开始执行后台任务（包括上次停止时未完成的任务），停止时让任务worker退出"""
+    await asyncio.to_thread(_job_runner)
+    yield
+    if _job_runner_instance is not None:
+        # 正在处理的财报最多再等10秒；未完成的部分在下次启动后由租约到期机制继续
+        await asyncio.to_thread(_job_runner_instance.stop, 10)
+
+app = FastAPI(title=API_TITLE, version=API_VERSION, description=API_DESCRIPTION, lifespan=lifespan)
+
+# 每个查询和结构化检索的追踪数据汇总为/metrics中的指标
+if METRICS_ENABLED:
+    monitoring.enable()
+
+class QueryRequest(BaseModel):
+    """自然语言查询请求"""
+    text: str
+    request_id: Optional[str] = None  # 重试时传入同一个ID，可从失败的节点继续
+
+class MetricRequest(BaseModel):
+    """批量查询中的一条结构化查询"""
+    ticker: str
+    metric: str
+    year: int
+    form_type: str = Field("10-K", pattern="^10-[KQ]$")
+
+class MetricNotFound(LookupError):
+    """股票代码、指标或财报中的数据不存在"""
+
+def get_metric_for_ticker(ticker: str, metric: str, year: int, form_type: str = "10-K") -> Dict[str, Any]:
+    """
+    检索财报并提取一个指标（同步执行，会访问网络）
+
+    按知识库中的候选XBRL标签依次尝试，该公司以往命中过的标签优先。
+
+    Raises:
+        MetricNotFound: 不支持的股票代码或指标，或财报中找不到该指标
+        FileNotFoundError: 找不到对应年份的财报
+    """
+    ticker = ticker.upper()
+    if ticker not in TICKER_TO_CIK:
+        raise MetricNotFound(f"不支持的股票代码: {ticker}")
+    canonical = resolve_metric(metric)
+    if canonical is None:
+        raise MetricNotFound(f"不支持的指标: {metric}")
+
+    html_content = get_filing_html(ticker, year, form_type)
+
+    for metric_tag in _candidate_tags(get_tags_for_metric(canonical, ticker)):
+        extracted = extract_metric_from_html(html_content, metric_tag)
+        if extracted:
+            value, unit = extracted
+            record_tag_hit(ticker, canonical, metric_tag)
+            return {
+                "ticker": ticker,
+                "metric": metric,
+                "year": year,
+                "form_type": form_type,
+                "value": value,
+                "unit": unit,
+                "xbrl_tag": metric_tag,
+                "filing": get_cached_filing_metadata(ticker, year, form_type)
+            }
+
+    raise MetricNotFound(f"在{ticker} {year}年的{form_type}中找不到指标: {metric}")
+
+async def _run_with_deadline(func, *args):
+    """
+    在线程中执行同步的检索/提取函数，受QUERY_TIMEOUT截止时间约束
+
+    截止时间随上下文进入工作线程；超时或客户端断开时，线程中的下载和解析会在下一个检查点停止。
+    注册了指标导出sink时，以函数名为操作名记录一次追踪。
+    """
+    operation = getattr(func, "__name__", type(func).__name__)
+    with (start_trace(operation) if has_sinks() else nullcontext()) as trace:
+        with deadline_scope(QUERY_TIMEOUT) as deadline:
+            succeeded = False
+            try:
+                result = await asyncio.wait_for(asyncio.to_thread(func, *args), timeout=deadline.remaining())
+                succeeded = True
+                return result
+            except TimeoutError:
+                raise HTTPException(status_code=504, detail=f"查询超时: 超过{QUERY_TIMEOUT}秒未完成")
+            finally:
+                deadline.cancel()
+                if trace is not None:
+                    trace.attributes["success"] = succeeded
+
+def _http_error(e: Exception) -> HTTPException:
+    """把检索/提取异常转换为HTTP错误"""
+    if isinstance(e, Overloaded):
+        return HTTPException(
+            status_code=429,
+            detail=f"服务繁忙: {e.upstream}请求排队过多",
+            headers={"Retry-After": e.retry_after_header}
+        )
+    if isinstance(e, (MetricNotFound, FileNotFoundError, ValueError)):
+        return HTTPException(status_code=404, detail=str(e))
+    if is_transient_error(e):
+        return HTTPException(status_code=503, detail=f"SEC数据检索失败: {str(e)}")
+    return HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
+
+def _metric_etag(result: Dict[str, Any]) -> Optional[str]:
+    """
+    指标结果的强ETag，由来源财报的accession号、XBRL标签和该事实（期间、值、单位）决定；
+    不知道来源财报时返回None
+    """
+    accession = (result.get("filing") or {}).get("accession_number")
+    if not accession:
+        return None
+    fact = [accession, result["xbrl_tag"], result["form_type"], result["year"], result["value"], result["unit"]]
+    return '"' + hashlib.sha256(json.dumps(fact).encode("utf-8")).hexdigest()[:32] + '"'
+
+def _metric_cache_control(year: int) -> str:
+    """已结束财年的结果几乎不会变化（除非发布修订版），可以缓存更久"""
+    max_age = METRIC_CACHE_MAX_AGE_PAST if year < datetime.date.today().year else METRIC_CACHE_MAX_AGE_CURRENT
+    return f"public, max-age={max_age}"
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match是否命中（按RFC 9110的弱比较，忽略W/前缀）"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in (candidate.removeprefix("W/") for candidate in candidates)
+
+@app.get("/")
+async def root():
+    """服务基本信息"""
+    return {
+        "name": API_TITLE,
+        "version": API_VERSION,
+        "endpoints": {
+            "/info": "支持的公司、指标和财报类型",
+            "/supported-tickers": "支持的股票代码",
+            "/supported-metrics": "支持的指标及其XBRL标签",
+            "/get-metric": "结构化查询：ticker、metric、year、form_type",
+            "/bulk/get-metric": "批量结构化查询，以NDJSON流式返回",
+            "/jobs": "提交后台批量任务，按任务ID查询进度和下载结果",
+            "/get-revenue": "最新10-K中的收入（旧接口）",
+            "/time-series": "单个指标的年度/季度时间序列",
+            "/query": "自然语言查询",
+            "/query/stream": "自然语言查询，按阶段以NDJSON流式返回",
+            "/metrics": "Prometheus格式的延迟、缓存和上游错误指标",
+            "/docs": "API文档"
+        }
+    }
+
+@app.get("/info")
+async def info():
+    """支持的公司、指标和财报类型"""
+    metrics = list_metrics()
+    return {
+        "supported_tickers": {
+            "list": list(TICKER_TO_CIK),
+            "companies": {ticker: COMPANY_ALIASES.get(ticker, [ticker])[0] for ticker in TICKER_TO_CIK}
+        },
+        "supported_metrics": {
+            "mapping": METRIC_TAG_MAPPING,
+            "descriptions": {metric: definition.get("description", "") for metric, definition in metrics.items()}
+        },
+        "supported_form_types": SUPPORTED_FORM_TYPES
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus文本格式的指标：端到端和各阶段延迟直方图、各级缓存命中、上游错误/重试、下载字节数和准入控制负载"""
+    return Response(monitoring.render(), media_type=monitoring.CONTENT_TYPE)
+
+@app.get("/supported-tickers")
+async def supported_tickers():
+    """支持的股票代码"""
+    return list(TICKER_TO_CIK)
+
+@app.get("/supported-metrics")
+async def supported_metrics():
+    """支持的指标及其首选XBRL标签"""
+    return METRIC_TAG_MAPPING
+
+@app.get("/get-metric")
+async def get_metric(
+    request: Request,
+    ticker: str,
+    metric: str,
+    year: int,
+    form_type: str = Query("10-K", pattern="^10-[KQ]$")
+):
+    """
+    结构化查询：从指定财报中提取一个指标
+
+    响应带有ETag和Cache-Control，客户端和代理缓存可以直接复用；
+    If-None-Match与当前ETag一致时返回304。
+    """
+    try:
+        result = await _run_with_deadline(get_metric_for_ticker, ticker, metric, year, form_type)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _http_error(e)
+
+    headers = {"Cache-Control": _metric_cache_control(year)}
+    etag = _metric_etag(result)
+    if etag is not None:
+        headers["ETag"] = etag
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+    return JSONResponse(result, headers=headers)
+
+@app.get("/get-revenue")
+async def get_revenue(ticker: str):
+    """旧接口：最新10-K中的收入"""
+    ticker = ticker.upper()
+    if ticker not in TICKER_TO_CIK:
+        raise HTTPException(status_code=404, detail=f"不支持的股票代码: {ticker}")
+
+    def latest_revenue():
+        return extract_revenue_from_html(get_latest_10k_html(ticker))
+
+    try:
+        extracted = await _run_with_deadline(latest_revenue)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _http_error(e)
+
+    if not extracted:
+        raise HTTPException(status_code=404, detail=f"在{ticker}最新的10-K中找不到收入")
+    revenue, unit = extracted
+    return {"ticker": ticker, "revenue": revenue, "unit": unit}
+
+@app.get("/time-series")
+async def time_series(
+    ticker: str,
+    metric: str,
+    start_year: Optional[int] = None,
+    end_year: Optional[int] = None,
+    period: str = Query("annual", pattern="^(annual|quarterly)$")
+):
+    """单个指标的年度或季度时间序列"""
+    try:
+        return await _run_with_deadline(get_metric_time_series, ticker, metric, start_year, end_year, period)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise _http_error(e)
+
+def _ndjson(row: Dict[str, Any]) -> str:
+    return json.dumps(row, ensure_ascii=False) + "\n"
+
+def _parse_bulk_body(body: bytes, content_type: str) -> List[Any]:
+    """
+    解析批量请求体：NDJSON（每行一条查询），或JSON数组 / {"requests": [...]}
+
+    Raises:
+        ValueError: 请求体不是这几种格式之一
+    """
+    text = body.decode("utf-8")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get("requests")
+    if not isinstance(data, list):
+        raise ValueError('请求体应为查询列表、{"requests": [...]} 或NDJSON')
+    return data
+
+def _row_from_facts(index: int, item: MetricRequest, facts: Dict, filing: Optional[Dict]) -> Dict[str, Any]:
+    """从一份财报的XBRL事实中取出一条批量查询的结果"""
+    ticker, canonical = item.ticker.upper(), resolve_metric(item.metric)
+    row = {"index": index, "ticker": ticker, "metric": item.metric, "year": item.year, "form_type": item.form_type}
+    for metric_tag in _candidate_tags(get_tags_for_metric(canonical, ticker)):
+        fact = facts.get(metric_tag)
+        if fact is not None:
+            record_tag_hit(ticker, canonical, metric_tag)
+            return {
+                **row,
+                "value": fact["value"],
+                "unit": fact["unit"],
+                "xbrl_tag": metric_tag,
+                "filing": filing,
+                "success": True
+            }
+    return {**row, "status": 404, "error": f"在{ticker} {item.year}年的{item.form_type}中找不到指标: {item.metric}", "success": False}
+
+def _error_rows(members: List[Tuple[int, MetricRequest]], e: Exception) -> List[Dict[str, Any]]:
+    """一份财报检索失败时，涉及它的每条批量查询的结果"""
+    error = _http_error(e)
+    return [
+        {"index": index, **item.model_dump(), "status": error.status_code, "error": error.detail, "success": False}
+        for index, item in members
+    ]
+
+async def _bulk_lookup(raw_items: List[Any]) -> AsyncIterator[str]:
+    """
+    并发执行批量查询，每条结果就绪后立即以NDJSON输出（不保证输入顺序，按index对应）
+
+    查询按 (ticker, year, form_type) 分组，每份财报只下载、解析一次；
+    无效的查询最先输出。客户端断开时取消尚未完成的下载和解析。
+    """
+    groups: Dict[Tuple[str, int, str], List[Tuple[int, MetricRequest]]] = {}
+    for index, raw in enumerate(raw_items):
+        try:
+            item = MetricRequest.model_validate(raw)
+        except ValidationError as e:
+            yield _ndjson({"index": index, "status": 422, "error": f"无效的查询: {e.errors()[0]['msg']}", "success": False})
+            continue
+        ticker = item.ticker.upper()
+        if ticker not in TICKER_TO_CIK or resolve_metric(item.metric) is None:
+            error = f"不支持的股票代码: {ticker}" if ticker not in TICKER_TO_CIK else f"不支持的指标: {item.metric}"
+            yield _ndjson({"index": index, **item.model_dump(), "status": 404, "error": error, "success": False})
+            continue
+        groups.setdefault((ticker, item.year, item.form_type), []).append((index, item))
+
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def lookup_filing(filing_key, members) -> List[Dict[str, Any]]:
+        try:
+            async with semaphore:
+                facts = await asyncio.to_thread(load_filing_facts, filing_key)
+        except Exception as e:
+            return _error_rows(members, e)
+        filing = get_cached_filing_metadata(*filing_key)
+        return [_row_from_facts(index, item, facts, filing) for index, item in members]
+
+    # 没有时间限制，只用于在客户端断开时通知线程中的下载和解析停止
+    with deadline_scope(None) as deadline:
+        await asyncio.to_thread(warm_filing_facts, list(groups))
+        tasks = [asyncio.create_task(lookup_filing(filing_key, members)) for filing_key, members in groups.items()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for row in await next_done:
+                    yield _ndjson(row)
+        finally:
+            deadline.cancel()
+            for task in tasks:
+                task.cancel()
+
+@app.post("/bulk/get-metric")
+async def bulk_get_metric(request: Request):
+    """
+    批量结构化查询
+
+    请求体为查询列表（JSON数组或 {"requests": [...]}），或Content-Type为application/x-ndjson的
+    逐行查询，每条查询包含ticker、metric、year和可选的form_type。结果以NDJSON流式返回，
+    每行带有对应查询的index；失败的查询带有status和error，不影响其他查询。
+    """
+    try:
+        raw_items = _parse_bulk_body(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"无法解析请求体: {str(e)}")
+    if len(raw_items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"单次最多{BULK_MAX_ITEMS}条查询")
+
+    return StreamingResponse(_bulk_lookup(raw_items), media_type="application/x-ndjson")
+
+class JobRequest(BaseModel):
+    """后台批量任务：显式的查询列表，或按 公司 × 指标 × 年份 展开"""
+    requests: Optional[List[MetricRequest]] = None
+    tickers: Optional[List[str]] = None  # 省略时为全部支持的公司
+    metrics: Optional[List[str]] = None  # 省略时为全部支持的指标
+    years: Optional[List[int]] = None
+    start_year: Optional[int] = None
+    end_year: Optional[int] = None
+    form_type: str = Field("10-K", pattern="^10-[KQ]$")
+
+def _expand_job(request: JobRequest) -> List[MetricRequest]:
+    """
+    把任务请求展开为结构化查询列表
+
+    Raises:
+        HTTPException: 没有查询、查询过多，或包含不支持的公司/指标
+    """
+    if request.requests is not None:
+        items = request.requests
+    else:
+        if request.years:
+            years = request.years
+        elif request.start_year is not None and request.end_year is not None:
+            if request.start_year > request.end_year:
+                raise HTTPException(status_code=422, detail="起始年份不能晚于结束年份")
+            years = list(range(request.start_year, request.end_year + 1))
+        else:
+            raise HTTPException(status_code=422, detail="请提供requests，或years / start_year和end_year")
+        tickers = request.tickers or list(TICKER_TO_CIK)
+        metrics = request.metrics or list(list_metrics())
+        if len(tickers) * len(metrics) * len(years) > JOB_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"单个任务最多{JOB_MAX_ITEMS}条查询")
+        items = [
+            MetricRequest(ticker=ticker, metric=metric, year=year, form_type=request.form_type)
+            for ticker in tickers
+            for metric in metrics
+            for year in years
+        ]
+
+    if not items:
+        raise HTTPException(status_code=422, detail="任务中没有查询")
+    if len(items) > JOB_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"单个任务最多{JOB_MAX_ITEMS}条查询")
+    unsupported = sorted(
+        {item.ticker.upper() for item in items if item.ticker.upper() not in TICKER_TO_CIK}
+        | {item.metric for item in items if resolve_metric(item.metric) is None}
+    )
+    if unsupported:
+        raise HTTPException(status_code=422, detail=f"不支持的股票代码或指标: {', '.join(unsupported)}")
+    return items
+
+def _job_filing_rows(filing_key: Tuple[str, int, str], members: List[Tuple[int, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    后台任务的处理函数：下载、解析一份财报，返回涉及它的每条查询的结果（在任务worker线程中执行）
+
+    SEC暂时不可用或上游过载时抛出异常，由任务队列稍后重试；其他错误直接记入结果。
+    """
+    members = [(index, MetricRequest.model_validate(item)) for index, item in members]
+    try:
+        facts = load_filing_facts(filing_key)
+    except Exception as e:
+        if isinstance(e, Overloaded) or is_transient_error(e):
+            raise
+        return _error_rows(members, e)
+    filing = get_cached_filing_metadata(*filing_key)
+    return [_row_from_facts(index, item, facts, filing) for index, item in members]
+
+_job_runner_instance: Optional[JobRunner] = None
+
+def _job_runner() -> JobRunner:
+    """本进程的任务worker池，首次使用时创建并启动（任务队列由所有worker进程共享）"""
+    global _job_runner_instance
+    if _job_runner_instance is None:
+        _job_runner_instance = JobRunner(JobStore(), _job_filing_rows)
+        _job_runner_instance.start()
+    return _job_runner_instance
+
+def _job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """任务状态的对外表示：不暴露服务器上的文件路径，完成后给出结果下载地址"""
+    view = {key: value for key, value in job.items() if key != "result_path"}
+    if job["status"] == "completed":
+        view["result_url"] = f"/jobs/{job['job_id']}/result"
+    return view
+
+async def _get_job(job_id: str) -> Dict[str, Any]:
+    job = await asyncio.to_thread(_job_runner().store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return job
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: JobRequest):
+    """
+    提交后台批量任务，适合无法在一次HTTP请求内完成的大批量查询
+
+    请求体为 {"requests": [...]}，或 {"tickers": [...], "metrics": [...], "start_year": ..., "end_year": ...}
+    （省略tickers/metrics表示全部支持的公司/指标）。立即返回任务ID，用 GET /jobs/{job_id} 查询进度，
+    完成后从 GET /jobs/{job_id}/result 下载NDJSON结果（按输入顺序，每行带index）。
+    同一份财报只下载、解析一次；任务保存在SQLite中，服务重启后继续执行。
+    """
+    items = _expand_job(request)
+    runner = _job_runner()
+    job_id = await asyncio.to_thread(
+        runner.submit,
+        [((item.ticker.upper(), item.year, item.form_type), {**item.model_dump(), "ticker": item.ticker.upper()}) for item in items]
+    )
+    job = await asyncio.to_thread(runner.store.get, job_id)
+    return JSONResponse(_job_view(job), status_code=202, headers={"Location": f"/jobs/{job_id}"})
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """任务状态和进度：total、done、failed、progress，完成后带result_url"""
+    return _job_view(await _get_job(job_id))
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    """下载已完成任务的结果文件（NDJSON）"""
+    job = await _get_job(job_id)
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"任务尚未完成: {job['status']}")
+    return FileResponse(job["result_path"], media_type="application/x-ndjson", filename=f"{job_id}.ndjson")
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """取消尚未完成的任务（正在处理的财报仍会完成）"""
+    await _get_job(job_id)
+    if not await asyncio.to_thread(_job_runner().store.cancel, job_id):
+        raise HTTPException(status_code=409, detail="任务已结束，无法取消")
+    return _job_view(await _get_job(job_id))
+
+def _llm_unavailable() -> bool:
+    """使用OpenAI后端但没有配置API密钥（回放录制的LLM回复时不需要密钥）"""
+    return LLM_BACKEND.lower() == "openai" and RECORDING_MODE != "replay" and not OPENAI_API_KEY
+
+def _llm_unavailable_result(text: str) -> Dict[str, Any]:
+    return {"query": text, "error": "未配置OpenAI API密钥", "success": False}
+
+@app.post("/query")
+async def query(request: QueryRequest):
+    """自然语言查询，走完整的LangGraph工作流"""
+    if _llm_unavailable():
+        # 服务本身正常（结构化查询仍可用），只是自然语言查询暂不可用
+        return JSONResponse(_llm_unavailable_result(request.text), status_code=503)
+    result = await process_query_with_langgraph(request.text, request_id=request.request_id)
+    if result.get("retry_after") is not None:
+        # 上游过载被拒绝：429 + Retry-After，客户端和负载均衡器可以据此退避
+        retry_after = str(max(1, math.ceil(result["retry_after"])))
+        return JSONResponse(result, status_code=429, headers={"Retry-After": retry_after})
+    return result
+
+@app.post("/query/stream")
+async def query_stream(request: QueryRequest):
+    """
+    自然语言查询，每个阶段完成后立即输出一行JSON（NDJSON）：
+    parsed_intent、filing（单点查询）和最终的result。客户端断开时剩余的工作会被取消。
+    """
+    if _llm_unavailable():
+        # 开始输出之前就能确定，用503状态码，事件格式不变
+        event = _ndjson({"event": "result", "data": _llm_unavailable_result(request.text)})
+        return StreamingResponse(iter([event]), status_code=503, media_type="application/x-ndjson")
+
+    async def events():
+        async for event in stream_query_with_langgraph(request.text):
+            yield _ndjson(event)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+if __name__ == "__main__":
+    import uvicorn
+    # 多个worker进程默认共享同一个SQLite缓存，一个进程下载的财报其他进程直接复用（环境变量由worker继承）
+    if API_WORKERS > 1:
+        os.environ.setdefault("SHARED_CACHE", "sqlite")
+    # 多个worker需要以导入字符串的形式传入应用
+    uvicorn.run("src.orchestrator:app", host=API_HOST, port=API_PORT, workers=API_WORKERS)
@@ -0,0 +1,97 @@
+"""
+Cheap rule-based extraction of query slots (company, metric, year, form type).
+
+These helpers only look for literal tickers, company names, metric aliases and
+four-digit years; they are used where a best-effort guess is enough without
+calling the LLM (e.g. the offline LLM backend).
+"""
+
+import re
+from typing import List, Optional
+
+from .config import TICKER_TO_CIK, COMPANY_ALIASES
+from .metrics_manager import list_metrics, normalize_alias
+
+_TICKER_PATTERN = re.compile(r"\b[A-Z]{1,5}\b")
+_YEAR_PATTERN = re.compile(r"(?<!\d)((?:19|20)\d{2})(?!\d)")
+_YEAR_RANGE_PATTERN = re.compile(
+    r"(?<!\d)((?:19|20)\d{2})\s*(?:-|–|~|to|through|到|至)\s*((?:19|20)\d{2})(?!\d)",
+    re.IGNORECASE
+)
+_QUARTERLY_PATTERN = re.compile(r"10-?Q|quarter|季度|季报", re.IGNORECASE)
+
+def _company_patterns():
+    for ticker, names in COMPANY_ALIASES.items():
+        for name in names:
+            if name.isascii():
+                yield ticker, re.compile(rf"\b{re.escape(name)}\b", re.IGNORECASE)
+            else:
+                yield ticker, re.compile(re.escape(name))
+
+_COMPANY_PATTERNS = list(_company_patterns())
+
+def detect_tickers(query: str) -> List[str]:
+    """Returns the supported tickers mentioned in query (by ticker or company name), in order of appearance."""
+    matches = []
+    for match in _TICKER_PATTERN.finditer(query):
+        if match.group() in TICKER_TO_CIK:
+            matches.append((match.start(), match.group()))
+    for ticker, pattern in _COMPANY_PATTERNS:
+        match = pattern.search(query)
+        if match:
+            matches.append((match.start(), ticker))
+
+    tickers = []
+    for _, ticker in sorted(matches):
+        if ticker not in tickers:
+            tickers.append(ticker)
+    return tickers
+
+def detect_ticker(query: str) -> Optional[str]:
+    """Returns the first supported ticker mentioned in query, or None."""
+    tickers = detect_tickers(query)
+    return tickers[0] if tickers else None
+
+def detect_years(query: str) -> List[int]:
+    """Returns the years mentioned in query in ascending order; ranges like '2019-2023' are expanded."""
+    years = set()
+    for match in _YEAR_RANGE_PATTERN.finditer(query):
+        start, end = sorted((int(match.group(1)), int(match.group(2))))
+        years.update(range(start, end + 1))
+    years.update(int(year) for year in _YEAR_PATTERN.findall(query))
+    return sorted(years)
+
+def detect_form_type(query: str) -> str:
+    """Returns '10-Q' if query asks for quarterly data, '10-K' otherwise."""
+    return "10-Q" if _QUARTERLY_PATTERN.search(query) else "10-K"
+
+def detect_metrics(query: str) -> List[str]:
+    """
+    Returns the canonical metrics whose name or alias appears in query, in order of appearance.
+    Longer aliases win over shorter ones they contain ("net income" over "income").
+    """
+    text = normalize_alias(query)
+    aliases = []
+    for metric, definition in list_metrics().items():
+        for alias in [metric, *definition.get("aliases", [])]:
+            normalized = normalize_alias(alias)
+            if normalized:
+                aliases.append((normalized, metric))
+    aliases.sort(key=lambda item: -len(item[0]))
+
+    taken = [False] * len(text)
+    found = []
+    for alias, metric in aliases:
+        start = text.find(alias)
+        while start != -1:
+            end = start + len(alias)
+            if not any(taken[start:end]):
+                taken[start:end] = [True] * len(alias)
+                found.append((start, metric))
+            start = text.find(alias, end)
+
+    metrics = []
+    for _, metric in sorted(found):
+        if metric not in metrics:
+            metrics.append(metric)
+    return metrics
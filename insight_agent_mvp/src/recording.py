@@ -0,0 +1,151 @@
+"""
+Record/replay of upstream traffic, for reproducible offline benchmarks.
+
+With RECORDING_MODE=record, every SEC HTTP response and every LLM completion of a
+live run is saved to a fixture store under RECORDING_PATH. With RECORDING_MODE=replay
+the same calls are answered from the store instead: no network, SEC rate limit or API
+key is involved, so a recorded eval or benchmark can be rerun on an air-gapped box
+(copy the directory over).
+
+Replayed calls sleep for REPLAY_LATENCY: a fixed number of milliseconds, or "recorded"
+to reproduce the duration each call took when it was captured. A call whose timeout
+is shorter than that delay times out like the live call would.
+
+A call with no recording raises FixtureMissing; it is not retried.
+
+Store layout (one file per call, written atomically, safe for concurrent writers):
+    http/<key>.json     url, status, encoding, content type and duration
+    http/<key>.body.gz  response body
+    llm/<key>.json      prompt, reply message and duration
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .config import RECORDING_PATH, REPLAY_LATENCY
+
+class FixtureMissing(LookupError):
+    """Replay mode was asked for a call that was never recorded."""
+
+def fixture_key(*parts: str) -> str:
+    """Stable file name for a call identified by parts (URL, prompt messages, tool names)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:40]
+
+class FixtureStore:
+    """Recorded calls in a directory, grouped by kind ("http", "llm")."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _file(self, kind: str, key: str, suffix: str) -> str:
+        return os.path.join(self.path, kind, key + suffix)
+
+    def _write(self, path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def save(self, kind: str, key: str, record: Dict[str, Any], body: Optional[bytes] = None) -> None:
+        """Stores one call; body (if any) is kept gzip-compressed next to the record."""
+        if body is not None:
+            self._write(self._file(kind, key, ".body.gz"), gzip.compress(body))
+        # The record goes last, so a reader never sees a record whose body is still being written
+        self._write(self._file(kind, key, ".json"), json.dumps(record, ensure_ascii=False).encode("utf-8"))
+
+    def load(self, kind: str, key: str) -> Optional[Dict[str, Any]]:
+        """The stored record, or None if the call was not recorded."""
+        try:
+            with open(self._file(kind, key, ".json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load_body(self, kind: str, key: str) -> bytes:
+        with open(self._file(kind, key, ".body.gz"), "rb") as f:
+            return gzip.decompress(f.read())
+
+_store: Optional[FixtureStore] = None
+_store_lock = threading.Lock()
+
+def fixture_store() -> FixtureStore:
+    """The process-wide store at RECORDING_PATH."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FixtureStore(RECORDING_PATH)
+        return _store
+
+def set_fixture_store(store: Optional[FixtureStore]) -> None:
+    """Points recording and replay at another store (None: back to RECORDING_PATH)."""
+    global _store
+    with _store_lock:
+        _store = store
+
+def replay_delay(record: Dict[str, Any]) -> float:
+    """Seconds a replayed call sleeps, per REPLAY_LATENCY."""
+    if REPLAY_LATENCY.strip().lower() == "recorded":
+        return record.get("elapsed_ms", 0) / 1000
+    return max(0.0, float(REPLAY_LATENCY or 0)) / 1000
+
+def record_http(url: str, response: requests.Response, elapsed: float) -> None:
+    """
+    Saves a live SEC response (error statuses included, so replay fails the same way).
+    Reads the whole body if it was streamed; the response remains usable afterwards.
+    """
+    body = response.content
+    fixture_store().save("http", fixture_key(url), {
+        "url": url,
+        "status": response.status_code,
+        "reason": response.reason,
+        "encoding": response.encoding,
+        "content_type": response.headers.get("Content-Type"),
+        "elapsed_ms": round(elapsed * 1000, 3),
+    }, body)
+
+def replay_http(url: str, timeout: Optional[float] = None) -> requests.Response:
+    """
+    Serves a recorded SEC response for url, after the replay delay.
+
+    Raises:
+        FixtureMissing: If url was never recorded
+        requests.Timeout: If the delay exceeds timeout
+    """
+    store = fixture_store()
+    key = fixture_key(url)
+    record = store.load("http", key)
+    if record is None:
+        raise FixtureMissing(f"No recorded SEC response for {url}")
+
+    delay = replay_delay(record)
+    if timeout is not None and delay > timeout:
+        time.sleep(timeout)
+        raise requests.Timeout(f"Replayed SEC request timed out after {timeout:.3f}s")
+    if delay:
+        time.sleep(delay)
+
+    response = requests.Response()
+    response.url = url
+    response.status_code = record["status"]
+    response.reason = record.get("reason")
+    response.encoding = record.get("encoding")
+    if record.get("content_type"):
+        response.headers = CaseInsensitiveDict({"Content-Type": record["content_type"]})
+    response._content = store.load_body("http", key)
+    # Marks the body as already read, so iter_content() serves it from memory
+    response._content_consumed = True
+    return response
@@ -1,17 +1,145 @@
 import requests
+import threading
 import time
-from typing import Optional
+from typing import Callable, Optional
+from .cache import LRUCache, shared_backend
+from .telemetry import span, annotate
+from .deadline import DeadlineExceeded, check_deadline, current_deadline, remaining_time
+from .admission import upstream_slot
+from .recording import record_http, replay_http
 from .config import (
     TICKER_TO_CIK, 
     SEC_BASE_URL, 
     SEC_EDGAR_URL, 
     SEC_USER_AGENT, 
-    SEC_REQUEST_DELAY
+    SEC_REQUEST_DELAY,
+    SEC_HTTP_TIMEOUT,
+    SEC_DOWNLOAD_CHUNK_SIZE,
+    SUBMISSIONS_CACHE_TTL,
+    FILING_CACHE_SIZE,
+    COMPANY_FACTS_CACHE_SIZE,
+    RECORDING_MODE
 )
 
 # SEC requires a custom User-Agent for all programmatic requests.
 HEADERS = {'User-Agent': SEC_USER_AGENT}
 
+# Shared across threads so concurrent callers (e.g. batch queries) stay under the SEC rate limit together.
+_rate_limit_lock = threading.Lock()
+_last_request_time = 0.0
+
+def _throttle() -> None:
+    """
+    Blocks until at least SEC_REQUEST_DELAY seconds have passed since the previous SEC request
+    issued by any thread in this process.
+    """
+    global _last_request_time
+    with _rate_limit_lock:
+        check_deadline()
+        wait = _last_request_time + SEC_REQUEST_DELAY - time.monotonic()
+        if wait > 0:
+            remaining = remaining_time()
+            if remaining is not None and remaining < wait:
+                raise DeadlineExceeded("Query deadline would pass while waiting for the SEC rate limit")
+            time.sleep(wait)
+        _last_request_time = time.monotonic()
+
+# Submissions indexes change when a company files something new, so they expire;
+# a filing document never changes once published.
+# Downloads are also kept in the shared cache tier when SHARED_CACHE is set, so the
+# other worker processes on this host reuse them instead of downloading again.
+_submissions_cache = LRUCache(
+    maxsize=len(TICKER_TO_CIK) * 4, ttl=SUBMISSIONS_CACHE_TTL, backend=shared_backend(), namespace="submissions"
+)
+_filing_cache = LRUCache(maxsize=FILING_CACHE_SIZE, backend=shared_backend(), namespace="filing")
+# Shared too: a process that gets a filing from the shared tier needs its metadata (accession number,
+# dates) for ETags and result caching without resolving it again.
+_filing_metadata_cache = LRUCache(
+    maxsize=FILING_CACHE_SIZE * 32, backend=shared_backend(), namespace="filing_metadata"
+)
+# Company facts grow with every new filing, so they expire like submissions indexes.
+_company_facts_cache = LRUCache(
+    maxsize=COMPANY_FACTS_CACHE_SIZE, ttl=SUBMISSIONS_CACHE_TTL, backend=shared_backend(), namespace="company_facts"
+)
+
+def clear_cache() -> None:
+    """Drops all cached submissions indexes, filing metadata, filing documents and company facts."""
+    _submissions_cache.clear()
+    _filing_cache.clear()
+    _filing_metadata_cache.clear()
+    _company_facts_cache.clear()
+
+def _sec_get(url: str) -> requests.Response:
+    """
+    Issues a rate-limited GET request against SEC endpoints.
+    
+    Inside a query deadline the timeout is capped by the time left, and the body is
+    streamed in chunks with a deadline check between them, so a slow or cancelled
+    download stops early instead of holding the worker.
+    
+    With RECORDING_MODE=record each response is also saved to the fixture store; with
+    RECORDING_MODE=replay it is served from there without the rate limit (see recording.py).
+    
+    Raises:
+        requests.HTTPError: If SEC responds with an error status
+        DeadlineExceeded: If the query deadline passes or the query is cancelled
+        Overloaded: If too many requests are already queued for SEC to serve this one in time
+        FixtureMissing: If replaying and the request was never recorded
+    """
+    with span("sec.http", url=url) as record, upstream_slot("sec"):
+        deadline = current_deadline()
+        if RECORDING_MODE == "replay":
+            check_deadline()
+            response = replay_http(url, timeout=remaining_time(SEC_HTTP_TIMEOUT))
+        else:
+            _throttle()
+            started = time.monotonic()
+            response = requests.get(
+                url,
+                headers=HEADERS,
+                timeout=remaining_time(SEC_HTTP_TIMEOUT),
+                stream=deadline is not None
+            )
+            if RECORDING_MODE == "record":
+                record_http(url, response, time.monotonic() - started)
+        response.raise_for_status()
+        if deadline is not None:
+            _read_body(response)
+        if record is not None:
+            record["attributes"].update(status=response.status_code, bytes=len(response.content))
+        return response
+
+# HTTP statuses EDGAR returns for overload or rate limiting; the same request usually succeeds shortly after.
+_TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Whether an exception raised by a SEC request is worth retrying: connection
+    failures, dropped downloads, HTTP timeouts and overload/rate-limit statuses.
+    Query deadlines, missing filings and other client errors are not.
+    """
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in _TRANSIENT_STATUS_CODES
+    return isinstance(error, (
+        requests.ConnectionError,
+        requests.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    ))
+
+def _read_body(response: requests.Response) -> None:
+    """
+    Reads a streamed response body chunk by chunk, checking the query deadline in between.
+    The body ends up where requests keeps it, so .text/.json() work as usual afterwards.
+    """
+    chunks = []
+    try:
+        for chunk in response.iter_content(chunk_size=SEC_DOWNLOAD_CHUNK_SIZE):
+            check_deadline()
+            chunks.append(chunk)
+    finally:
+        response.close()
+    response._content = b"".join(chunks)
+
 def get_filing_html(ticker: str, year: int, form_type: str = "10-K") -> str:
     """
     Fetches the HTML content of a specific filing for a given ticker, year, and form type.
@@ -31,35 +159,246 @@ def get_filing_html(ticker: str, year: int, form_type: str = "10-K") -> str:
     if ticker.upper() not in TICKER_TO_CIK:
         raise ValueError(f"Ticker {ticker} not found in CIK mapping. Supported tickers: {list(TICKER_TO_CIK.keys())}")
 
+    with span("sec.get_filing_html", ticker=ticker.upper(), year=year, form_type=form_type):
+        downloaded = []
+        
+        def download():
+            downloaded.append(True)
+            return _download_filing_html(ticker, year, form_type)
+        
+        html_content = _filing_cache.get_or_compute((ticker.upper(), year, form_type), download)
+        annotate(cache="miss" if downloaded else "hit", bytes=len(html_content))
+        if not downloaded:
+            ensure_filing_metadata(ticker, year, form_type)
+        return html_content
+
+def _get_submissions(cik: str) -> dict:
+    """
+    Returns the (cached) submissions history for a company.
+    
+    Args:
+        cik: 10-digit CIK of the company
+    """
+    submissions_url = f"{SEC_BASE_URL}/submissions/CIK{cik}.json"
+    with span("sec.submissions", cik=cik):
+        fetched = []
+        
+        def fetch():
+            fetched.append(True)
+            return _sec_get(submissions_url).json()
+        
+        submissions_data = _submissions_cache.get_or_compute(cik, fetch)
+        annotate(cache="miss" if fetched else "hit")
+        return submissions_data
+
+def get_company_facts(ticker: str) -> dict:
+    """
+    Returns the (cached) XBRL company facts for a company: every fact it has reported in
+    any filing, keyed by taxonomy and concept, from SEC's companyfacts API. One request
+    covers all years and metrics, so it is much cheaper than downloading filings when
+    many values of one company are needed.
+    
+    Args:
+        ticker: Company ticker symbol (e.g., 'AAPL')
+    
+    Raises:
+        ValueError: If ticker is not supported
+        requests.HTTPError: If SEC has no company facts for the company
+    """
+    if ticker.upper() not in TICKER_TO_CIK:
+        raise ValueError(f"Ticker {ticker} not found in CIK mapping. Supported tickers: {list(TICKER_TO_CIK.keys())}")
+    
     cik = TICKER_TO_CIK[ticker.upper()]
+    company_facts_url = f"{SEC_BASE_URL}/api/xbrl/companyfacts/CIK{cik}.json"
+    with span("sec.company_facts", cik=cik):
+        fetched = []
+        
+        def fetch():
+            fetched.append(True)
+            return _sec_get(company_facts_url).json()
+        
+        company_facts = _company_facts_cache.get_or_compute(cik, fetch)
+        annotate(cache="miss" if fetched else "hit")
+        return company_facts
+
+def find_filing(ticker: str, year: int, form_type: str = "10-K") -> dict:
+    """
+    Resolves the metadata of a filing without downloading the document itself.
+    
+    Args:
+        ticker: Company ticker symbol (e.g., 'AAPL')
+        year: The year of the filing (e.g., 2023)
+        form_type: Type of filing (default: "10-K")
+    
+    Returns:
+        Dict with ticker, cik, form_type, year, accession_number, primary_document,
+        filing_date, report_date and url
+    
+    Raises:
+        ValueError: If ticker is not supported
+        FileNotFoundError: If no filing found for the specified criteria
+    """
+    if ticker.upper() not in TICKER_TO_CIK:
+        raise ValueError(f"Ticker {ticker} not found in CIK mapping. Supported tickers: {list(TICKER_TO_CIK.keys())}")
+    
+    return _filing_metadata_cache.get_or_compute(
+        (ticker.upper(), year, form_type),
+        lambda: _locate_filing(ticker.upper(), year, form_type)
+    )
+
+def get_cached_filing_metadata(ticker: str, year: int, form_type: str = "10-K") -> Optional[dict]:
+    """
+    Returns the filing metadata resolved by an earlier find_filing()/get_filing_html() call,
+    or None if it is not cached. Never touches the network.
+    """
+    return _filing_metadata_cache.get((ticker.upper(), year, form_type))
+
+def ensure_filing_metadata(ticker: str, year: int, form_type: str = "10-K") -> None:
+    """
+    Makes sure get_cached_filing_metadata() has the metadata of a filing whose document
+    (or parsed facts) came from a cache, e.g. downloaded by another worker process and
+    the metadata entry since evicted from the shared tier. Resolves it with find_filing()
+    if needed, which only reads the cached submissions index in the common case.
+
+    The metadata is optional for callers, so this never raises.
+    """
+    if get_cached_filing_metadata(ticker, year, form_type) is not None:
+        return
+    try:
+        find_filing(ticker, year, form_type)
+    except Exception as e:
+        annotate(metadata_error=type(e).__name__)
+
+def prefetch_filing_metadata(
+    ticker: str,
+    year: Optional[int] = None,
+    form_type: str = "10-K",
+    cancelled: Optional[Callable[[], bool]] = None
+) -> None:
+    """
+    Speculatively warms the caches a later lookup of this filing will need: the
+    company's submissions index and, if year is given, the filing metadata.
+
+    Meant to run in the background while the query is still being parsed, so it
+    never raises. cancelled is checked between steps so work the caller no longer
+    wants can be skipped; a step already in flight finishes and stays cached.
+    """
+    if ticker.upper() not in TICKER_TO_CIK:
+        return
+
+    with span("sec.prefetch", ticker=ticker.upper(), year=year, form_type=form_type):
+        try:
+            _get_submissions(TICKER_TO_CIK[ticker.upper()])
+            if year is None or (cancelled is not None and cancelled()):
+                annotate(completed=year is None)
+                return
+            find_filing(ticker, year, form_type)
+            annotate(completed=True)
+        except Exception as e:
+            annotate(error=type(e).__name__)
+
+def find_latest_amendment(ticker: str, year: int, form_type: str = "10-K") -> Optional[dict]:
+    """
+    Finds the most recent amendment (e.g. 10-K/A) filed after the original filing.
+    
+    An amendment matches when it covers the same report date as the original filing
+    (or, if SEC did not publish a report date, simply when it was filed later).
+    Only the company's recent filings are searched, which is where a newer amendment
+    of a known filing always appears.
+    
+    Returns:
+        Dict of form_type, accession_number, primary_document, filing_date, report_date
+        and url, or None
+    """
+    original = find_filing(ticker, year, form_type)
+    recent_filings = _get_submissions(original["cik"]).get('filings', {}).get('recent', {})
+    
+    forms = recent_filings.get('form', [])
+    filing_dates = recent_filings.get('filingDate', [])
+    report_dates = recent_filings.get('reportDate', [])
+    accession_numbers = recent_filings.get('accessionNumber', [])
+    primary_documents = recent_filings.get('primaryDocument', [])
+    
+    latest = None
+    for i in range(min(len(forms), len(filing_dates), len(accession_numbers), len(primary_documents))):
+        if forms[i] != f"{form_type}/A" or filing_dates[i] <= original["filing_date"]:
+            continue
+        report_date = report_dates[i] if i < len(report_dates) else None
+        if original["report_date"] and report_date and report_date != original["report_date"]:
+            continue
+        if latest is None or filing_dates[i] > latest["filing_date"]:
+            accession_number = accession_numbers[i].replace('-', '')
+            latest = {
+                "form_type": forms[i],
+                "accession_number": accession_number,
+                "primary_document": primary_documents[i],
+                "filing_date": filing_dates[i],
+                "report_date": report_date,
+                "url": f"{SEC_EDGAR_URL}/{int(original['cik'])}/{accession_number}/{primary_documents[i]}"
+            }
+    
+    return latest
+
+def get_amendment_html(ticker: str, amendment: dict) -> str:
+    """
+    Fetches the primary document of an amendment found by find_latest_amendment().
+    
+    The document is cached under its accession number: a published filing never
+    changes, so a newer amendment simply gets an entry of its own and the original
+    filing's cache entry stays valid.
+    """
+    with span("sec.get_amendment_html", ticker=ticker.upper(), accession_number=amendment["accession_number"]):
+        downloaded = []
+        
+        def download():
+            downloaded.append(True)
+            with span("sec.download", accession_number=amendment["accession_number"]):
+                return _sec_get(amendment["url"]).text
+        
+        html_content = _filing_cache.get_or_compute((ticker.upper(), amendment["accession_number"]), download)
+        annotate(cache="miss" if downloaded else "hit", bytes=len(html_content))
+        return html_content
+
+def _locate_filing(ticker: str, year: int, form_type: str) -> dict:
+    """
+    Finds a filing in the company's submissions history and builds its metadata.
+    """
+    cik = TICKER_TO_CIK[ticker]
     
     # 1. Get the submissions history for the company.
-    submissions_url = f"{SEC_BASE_URL}/submissions/CIK{cik}.json"
-    response = requests.get(submissions_url, headers=HEADERS)
-    response.raise_for_status()
-    submissions_data = response.json()
+    submissions_data = _get_submissions(cik)
     
     # 2. Find the filing that matches the specified year and form type
     target_filing = _find_filing_by_year_and_type(submissions_data, year, form_type)
     
     if not target_filing:
         raise FileNotFoundError(f"No {form_type} found for {ticker} in year {year}.")
-
-    accession_number, primary_document = target_filing
     
     # 3. Construct the URL for the actual HTML filing.
-    filing_url = f"{SEC_EDGAR_URL}/{int(cik)}/{accession_number}/{primary_document}"
+    filing_url = f"{SEC_EDGAR_URL}/{int(cik)}/{target_filing['accession_number']}/{target_filing['primary_document']}"
     
-    # Add a small delay to respect SEC rate limits
-    time.sleep(SEC_REQUEST_DELAY)
+    return {
+        "ticker": ticker,
+        "cik": cik,
+        "form_type": form_type,
+        "year": year,
+        **target_filing,
+        "url": filing_url
+    }
+
+def _download_filing_html(ticker: str, year: int, form_type: str) -> str:
+    """
+    Locates a filing in the company's submissions history and downloads its primary document.
+    """
+    filing = find_filing(ticker, year, form_type)
     
-    # 4. Download the HTML content.
-    filing_response = requests.get(filing_url, headers=HEADERS)
-    filing_response.raise_for_status()
+    # Download the HTML content.
+    with span("sec.download", accession_number=filing["accession_number"]):
+        filing_response = _sec_get(filing["url"])
     
     return filing_response.text
 
-def _find_filing_by_year_and_type(submissions_data: dict, target_year: int, form_type: str) -> Optional[tuple]:
+def _find_filing_by_year_and_type(submissions_data: dict, target_year: int, form_type: str) -> Optional[dict]:
     """
     Helper function to find a filing by year and form type from submissions data.
     
@@ -69,7 +408,7 @@ def _find_filing_by_year_and_type(submissions_data: dict, target_year: int, form
         form_type: The form type to search for (e.g., "10-K", "10-Q")
     
     Returns:
-        Tuple of (accession_number, primary_document) if found, None otherwise
+        Dict of accession_number, primary_document, filing_date and report_date if found, None otherwise
     """
     # First, check recent filings
     recent_filings = submissions_data.get('filings', {}).get('recent', {})
@@ -84,22 +423,21 @@ def _find_filing_by_year_and_type(submissions_data: dict, target_year: int, form
             # Download and search the archived filing data
             archive_url = f"{SEC_BASE_URL}/submissions/{file_info['name']}"
             try:
-                response = requests.get(archive_url, headers=HEADERS)
-                response.raise_for_status()
-                archive_data = response.json()
+                archive_data = _submissions_cache.get_or_compute(
+                    file_info['name'],
+                    lambda: _sec_get(archive_url).json()
+                )
                 
                 result = _search_filings_in_data(archive_data, target_year, form_type)
                 if result:
                     return result
-                    
-                time.sleep(SEC_REQUEST_DELAY)  # Rate limiting
             except Exception as e:
                 print(f"Warning: Could not fetch archive file {file_info['name']}: {e}")
                 continue
     
     return None
 
-def _search_filings_in_data(filings_data: dict, target_year: int, form_type: str) -> Optional[tuple]:
+def _search_filings_in_data(filings_data: dict, target_year: int, form_type: str) -> Optional[dict]:
     """
     Search for a filing in a filings data structure.
     
@@ -109,10 +447,11 @@ def _search_filings_in_data(filings_data: dict, target_year: int, form_type: str
         form_type: The form type to search for
     
     Returns:
-        Tuple of (accession_number, primary_document) if found, None otherwise
+        Dict of accession_number, primary_document, filing_date and report_date if found, None otherwise
     """
     forms = filings_data.get('form', [])
     filing_dates = filings_data.get('filingDate', [])
+    report_dates = filings_data.get('reportDate', [])
     accession_numbers = filings_data.get('accessionNumber', [])
     primary_documents = filings_data.get('primaryDocument', [])
     
@@ -129,9 +468,12 @@ def _search_filings_in_data(filings_data: dict, target_year: int, form_type: str
                 
                 # Check if year matches
                 if filing_year == target_year:
-                    accession_number = accession_numbers[i].replace('-', '')
-                    primary_document = primary_documents[i]
-                    return (accession_number, primary_document)
+                    return {
+                        "accession_number": accession_numbers[i].replace('-', ''),
+                        "primary_document": primary_documents[i],
+                        "filing_date": filing_dates[i],
+                        "report_date": report_dates[i] if i < len(report_dates) else None
+                    }
     
     return None
 
@@ -0,0 +1,127 @@
+"""
+Timing spans for the query workflow.
+
+Spans are only recorded while a trace is active (see start_trace()); without one,
+span() and annotate() return immediately, so instrumented code costs next to nothing
+when tracing is disabled. The trace travels in a context variable, which asyncio
+and LangGraph copy into the worker threads that run sync nodes.
+"""
+
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("insight_agent_trace", default=None)
+_current_span: ContextVar[Optional[Dict[str, Any]]] = ContextVar("insight_agent_span", default=None)
+_span_ids = itertools.count(1)
+_sinks: List[Callable[[Dict[str, Any]], None]] = []
+
+class Trace:
+    """The spans recorded while handling one query."""
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.spans: List[Dict[str, Any]] = []
+        self._start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the trace started."""
+        return (time.perf_counter() - self._start) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the trace as plain data, spans ordered by start time."""
+        return {
+            "name": self.name,
+            "attributes": self.attributes,
+            "duration_ms": self.duration_ms if self.duration_ms is not None else self.elapsed_ms(),
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+        }
+
+def add_sink(sink: Callable[[Dict[str, Any]], None]) -> None:
+    """
+    Registers a callable that receives every finished trace (as returned by Trace.to_dict()).
+    While at least one sink is registered, every query is traced.
+    """
+    _sinks.append(sink)
+
+def remove_sink(sink: Callable[[Dict[str, Any]], None]) -> None:
+    """Unregisters a sink added with add_sink()."""
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+def sinks() -> List[Callable[[Dict[str, Any]], None]]:
+    """The registered sinks, in registration order."""
+    return list(_sinks)
+
+def has_sinks() -> bool:
+    """Whether any metrics sink is registered."""
+    return bool(_sinks)
+
+def current_trace() -> Optional[Trace]:
+    """The trace active in this context, if any."""
+    return _current_trace.get()
+
+@contextmanager
+def start_trace(name: str, **attributes) -> Iterator[Trace]:
+    """
+    Activates a new trace for the enclosed block and hands it to all sinks when the block exits.
+    A sink that raises is ignored so exporting can never break a query.
+    """
+    trace = Trace(name, **attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.duration_ms = trace.elapsed_ms()
+        if _sinks:
+            exported = trace.to_dict()
+            for sink in list(_sinks):
+                try:
+                    sink(exported)
+                except Exception as e:
+                    print(f"Warning: metrics sink {sink} failed: {e}")
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Dict[str, Any]]]:
+    """
+    Times the enclosed block as a child of the current span.
+
+    Yields the span record (or None when no trace is active); attributes can be added to it
+    directly or with annotate(). An exception escaping the block is recorded as the
+    span's 'error' attribute and re-raised.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    record = {
+        "id": next(_span_ids),
+        "parent_id": parent["id"] if parent else None,
+        "name": name,
+        "start_ms": trace.elapsed_ms(),
+        "duration_ms": None,
+        "attributes": dict(attributes),
+    }
+    token = _current_span.set(record)
+    try:
+        yield record
+    except BaseException as e:
+        record["attributes"]["error"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        record["duration_ms"] = trace.elapsed_ms() - record["start_ms"]
+        trace.spans.append(record)
+
+def annotate(**attributes) -> None:
+    """Adds attributes (bytes downloaded, cache hit/miss, ...) to the current span, if any."""
+    record = _current_span.get()
+    if record is not None:
+        record["attributes"].update(attributes)
@@ -1,35 +1,259 @@
 from bs4 import BeautifulSoup
-from typing import Tuple, Optional
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Tuple, Optional
 from .config import TARGET_XBRL_TAG, XBRL_PARSER
+from .telemetry import span, annotate
+from .deadline import check_deadline
+
+def _get_ix_attribute(element, name: str) -> Optional[str]:
+    """
+    Reads an iXBRL attribute such as 'unitRef'. The XML parser keeps attribute case,
+    so the lowercase spelling used by some hand-written documents is accepted as well.
+    """
+    return element.get(name) or element.get(name.lower())
+
+# Display text iXBRL uses for a zero value (ixt:fixed-zero / ixt:zerodash)
+_ZERO_TEXTS = {"-", "–", "—"}
+
+def normalize_fact_value(text: str, scale: Optional[str] = None, sign: Optional[str] = None) -> str:
+    """
+    Turns the display text of an ix:nonFraction fact into its full value, in the same
+    form the companyfacts API reports ("383285000000", "6.13"): thousands separators
+    are dropped, the 'scale' attribute is applied (display "383,285" with scale="6" is
+    383285000000) and sign="-" negates it. Text that is not a number is returned as is.
+    """
+    cleaned = "".join(text.replace(",", "").split())
+    if cleaned in _ZERO_TEXTS:
+        number = Decimal(0)
+    else:
+        try:
+            number = Decimal(cleaned)
+        except InvalidOperation:
+            return text
+    if scale:
+        try:
+            number = number.scaleb(int(scale))
+        except ValueError:
+            return text
+    if sign == "-":
+        number = -number
+    if number == number.to_integral_value():
+        return str(int(number))
+    return format(number.normalize(), "f")
+
+def _fact_value(element) -> str:
+    """Full value of an ix:nonFraction element (see normalize_fact_value)."""
+    return normalize_fact_value(
+        element.get_text(strip=True),
+        _get_ix_attribute(element, 'scale'),
+        element.get('sign')
+    )
 
 def extract_metric_from_html(html_content: str, metric_tag: str) -> Optional[Tuple[str, str]]:
     """
     Parses HTML content to find the iXBRL tag for a specified metric and returns its value and unit.
-    
+
     Args:
         html_content: The HTML content to parse
         metric_tag: The XBRL tag to search for (e.g., 'us-gaap:Revenues', 'us-gaap:NetIncomeLoss')
-    
+
     Returns:
-        Tuple of (value, unit) if found, None otherwise
+        Tuple of (value, unit) if found, None otherwise. The value is the full number with
+        the tag's scale and sign applied, comparable with companyfacts values.
     """
-    soup = BeautifulSoup(html_content, "xml")
-    
-    # Find the iXBRL tag for the specified metric. The tag name is 'ix:nonFraction'.
-    # The 'name' attribute corresponds to the XBRL concept.
-    metric_tag_element = soup.find('ix:nonFraction', {'name': metric_tag})
+    with span("xbrl.parse", tag=metric_tag, bytes=len(html_content)):
+        check_deadline()
+        soup = BeautifulSoup(html_content, "xml")
+        check_deadline()
+        
+        # Find the iXBRL tag for the specified metric. The tag name is 'ix:nonFraction'.
+        # The 'name' attribute corresponds to the XBRL concept.
+        metric_tag_element = soup.find('ix:nonFraction', {'name': metric_tag})
+        annotate(found=metric_tag_element is not None)
     
     if not metric_tag_element:
         return None
         
-    # The value is the text content of the tag.
-    value = metric_tag_element.get_text(strip=True)
+    # The value is the text content of the tag, scaled as its attributes say.
+    value = _fact_value(metric_tag_element)
     
-    # The unit is usually in the 'unitref' attribute of the tag.
-    unit_ref = metric_tag_element.get('unitref')
+    # The unit is usually in the 'unitRef' attribute of the tag.
+    unit_ref = _get_ix_attribute(metric_tag_element, 'unitRef')
     
     return value, unit_ref
 
+def extract_facts_from_html(html_content: str) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    Parses HTML content once and indexes every iXBRL numeric fact by its XBRL concept name.
+    
+    Only the first occurrence of each concept is kept, so looking a tag up in the
+    returned dict gives the same answer as extract_metric_from_html() for that tag
+    (values are full numbers, see normalize_fact_value).
+    
+    Args:
+        html_content: The HTML content to parse
+    
+    Returns:
+        Dict mapping XBRL tag (e.g. 'us-gaap:Revenues') to {"value", "unit", "context"}
+    """
+    with span("xbrl.parse_facts", bytes=len(html_content)):
+        check_deadline()
+        soup = BeautifulSoup(html_content, "xml")
+        
+        facts = {}
+        for element in soup.find_all('ix:nonFraction'):
+            check_deadline()
+            name = element.get('name')
+            if not name or name in facts:
+                continue
+            facts[name] = {
+                "value": _fact_value(element),
+                "unit": _get_ix_attribute(element, 'unitRef'),
+                "context": _get_ix_attribute(element, 'contextRef'),
+            }
+        annotate(facts=len(facts))
+    
+    return facts
+
+def _company_fact_entries(company_facts: dict, metric_tag: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """Returns (unit, entry) pairs reported for a tag like 'us-gaap:Revenues' in companyfacts data."""
+    taxonomy, _, concept = metric_tag.partition(':')
+    units = company_facts.get('facts', {}).get(taxonomy, {}).get(concept, {}).get('units', {})
+    return [(unit, entry) for unit, entries in units.items() for entry in entries]
+
+def _period_days(entry: Dict[str, Any]) -> int:
+    """Length of a duration fact in days (0 for instant facts)."""
+    if not entry.get('start'):
+        return 0
+    return (date.fromisoformat(entry['end']) - date.fromisoformat(entry['start'])).days
+
+def _company_fact_result(unit: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "value": str(entry['val']),
+        "unit": unit,
+        "start": entry.get('start'),
+        "end": entry['end'],
+        "fy": entry.get('fy'),
+        "fp": entry.get('fp'),
+        "form": entry.get('form'),
+        "filed": entry.get('filed'),
+        "accession_number": entry.get('accn', '').replace('-', ''),
+    }
+
+def find_company_fact(company_facts: dict, metric_tag: str, year: int, form_type: str = "10-K") -> Optional[Dict[str, Any]]:
+    """
+    Picks the value of a metric for one filing out of companyfacts data.
+    
+    Mirrors how filings are selected elsewhere: the filing is the latest one of
+    form_type filed in the given calendar year, and its value is the fact for the
+    filing's current period, i.e. the latest period end. Of the durations ending
+    then, a 10-K takes its full fiscal year (rather than its fourth quarter) and a
+    10-Q its quarter (rather than the year to date) - the period a filing presents
+    first, which is what extract_metric_from_html() reads from the document.
+    
+    Args:
+        company_facts: Data returned by the SEC companyfacts API
+        metric_tag: XBRL tag (e.g. 'us-gaap:Revenues')
+        year: Calendar year the filing was filed in
+        form_type: Form of the filing (default "10-K")
+    
+    Returns:
+        Dict with value, unit, start, end, fy, fp, form, filed and accession_number,
+        or None if the company never reported the tag in such a filing
+    """
+    candidates = [
+        (unit, entry) for unit, entry in _company_fact_entries(company_facts, metric_tag)
+        if entry.get('form') == form_type and str(entry.get('filed', ''))[:4] == str(year)
+    ]
+    if not candidates:
+        return None
+    
+    latest_filed = max(entry['filed'] for _, entry in candidates)
+    candidates = [(unit, entry) for unit, entry in candidates if entry['filed'] == latest_filed]
+    latest_end = max(entry['end'] for _, entry in candidates)
+    candidates = [(unit, entry) for unit, entry in candidates if entry['end'] == latest_end]
+    if form_type.startswith('10-Q'):
+        unit, entry = min(candidates, key=lambda item: _period_days(item[1]))
+    else:
+        unit, entry = max(candidates, key=lambda item: _period_days(item[1]))
+    return _company_fact_result(unit, entry)
+
+# Reporting period lengths in days, with slack for 52/53-week fiscal years.
+_ANNUAL_DAYS = range(350, 381)
+_QUARTER_DAYS = range(80, 101)
+
+def extract_company_fact_series(company_facts: dict, metric_tag: str, period: str = "annual") -> List[Dict[str, Any]]:
+    """
+    Extracts every annual or quarterly value of a metric from companyfacts data.
+    
+    Each filing contributes only the facts for its own current period (the latest period
+    end it reports for the tag), labelled with SEC's fiscal year and fiscal period, so
+    prior-year comparatives never masquerade as a different period. When a period was
+    reported more than once (e.g. by an amendment), the latest filing wins.
+    
+    Args:
+        company_facts: Data returned by the SEC companyfacts API
+        metric_tag: XBRL tag (e.g. 'us-gaap:Revenues')
+        period: 'annual' (10-K fiscal years) or 'quarterly' (10-Q quarters plus the fourth
+            quarter when a 10-K reports it separately)
+    
+    Returns:
+        Points sorted by fiscal year and period, each a dict with fiscal_year,
+        fiscal_period, value, unit, start, end, form, filed and accession_number
+    """
+    if period not in ("annual", "quarterly"):
+        raise ValueError(f"Unsupported period: {period}. Use 'annual' or 'quarterly'.")
+    
+    entries = [
+        (unit, entry) for unit, entry in _company_fact_entries(company_facts, metric_tag)
+        if entry.get('fy') and entry.get('accn') and entry.get('end')
+    ]
+    
+    current_period_end: Dict[str, str] = {}
+    for _, entry in entries:
+        if entry['end'] > current_period_end.get(entry['accn'], ''):
+            current_period_end[entry['accn']] = entry['end']
+    
+    points: Dict[Tuple[int, str], Dict[str, Any]] = {}
+    for unit, entry in entries:
+        if entry['end'] != current_period_end[entry['accn']]:
+            continue
+        
+        form = entry.get('form', '')
+        days = _period_days(entry)
+        instant = not entry.get('start')
+        if period == "annual":
+            if not form.startswith('10-K') or entry.get('fp') != 'FY':
+                continue
+            if not instant and days not in _ANNUAL_DAYS:
+                continue
+            fiscal_period = 'FY'
+        else:
+            if not (form.startswith('10-Q') or form.startswith('10-K')):
+                continue
+            if not instant and days not in _QUARTER_DAYS:
+                continue
+            fiscal_period = 'Q4' if form.startswith('10-K') else entry.get('fp')
+            if fiscal_period not in ('Q1', 'Q2', 'Q3', 'Q4'):
+                continue
+        
+        key = (int(entry['fy']), fiscal_period)
+        if key in points and (points[key]['filed'] or '') >= entry.get('filed', ''):
+            continue
+        points[key] = {
+            "fiscal_year": int(entry['fy']),
+            "fiscal_period": fiscal_period,
+            **_company_fact_result(unit, entry),
+        }
+    
+    for point in points.values():
+        # fy/fp are already exposed as fiscal_year/fiscal_period
+        point.pop('fy', None)
+        point.pop('fp', None)
+    
+    return [points[key] for key in sorted(points)]
+
 # Keep the old function for backward compatibility
 def extract_revenue_from_html(html_content: str) -> Optional[Tuple[str, str]]:
     """
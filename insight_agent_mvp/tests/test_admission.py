@@ -0,0 +1,81 @@
+"""
+测试上游准入控制 src/admission.py
+"""
+
+import os
+import sys
+import time
+import threading
+import pytest
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
+
+from src.admission import UpstreamLimiter, Overloaded
+from src.deadline import deadline_scope, DeadlineExceeded
+
+class TestUpstreamLimiter:
+    """测试并发上限、有界等待队列和按截止时间拒绝"""
+
+    def test_admits_up_to_limit(self):
+        """测试未满时立即放行"""
+        limiter = UpstreamLimiter("sec", max_concurrency=2, max_queue=1, initial_service_time=0.1)
+        assert limiter.acquire() == 0.0
+        assert limiter.acquire() == 0.0
+        assert limiter.stats()["active"] == 2
+
+    def test_queued_caller_gets_released_slot(self):
+        """测试排队的调用在有空位后按顺序执行"""
+        limiter = UpstreamLimiter("sec", max_concurrency=1, max_queue=4, initial_service_time=0.01)
+        limiter.acquire()
+        waited = []
+        thread = threading.Thread(target=lambda: waited.append(limiter.acquire()))
+        thread.start()
+
+        time.sleep(0.05)
+        assert limiter.stats()["queued"] == 1
+        limiter.release(0.05)
+        thread.join(timeout=1)
+
+        assert waited and waited[0] >= 0.04
+        assert limiter.stats()["active"] == 1
+
+    def test_rejects_when_queue_full(self):
+        """测试等待队列已满时直接拒绝，并给出重试等待时间"""
+        limiter = UpstreamLimiter("llm", max_concurrency=1, max_queue=0, initial_service_time=2.0)
+        limiter.acquire()
+
+        with pytest.raises(Overloaded) as excinfo:
+            limiter.acquire()
+        assert excinfo.value.upstream == "llm"
+        assert excinfo.value.retry_after_header == "2"
+        assert limiter.stats()["rejected"] == 1
+
+    def test_rejects_when_wait_exceeds_deadline(self):
+        """测试预计等待时间超过截止时间时立即拒绝，不进入队列"""
+        limiter = UpstreamLimiter("sec", max_concurrency=1, max_queue=10, initial_service_time=5.0)
+        limiter.acquire()
+
+        with deadline_scope(1.0):
+            start = time.perf_counter()
+            with pytest.raises(Overloaded):
+                limiter.check()
+            with pytest.raises(Overloaded):
+                limiter.acquire()
+            assert time.perf_counter() - start < 0.1
+        assert limiter.stats()["queued"] == 0
+
+    def test_cancelled_while_queued(self):
+        """测试排队期间查询被取消时退出队列"""
+        limiter = UpstreamLimiter("sec", max_concurrency=1, max_queue=10, initial_service_time=0.01)
+        limiter.acquire()
+
+        with deadline_scope(None) as deadline:
+            threading.Timer(0.05, deadline.cancel).start()
+            with pytest.raises(DeadlineExceeded):
+                limiter.acquire()
+        assert limiter.stats()["queued"] == 0
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
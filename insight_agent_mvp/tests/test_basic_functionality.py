@@ -104,6 +104,108 @@ class TestXBRLExtractor:
         # 测试不存在的指标
         result = extract_metric_from_html(sample_html, "us-gaap:NonExistentMetric")
         assert result is None
+    
+    def test_extract_facts_from_sample_html(self):
+        """测试一次解析提取全部指标"""
+        from src.xbrl_extractor import extract_facts_from_html
+        
+        sample_html = """
+        <html xmlns:ix="http://www.xbrl.org/2013/inlineXBRL">
+            <body>
+                <ix:nonFraction name="us-gaap:Revenues" contextRef="c1" unitRef="usd">383285000000</ix:nonFraction>
+                <ix:nonFraction name="us-gaap:Revenues" contextRef="c2" unitRef="usd">394328000000</ix:nonFraction>
+                <ix:nonFraction name="us-gaap:NetIncomeLoss" contextRef="c1" unitRef="usd">96995000000</ix:nonFraction>
+            </body>
+        </html>
+        """
+        
+        facts = extract_facts_from_html(sample_html)
+        
+        # 同一标签只保留第一次出现的值
+        assert facts["us-gaap:Revenues"] == {"value": "383285000000", "unit": "usd", "context": "c1"}
+        assert facts["us-gaap:NetIncomeLoss"]["value"] == "96995000000"
+        assert "us-gaap:Assets" not in facts
+    
+    def test_scaled_display_values(self):
+        """测试按scale和sign换算财报中的显示值，与公司事实的数值格式一致"""
+        from src.xbrl_extractor import extract_metric_from_html, extract_facts_from_html, normalize_fact_value
+        
+        sample_html = """
+        <html xmlns:ix="http://www.xbrl.org/2013/inlineXBRL">
+            <body>
+                <ix:nonFraction name="us-gaap:Revenues" contextRef="c1" unitRef="usd" scale="6">383,285</ix:nonFraction>
+                <ix:nonFraction name="us-gaap:NetIncomeLoss" contextRef="c1" unitRef="usd" scale="3" sign="-">1,250</ix:nonFraction>
+                <ix:nonFraction name="us-gaap:EarningsPerShareBasic" contextRef="c1" unitRef="usdPerShare">6.16</ix:nonFraction>
+            </body>
+        </html>
+        """
+        
+        assert extract_metric_from_html(sample_html, "us-gaap:Revenues") == ("383285000000", "usd")
+        facts = extract_facts_from_html(sample_html)
+        assert facts["us-gaap:Revenues"]["value"] == "383285000000"
+        assert facts["us-gaap:NetIncomeLoss"]["value"] == "-1250000"
+        assert facts["us-gaap:EarningsPerShareBasic"]["value"] == "6.16"
+        assert normalize_fact_value("—") == "0"
+        assert normalize_fact_value("n/a") == "n/a"
+    
+    def test_find_company_fact(self):
+        """测试从公司事实数据中按财报选取当期值"""
+        from src.xbrl_extractor import find_company_fact
+        
+        company_facts = {"facts": {"us-gaap": {"Revenues": {"units": {"USD": [
+            # 2023年提交的10-K：上一财年对比数、第四季度和当前财年
+            {"start": "2021-09-26", "end": "2022-09-24", "val": 394328000000, "fy": 2023, "fp": "FY",
+             "form": "10-K", "filed": "2023-11-03", "accn": "0000320193-23-000106"},
+            {"start": "2023-07-02", "end": "2023-09-30", "val": 89498000000, "fy": 2023, "fp": "FY",
+             "form": "10-K", "filed": "2023-11-03", "accn": "0000320193-23-000106"},
+            {"start": "2022-09-25", "end": "2023-09-30", "val": 383285000000, "fy": 2023, "fp": "FY",
+             "form": "10-K", "filed": "2023-11-03", "accn": "0000320193-23-000106"},
+            {"start": "2023-04-02", "end": "2023-07-01", "val": 81797000000, "fy": 2023, "fp": "Q3",
+             "form": "10-Q", "filed": "2023-08-04", "accn": "0000320193-23-000077"},
+            # 同一份10-Q中截至同一日期的年初至今累计值：与财报首先列出的当季值不同，不应被选中
+            {"start": "2022-09-25", "end": "2023-07-01", "val": 281310000000, "fy": 2023, "fp": "Q3",
+             "form": "10-Q", "filed": "2023-08-04", "accn": "0000320193-23-000077"},
+        ]}}}}}
+        
+        fact = find_company_fact(company_facts, "us-gaap:Revenues", 2023)
+        
+        assert fact["value"] == "383285000000"
+        assert fact["unit"] == "USD"
+        assert fact["end"] == "2023-09-30"
+        assert fact["accession_number"] == "000032019323000106"
+        assert find_company_fact(company_facts, "us-gaap:Revenues", 2023, "10-Q")["value"] == "81797000000"
+        assert find_company_fact(company_facts, "us-gaap:Revenues", 2021) is None
+        assert find_company_fact(company_facts, "us-gaap:Assets", 2023) is None
+
+    def test_extract_company_fact_series(self):
+        """测试从公司事实数据中提取按财年/季度的序列，比较期数据不重复计入"""
+        from src.xbrl_extractor import extract_company_fact_series
+        
+        def fact(start, end, val, fy, fp, form, filed, accn):
+            return {"start": start, "end": end, "val": val, "fy": fy, "fp": fp,
+                    "form": form, "filed": filed, "accn": accn}
+        
+        company_facts = {"facts": {"us-gaap": {"Revenues": {"units": {"USD": [
+            # FY2022 10-K
+            fact("2021-09-26", "2022-09-24", 394, 2022, "FY", "10-K", "2022-10-28", "a-22"),
+            fact("2020-09-27", "2021-09-25", 366, 2022, "FY", "10-K", "2022-10-28", "a-22"),
+            # FY2023 10-K（含上年比较数）
+            fact("2022-09-25", "2023-09-30", 383, 2023, "FY", "10-K", "2023-11-03", "a-23"),
+            fact("2021-09-26", "2022-09-24", 394, 2023, "FY", "10-K", "2023-11-03", "a-23"),
+            # FY2024 Q1 10-Q：当季和上年同季
+            fact("2023-10-01", "2023-12-30", 120, 2024, "Q1", "10-Q", "2024-02-02", "q-24-1"),
+            fact("2022-09-25", "2022-12-31", 117, 2024, "Q1", "10-Q", "2024-02-02", "q-24-1"),
+        ]}}}}}
+        
+        annual = extract_company_fact_series(company_facts, "us-gaap:Revenues")
+        assert [(p["fiscal_year"], p["value"]) for p in annual] == [(2022, "394"), (2023, "383")]
+        assert annual[1]["end"] == "2023-09-30"
+        
+        quarterly = extract_company_fact_series(company_facts, "us-gaap:Revenues", "quarterly")
+        assert [(p["fiscal_year"], p["fiscal_period"], p["value"]) for p in quarterly] == [(2024, "Q1", "120")]
+        
+        with pytest.raises(ValueError):
+            extract_company_fact_series(company_facts, "us-gaap:Revenues", "monthly")
 
 class TestOrchestratorBasic:
     """测试编排器基本功能"""
@@ -0,0 +1,294 @@
+"""
+测试缓存模块 src/cache.py
+"""
+
+import os
+import sys
+import time
+import threading
+import pytest
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
+
+from src.cache import LRUCache, SQLiteCache, RedisCache
+
+class TestLRUCache:
+    """测试进程内LRU缓存"""
+
+    def test_get_and_set(self):
+        """测试基本读写"""
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+
+        assert cache.get("a") == 1
+        assert cache.get("missing") is None
+        assert cache.get("missing", "default") == "default"
+
+    def test_evicts_least_recently_used(self):
+        """测试超出容量时淘汰最久未使用的条目"""
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+        assert len(cache) == 2
+
+    def test_ttl_expiry(self):
+        """测试条目过期"""
+        cache = LRUCache(maxsize=2, ttl=0.05)
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+
+        time.sleep(0.1)
+        assert cache.get("a") is None
+
+    def test_get_or_compute_does_not_cache_errors(self):
+        """测试计算失败时不缓存"""
+        cache = LRUCache()
+
+        def fail():
+            raise FileNotFoundError("missing")
+
+        with pytest.raises(FileNotFoundError):
+            cache.get_or_compute("a", fail)
+        assert cache.get_or_compute("a", lambda: 1) == 1
+
+    def test_get_or_compute_single_flight(self):
+        """测试并发未命中时只计算一次"""
+        cache = LRUCache()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_compute("key", compute)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == ["value"] * 5
+        assert len(calls) == 1
+
+class TestSharedCache:
+    """测试跨进程共享的SQLite缓存层（每个SQLiteCache实例模拟一个进程）"""
+
+    def test_entries_visible_to_other_processes(self, tmp_path):
+        """测试一个进程写入的条目，另一个进程的缓存未命中时可以读到"""
+        path = str(tmp_path / "cache.sqlite")
+        writer = LRUCache(backend=SQLiteCache(path), namespace="filing")
+        reader = LRUCache(backend=SQLiteCache(path), namespace="filing")
+
+        writer.set(("AAPL", 2023, "10-K"), {"html": "<html/>"})
+        assert reader.get(("AAPL", 2023, "10-K")) == {"html": "<html/>"}
+        assert len(reader) == 1
+        # 不同命名空间互不影响
+        assert LRUCache(backend=SQLiteCache(path), namespace="facts").get(("AAPL", 2023, "10-K")) is None
+
+        writer.clear()
+        assert LRUCache(backend=SQLiteCache(path), namespace="filing").get(("AAPL", 2023, "10-K")) is None
+
+    def test_single_flight_across_processes(self, tmp_path):
+        """测试多个进程同时未命中时只有一个进程计算，其他进程等待其结果"""
+        path = str(tmp_path / "cache.sqlite")
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return "value"
+
+        caches = [LRUCache(backend=SQLiteCache(path), namespace="filing") for _ in range(4)]
+        results = []
+        threads = [
+            threading.Thread(target=lambda cache=cache: results.append(cache.get_or_compute("key", compute)))
+            for cache in caches
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == ["value"] * 4
+        assert len(calls) == 1
+
+    def test_lock_lease_expires(self, tmp_path):
+        """测试持有锁的进程退出后，租约到期即可被其他进程获取"""
+        store = SQLiteCache(str(tmp_path / "cache.sqlite"))
+        token = store.acquire("key", lease=30)
+        assert token is not None
+        assert store.acquire("key", lease=30) is None
+        store.release("key", token)
+
+        assert store.acquire("key", lease=0) is not None
+        assert store.acquire("key", lease=30) is not None
+
+    def test_ttl_and_size_limit(self, tmp_path):
+        """测试过期条目不再返回，超出容量时淘汰最早写入的条目"""
+        store = SQLiteCache(str(tmp_path / "cache.sqlite"), max_bytes=10)
+        store.set("expired", b"x", ttl=-1)
+        assert store.get("expired") is None
+
+        store.set("old", b"123456")
+        store.set("new", b"123456")
+        store.trim()
+        assert store.get("old") is None
+        assert store.get("new") == b"123456"
+
+    def test_get_many_fills_local_cache(self, tmp_path):
+        """测试批量读取：本地未命中的键一次性从共享缓存取回并保存在本地"""
+        path = str(tmp_path / "cache.sqlite")
+        writer = LRUCache(backend=SQLiteCache(path), namespace="facts")
+        for year in (2021, 2022):
+            writer.set(("AAPL", year, "10-K"), {"year": year})
+
+        reader = LRUCache(backend=SQLiteCache(path), namespace="facts")
+        found = reader.get_many([("AAPL", 2021, "10-K"), ("AAPL", 2022, "10-K"), ("AAPL", 2023, "10-K")])
+
+        assert found == {("AAPL", 2021, "10-K"): {"year": 2021}, ("AAPL", 2022, "10-K"): {"year": 2022}}
+        assert len(reader) == 2
+
+    def test_filing_metadata_follows_shared_filing(self, tmp_path):
+        """测试另一个进程从共享缓存取到财报时也能拿到财报元数据（ETag和结果缓存依赖它）"""
+        from unittest.mock import patch
+        from src import sec_retriever
+
+        path = str(tmp_path / "cache.sqlite")
+        metadata = {
+            "ticker": "AAPL", "year": 2023, "form_type": "10-K",
+            "accession_number": "000032019323000106", "url": "https://www.sec.gov/Archives/edgar/data/320193/aapl.htm"
+        }
+
+        def process_caches():
+            return {
+                "_filing_cache": LRUCache(backend=SQLiteCache(path), namespace="filing"),
+                "_filing_metadata_cache": LRUCache(backend=SQLiteCache(path), namespace="filing_metadata"),
+            }
+
+        # 下载财报的进程
+        with patch.multiple(sec_retriever, **process_caches()), \
+             patch.object(sec_retriever, "_locate_filing", return_value=metadata), \
+             patch.object(sec_retriever, "_sec_get") as mock_get:
+            mock_get.return_value.text = "<html/>"
+            assert sec_retriever.get_filing_html("AAPL", 2023) == "<html/>"
+
+        # 其他进程：财报和元数据都来自共享缓存
+        with patch.multiple(sec_retriever, **process_caches()), \
+             patch.object(sec_retriever, "_locate_filing", side_effect=AssertionError("no lookup expected")):
+            assert sec_retriever.get_filing_html("AAPL", 2023) == "<html/>"
+            assert sec_retriever.get_cached_filing_metadata("AAPL", 2023)["accession_number"] == "000032019323000106"
+
+        # 元数据条目已被淘汰时，命中财报后重新解析
+        SQLiteCache(path).clear("filing_metadata:")
+        with patch.multiple(sec_retriever, **process_caches()), \
+             patch.object(sec_retriever, "_locate_filing", return_value=metadata) as mock_locate:
+            assert sec_retriever.get_filing_html("AAPL", 2023) == "<html/>"
+            assert sec_retriever.get_cached_filing_metadata("AAPL", 2023) == metadata
+            mock_locate.assert_called_once()
+
+    def test_failing_backend_is_skipped(self):
+        """测试共享缓存不可用时退回进程内缓存"""
+        class BrokenBackend:
+            def __getattr__(self, name):
+                def fail(*args, **kwargs):
+                    raise OSError("disk full")
+                return fail
+
+        cache = LRUCache(backend=BrokenBackend(), namespace="filing")
+        assert cache.get_or_compute("key", lambda: "value") == "value"
+        assert cache.get("key") == "value"
+
+class TestRedisCache:
+    """测试Redis协议的共享缓存层（使用fakeredis代替真实的Redis服务器）"""
+
+    @pytest.fixture
+    def server(self):
+        fakeredis = pytest.importorskip("fakeredis")
+        return fakeredis.FakeServer()
+
+    def _store(self, server, **kwargs):
+        import fakeredis
+        return RedisCache(fakeredis.FakeRedis(server=server), **kwargs)
+
+    def test_round_trip_and_compression(self, server):
+        """测试大于阈值的值压缩存储，读取时透明解压"""
+        store = self._store(server, compress_min_bytes=100)
+        large = b"<ix:nonFraction>1</ix:nonFraction>" * 100
+        store.set("filing", large)
+        store.set("small", b"tiny")
+
+        assert store.get("filing") == large
+        assert store.get("small") == b"tiny"
+        assert len(store.client.get("insight:filing")) < len(large) / 5
+        assert store.get("missing") is None
+
+    def test_shared_between_hosts_with_batch_get(self, server):
+        """测试一台主机写入的条目，其他主机通过流水线批量读取"""
+        writer = LRUCache(backend=self._store(server), namespace="facts")
+        reader = LRUCache(backend=self._store(server), namespace="facts")
+        writer.set(("AAPL", 2022, "10-K"), {"us-gaap:Revenues": {"value": "1"}})
+        writer.set(("AAPL", 2023, "10-K"), {"us-gaap:Revenues": {"value": "2"}})
+
+        found = reader.get_many([("AAPL", 2022, "10-K"), ("AAPL", 2023, "10-K"), ("MSFT", 2023, "10-K")])
+        assert set(found) == {("AAPL", 2022, "10-K"), ("AAPL", 2023, "10-K")}
+
+        writer.clear()
+        assert self._store(server).get('facts:["AAPL", 2022, "10-K"]') is None
+
+    def test_ttl(self, server):
+        """测试条目按TTL过期"""
+        store = self._store(server)
+        store.set("submissions", b"{}", ttl=0.05)
+        assert store.get("submissions") == b"{}"
+        time.sleep(0.1)
+        assert store.get("submissions") is None
+
+    def test_locks(self, server):
+        """测试锁只能由持有者释放"""
+        first, second = self._store(server), self._store(server)
+        token = first.acquire("filing", lease=30)
+        assert token is not None
+        assert second.acquire("filing", lease=30) is None
+
+        second.release("filing", "not-the-token")
+        assert second.acquire("filing", lease=30) is None
+        first.release("filing", token)
+        assert second.acquire("filing", lease=30) is not None
+
+    def test_single_flight_across_hosts(self, server):
+        """测试多台主机同时未命中时只计算一次"""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return "value"
+
+        caches = [LRUCache(backend=self._store(server), namespace="filing") for _ in range(3)]
+        results = []
+        threads = [
+            threading.Thread(target=lambda cache=cache: results.append(cache.get_or_compute("key", compute)))
+            for cache in caches
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == ["value"] * 3
+        assert len(calls) == 1
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
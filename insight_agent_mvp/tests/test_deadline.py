@@ -0,0 +1,104 @@
+"""
+测试截止时间模块 src/deadline.py
+"""
+
+import os
+import sys
+import time
+import pytest
+from unittest.mock import Mock, patch
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
+
+from src.deadline import (
+    DeadlineExceeded, deadline_scope, check_deadline, current_deadline, remaining_time
+)
+from src import sec_retriever
+
+class TestDeadline:
+    """测试截止时间的传递和检查"""
+
+    def test_no_scope_is_unlimited(self):
+        """测试截止时间范围之外不做任何限制"""
+        assert current_deadline() is None
+        check_deadline()
+        assert remaining_time() is None
+        assert remaining_time(10) == 10
+
+    def test_remaining_time_caps_timeouts(self):
+        """测试超时被限制在剩余时间以内"""
+        with deadline_scope(1.0):
+            assert 0.9 < remaining_time() <= 1.0
+            assert remaining_time(0.5) == 0.5
+            assert remaining_time(10) <= 1.0
+
+    def test_expired_deadline_raises(self):
+        """测试超过截止时间后检查抛出异常"""
+        with deadline_scope(0.01):
+            time.sleep(0.02)
+            with pytest.raises(DeadlineExceeded):
+                check_deadline()
+            assert remaining_time(5) == 0
+
+    def test_cancel(self):
+        """测试取消查询"""
+        with deadline_scope(None) as deadline:
+            check_deadline()
+            deadline.cancel()
+            with pytest.raises(DeadlineExceeded):
+                check_deadline()
+
+    def test_nested_scope_never_extends(self):
+        """测试嵌套的截止时间不会超过外层，外层取消对内层生效"""
+        with deadline_scope(0.5) as outer:
+            with deadline_scope(10):
+                assert remaining_time() <= 0.5
+                outer.cancel()
+                with pytest.raises(DeadlineExceeded):
+                    check_deadline()
+        assert current_deadline() is None
+
+class TestSECDeadline:
+    """测试SEC请求遵守截止时间"""
+
+    @patch('src.sec_retriever.requests.get')
+    def test_download_stops_when_cancelled(self, mock_get):
+        """测试下载过程中取消查询时停止读取"""
+        chunks_read = []
+
+        def iter_content(chunk_size):
+            for index in range(100):
+                chunks_read.append(index)
+                if index == 2:
+                    current_deadline().cancel()
+                yield b"x" * 10
+
+        response = Mock()
+        response.iter_content.side_effect = iter_content
+        mock_get.return_value = response
+
+        with deadline_scope(5):
+            with pytest.raises(DeadlineExceeded):
+                sec_retriever._sec_get("https://www.sec.gov/test")
+
+        assert len(chunks_read) == 3
+        response.close.assert_called_once()
+        assert mock_get.call_args.kwargs["stream"] is True
+        assert mock_get.call_args.kwargs["timeout"] <= 5
+
+    @patch('src.sec_retriever.requests.get')
+    def test_body_available_after_streamed_read(self, mock_get):
+        """测试分块读取后响应内容照常可用"""
+        response = Mock()
+        response.iter_content.return_value = [b'{"a": ', b'1}']
+        mock_get.return_value = response
+
+        with deadline_scope(5):
+            result = sec_retriever._sec_get("https://www.sec.gov/test")
+
+        assert result._content == b'{"a": 1}'
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -9,10 +9,11 @@ import json
 import time
 from fastapi.testclient import TestClient
 
-# 添加src目录到路径
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
 
-from orchestrator import app
+from src.orchestrator import app
 
 client = TestClient(app)
 
@@ -0,0 +1,125 @@
+"""
+测试微批处理模块 src/intent_batcher.py
+"""
+
+import os
+import sys
+import threading
+import time
+import pytest
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
+
+from src.intent_batcher import MicroBatcher
+from src.deadline import deadline_scope, check_deadline, remaining_time
+
+def submit_concurrently(batcher, items):
+    """从多个线程同时提交，返回按items顺序排列的结果（异常原样返回）"""
+    results = [None] * len(items)
+
+    def submit(index, item):
+        try:
+            results[index] = batcher.submit(item)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=submit, args=(i, item)) for i, item in enumerate(items)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+class TestMicroBatcher:
+    """测试窗口内提交的条目合并处理"""
+
+    def test_single_submit(self):
+        """测试单独提交也能得到结果"""
+        batcher = MicroBatcher(lambda items: [item * 2 for item in items], window=0.01)
+        assert batcher.submit(21) == 42
+
+    def test_concurrent_submits_share_one_call(self):
+        """测试窗口内的并发提交只调用一次处理函数"""
+        batches = []
+
+        def handler(items):
+            batches.append(list(items))
+            return [item.upper() for item in items]
+
+        batcher = MicroBatcher(handler, window=0.2)
+        results = submit_concurrently(batcher, ["a", "b", "c"])
+
+        assert results == ["A", "B", "C"]
+        assert len(batches) == 1
+        assert sorted(batches[0]) == ["a", "b", "c"]
+
+    def test_max_batch_size(self):
+        """测试批次不超过最大条目数"""
+        batches = []
+
+        def handler(items):
+            batches.append(len(items))
+            return items
+
+        batcher = MicroBatcher(handler, window=0.1, max_batch_size=2)
+        results = submit_concurrently(batcher, [1, 2, 3, 4, 5])
+
+        assert results == [1, 2, 3, 4, 5]
+        assert max(batches) <= 2
+        assert sum(batches) == 5
+
+    def test_per_item_and_batch_errors(self):
+        """测试单条失败只影响该条，处理函数本身失败影响整批"""
+        batcher = MicroBatcher(
+            lambda items: [ValueError(item) if item == "bad" else item for item in items],
+            window=0.1
+        )
+        results = submit_concurrently(batcher, ["ok", "bad"])
+        assert results[0] == "ok"
+        assert isinstance(results[1], ValueError)
+
+        def fail(items):
+            raise RuntimeError("upstream down")
+
+        batcher = MicroBatcher(fail, window=0.1)
+        results = submit_concurrently(batcher, ["a", "b"])
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    def test_short_deadline_does_not_fail_batch(self):
+        """测试截止时间很短的调用方不会让同一批次中的其他调用方失败"""
+        budgets = []
+
+        def handler(items):
+            time.sleep(0.1)
+            check_deadline()
+            budgets.append(remaining_time())
+            return [item.upper() for item in items]
+
+        batcher = MicroBatcher(handler, window=0.05)
+        results = {}
+
+        def submit(item, timeout):
+            with deadline_scope(timeout):
+                try:
+                    results[item] = batcher.submit(item, timeout=remaining_time())
+                except Exception as e:
+                    results[item] = e
+
+        leader = threading.Thread(target=submit, args=("short", 0.02))
+        leader.start()
+        time.sleep(0.01)
+        follower = threading.Thread(target=submit, args=("long", 30))
+        follower.start()
+        leader.join()
+        follower.join()
+
+        assert isinstance(results["short"], FutureTimeoutError)
+        assert results["long"] == "LONG"
+        # 处理函数按批次中剩余时间最长的调用方计时
+        assert budgets[0] > 20
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
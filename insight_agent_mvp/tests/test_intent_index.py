@@ -0,0 +1,78 @@
+"""
+测试意图相似度索引 src/intent_index.py
+"""
+
+import os
+import sys
+import pytest
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
+
+from src.intent_index import IntentIndex
+
+APPLE_REVENUE_2023 = {"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}
+
+class TestIntentIndex:
+    """测试基于字符n-gram TF-IDF的意图复用"""
+
+    def test_paraphrase_reuses_intent(self):
+        """测试换个说法的查询命中已解析的意图"""
+        index = IntentIndex(threshold=0.8)
+        assert index.add("What was Apple's revenue in 2023?", APPLE_REVENUE_2023)
+
+        match = index.lookup("what was Apple revenue in 2023")
+        assert match is not None
+        intent, similarity = match
+        assert intent == APPLE_REVENUE_2023
+        assert similarity >= 0.8
+
+    def test_slots_must_match(self):
+        """测试公司、年份或指标不同时不会命中，无论措辞多相似"""
+        index = IntentIndex(threshold=0.5)
+        index.add("What was Apple's revenue in 2023?", APPLE_REVENUE_2023)
+
+        assert index.lookup("What was Apple's revenue in 2022?") is None
+        assert index.lookup("What was Microsoft's revenue in 2023?") is None
+        assert index.lookup("What was Apple's net income in 2023?") is None
+        assert index.lookup("What was the revenue in 2023?") is None
+
+    def test_dissimilar_query_misses(self):
+        """测试相似度不足阈值时不命中"""
+        index = IntentIndex(threshold=0.8)
+        index.add("How much money did Apple make in 2023?", {"ticker": "AAPL", "metric": "NetIncome", "year": 2023})
+
+        assert index.lookup("How much did Apple spend in 2023?") is None
+
+    def test_inconsistent_intent_not_stored(self):
+        """测试意图与查询文本中的公司、年份不一致或解析失败时不入库"""
+        index = IntentIndex()
+
+        assert not index.add("What was Apple's revenue in 2023?", {**APPLE_REVENUE_2023, "year": 2022})
+        assert not index.add("What was Apple's revenue in 2023?", {"error": "无法理解查询"})
+        assert not index.add("What was the iPhone maker's revenue?", APPLE_REVENUE_2023)
+        assert len(index) == 0
+
+    def test_unknown_metric_never_matched(self):
+        """测试查询中没有可识别的指标时不入库也不命中，避免措辞相似的不同指标互相复用"""
+        index = IntentIndex(threshold=0.5)
+        tax_intent = {"ticker": "AAPL", "metric": "IncomeTaxExpense", "year": 2023, "form_type": "10-K"}
+
+        assert not index.add("What was Apple total tax in fiscal year 2023?", tax_intent)
+        assert index.lookup("What was Apple total debt in fiscal year 2023?") is None
+        assert len(index) == 0
+
+    def test_evicts_oldest_entry(self):
+        """测试超出容量时淘汰最久未使用的条目"""
+        index = IntentIndex(threshold=0.9, max_entries=2)
+        index.add("Apple revenue 2021", {**APPLE_REVENUE_2023, "year": 2021})
+        index.add("Apple revenue 2022", {**APPLE_REVENUE_2023, "year": 2022})
+        index.add("Apple revenue 2023", APPLE_REVENUE_2023)
+
+        assert len(index) == 2
+        assert index.lookup("Apple revenue 2021") is None
+        assert index.lookup("Apple revenue 2023")[0] == APPLE_REVENUE_2023
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
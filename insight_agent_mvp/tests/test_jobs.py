@@ -0,0 +1,123 @@
+"""
+测试后台任务队列 src/jobs.py
+"""
+
+import os
+import sys
+import json
+import time
+import pytest
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
+
+from src.jobs import JobStore, JobRunner
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite"), str(tmp_path / "results"))
+
+def _items(*keys):
+    """(财报, 指标) -> 任务条目"""
+    return [(filing, {"ticker": filing[0], "year": filing[1], "metric": metric}) for filing, metric in keys]
+
+def _handler(calls):
+    """记录每次处理的财报，结果取条目本身"""
+    def handle(group_key, members):
+        calls.append(group_key)
+        return [{"index": index, **item, "success": True} for index, item in members]
+    return handle
+
+def _drain(runner):
+    while runner.run_once():
+        pass
+
+class TestJobStore:
+    """测试任务的持久化、按财报分组和租约"""
+
+    def test_groups_by_filing_and_writes_ordered_results(self, store):
+        """测试同一份财报只处理一次，结果文件按输入顺序"""
+        calls = []
+        runner = JobRunner(store, _handler(calls), workers=1)
+        job_id = runner.submit(_items(
+            (("AAPL", 2023, "10-K"), "Revenues"),
+            (("MSFT", 2023, "10-K"), "Revenues"),
+            (("AAPL", 2023, "10-K"), "NetIncome"),
+        ))
+        assert store.get(job_id)["status"] == "queued"
+
+        _drain(runner)
+
+        assert sorted(calls) == [("AAPL", 2023, "10-K"), ("MSFT", 2023, "10-K")]
+        job = store.get(job_id)
+        assert job["status"] == "completed"
+        assert (job["done"], job["failed"], job["progress"]) == (3, 0, 1.0)
+        with open(job["result_path"], encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        assert [(row["index"], row["metric"]) for row in rows] == [(0, "Revenues"), (1, "Revenues"), (2, "NetIncome")]
+
+    def test_expired_claim_is_resumed(self, store):
+        """测试worker中途退出后，租约到期的财报被重新领取"""
+        job_id = store.create(_items((("AAPL", 2023, "10-K"), "Revenues")))
+        assert store.claim() is not None
+        # 租约未到期时不会重复领取
+        assert store.claim() is None
+
+        # 模拟重启：新的worker在租约到期后继续
+        reopened = JobStore(store.path, store.results_dir)
+        claimed = reopened.claim(lease=-1)
+        assert claimed[0] == job_id
+        reopened.complete(job_id, [{"index": 0, "success": True}])
+        assert reopened.finish_if_done(job_id)
+        assert reopened.get(job_id)["status"] == "completed"
+
+    def test_cancel(self, store):
+        """测试取消的任务不再分配工作"""
+        job_id = store.create(_items((("AAPL", 2023, "10-K"), "Revenues")))
+        assert store.cancel(job_id)
+        assert store.claim() is None
+        assert store.get(job_id)["status"] == "cancelled"
+        assert not store.cancel(job_id)
+
+class TestJobRunner:
+    """测试失败重试和worker线程"""
+
+    def test_retries_then_records_failure(self, store):
+        """测试处理函数抛出异常时稍后重试，超过次数后记为失败"""
+        attempts = []
+
+        def flaky(group_key, members):
+            attempts.append(group_key)
+            raise ConnectionError("SEC unavailable")
+
+        runner = JobRunner(store, flaky, workers=1, max_attempts=2, retry_interval=0)
+        job_id = runner.submit(_items((("AAPL", 2023, "10-K"), "Revenues"), (("AAPL", 2023, "10-K"), "NetIncome")))
+        _drain(runner)
+
+        assert len(attempts) == 2
+        job = store.get(job_id)
+        assert (job["status"], job["done"], job["failed"]) == ("completed", 2, 2)
+
+    def test_retry_waits_for_backoff(self, store):
+        """测试重试在退避时间之后才会再次领取"""
+        runner = JobRunner(store, lambda key, members: 1 / 0, workers=1, max_attempts=3, retry_interval=60)
+        runner.submit(_items((("AAPL", 2023, "10-K"), "Revenues")))
+        assert runner.run_once()
+        assert not runner.run_once()
+
+    def test_worker_threads_complete_job(self, store):
+        """测试后台worker线程执行并完成任务"""
+        calls = []
+        runner = JobRunner(store, _handler(calls), workers=2, poll_interval=0.05)
+        runner.start()
+        try:
+            job_id = runner.submit(_items(*[((ticker, 2023, "10-K"), "Revenues") for ticker in ("AAPL", "MSFT", "GOOGL")]))
+            deadline = time.monotonic() + 5
+            while store.get(job_id)["status"] != "completed" and time.monotonic() < deadline:
+                time.sleep(0.02)
+        finally:
+            runner.stop(timeout=5)
+
+        assert store.get(job_id)["status"] == "completed"
+        assert len(calls) == 3
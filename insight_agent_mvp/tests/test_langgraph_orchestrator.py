@@ -4,7 +4,11 @@
 
 import os
 import sys
+import time
+import threading
+import json
 import pytest
+import requests
 import asyncio
 from unittest.mock import Mock, patch
 
@@ -19,10 +23,31 @@ from src.langgraph_orchestrator import (
     extract_xbrl_data_node,
     should_continue,
     build_workflow,
-    process_query_with_langgraph
+    process_query_with_langgraph,
+    process_queries_with_langgraph,
+    stream_query_with_langgraph,
+    expand_intent,
+    route_after_parse,
+    get_metric_time_series,
+    clear_caches,
+    _memory_checkpointer,
+    _parse_intent_batch,
+    _invoke_intent_llm
 )
+from langchain_core.messages import AIMessage
+from langgraph.types import RetryPolicy
+from src.sec_retriever import is_transient_error
+from src.admission import UpstreamLimiter
+from src.intent_batcher import MicroBatcher
+from src.deadline import DeadlineExceeded, check_deadline
 from langgraph.graph import END
 
+@pytest.fixture(autouse=True)
+def no_speculative_prefetch():
+    """默认不让预取访问SEC，需要验证预取的测试自行替换"""
+    with patch('src.langgraph_orchestrator.prefetch_filing_metadata') as mock_prefetch:
+        yield mock_prefetch
+
 class TestLangGraphOrchestrator:
     """测试LangGraph编排器"""
     
@@ -31,7 +56,6 @@ class TestLangGraphOrchestrator:
         state = WorkflowState(
             query="test query",
             parsed_intent=None,
-            html_content=None,
             extracted_value=None,
             error=None,
             success=False
@@ -47,7 +71,6 @@ class TestLangGraphOrchestrator:
         success_state = WorkflowState(
             query="test",
             parsed_intent=None,
-            html_content=None,
             extracted_value=None,
             error=None,
             success=True
@@ -60,7 +83,6 @@ class TestLangGraphOrchestrator:
         failure_state = WorkflowState(
             query="test",
             parsed_intent=None,
-            html_content=None,
             extracted_value=None,
             error="some error",
             success=False
@@ -88,7 +110,6 @@ class TestLangGraphOrchestrator:
         initial_state = WorkflowState(
             query="Apple 2023年的收入是多少？",
             parsed_intent=None,
-            html_content=None,
             extracted_value=None,
             error=None,
             success=False
@@ -113,7 +134,6 @@ class TestLangGraphOrchestrator:
         initial_state = WorkflowState(
             query="无法理解的查询",
             parsed_intent=None,
-            html_content=None,
             extracted_value=None,
             error=None,
             success=False
@@ -135,7 +155,6 @@ class TestLangGraphOrchestrator:
         state_with_intent = WorkflowState(
             query="test",
             parsed_intent={"ticker": "AAPL", "year": 2023, "form_type": "10-K"},
-            html_content=None,
             extracted_value=None,
             error=None,
             success=True
@@ -144,7 +163,9 @@ class TestLangGraphOrchestrator:
         result = retrieve_sec_data_node(state_with_intent)
         
         assert result["success"] is True
-        assert result["html_content"] == mock_html
+        # 状态中只保存财报元数据，不保存文档本身
+        assert "html_content" not in result
+        assert result["filing"]["size"] == len(mock_html)
         assert result["error"] is None
         mock_get_filing_html.assert_called_once_with("AAPL", 2023, "10-K")
     
@@ -153,7 +174,6 @@ class TestLangGraphOrchestrator:
         state_with_invalid_ticker = WorkflowState(
             query="test",
             parsed_intent={"ticker": "INVALID", "year": 2023, "form_type": "10-K"},
-            html_content=None,
             extracted_value=None,
             error=None,
             success=True
@@ -164,8 +184,9 @@ class TestLangGraphOrchestrator:
         assert result["success"] is False
         assert "不支持的股票代码" in result["error"]
     
+    @patch('src.langgraph_orchestrator.get_filing_html', return_value="<html>mock html</html>")
     @patch('src.langgraph_orchestrator.extract_metric_from_html')
-    def test_extract_xbrl_data_node_success(self, mock_extract_metric):
+    def test_extract_xbrl_data_node_success(self, mock_extract_metric, mock_get_filing_html):
         """测试XBRL数据提取节点成功情况"""
         # 模拟XBRL数据提取
         mock_extract_metric.return_value = ("383285000000", "usd")
@@ -173,7 +194,7 @@ class TestLangGraphOrchestrator:
         state_with_html = WorkflowState(
             query="test",
             parsed_intent={"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"},
-            html_content="<html>mock html</html>",
+            filing={"ticker": "AAPL", "year": 2023, "form_type": "10-K", "accession_number": "000032019323000106"},
             extracted_value=None,
             error=None,
             success=True
@@ -188,9 +209,11 @@ class TestLangGraphOrchestrator:
         assert result["extracted_value"]["unit"] == "usd"
         assert result["error"] is None
         mock_extract_metric.assert_called_once_with("<html>mock html</html>", "us-gaap:Revenues")
+        mock_get_filing_html.assert_called_once_with("AAPL", 2023, "10-K")
     
+    @patch('src.langgraph_orchestrator.get_filing_html', return_value="<html>mock html</html>")
     @patch('src.langgraph_orchestrator.extract_metric_from_html')
-    def test_extract_xbrl_data_node_not_found(self, mock_extract_metric):
+    def test_extract_xbrl_data_node_not_found(self, mock_extract_metric, mock_get_filing_html):
         """测试XBRL数据提取节点找不到数据"""
         # 模拟找不到数据
         mock_extract_metric.return_value = None
@@ -198,7 +221,7 @@ class TestLangGraphOrchestrator:
         state_with_html = WorkflowState(
             query="test",
             parsed_intent={"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"},
-            html_content="<html>mock html</html>",
+            filing={"ticker": "AAPL", "year": 2023, "form_type": "10-K", "accession_number": "000032019323000106"},
             extracted_value=None,
             error=None,
             success=True
@@ -248,5 +271,835 @@ class TestLangGraphWorkflow:
         assert result["success"] is False
         assert "无法理解查询" in result["error"]
 
+@pytest.mark.asyncio
+class TestStreaming:
+    """测试流式查询"""
+    
+    def setup_method(self):
+        clear_caches()
+    
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    @patch('src.langgraph_orchestrator.get_cached_filing_metadata')
+    @patch('src.langgraph_orchestrator.find_latest_amendment', return_value=None)
+    @patch('src.langgraph_orchestrator.extract_metric_from_html')
+    async def test_stream_yields_each_stage(self, mock_extract_metric, mock_amendment, mock_metadata, mock_get_filing_html, mock_llm):
+        """测试按阶段依次产出意图、财报元数据和最终结果"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}'
+        )
+        mock_get_filing_html.return_value = "<html>mock SEC data</html>"
+        mock_metadata.return_value = {"accession_number": "000032019323000106", "filing_date": "2023-11-03"}
+        mock_extract_metric.return_value = ("383285000000", "usd")
+        
+        events = [event async for event in stream_query_with_langgraph("Apple 2023年的收入是多少？")]
+        
+        assert [event["event"] for event in events] == ["parsed_intent", "filing", "result"]
+        assert events[0]["data"]["ticker"] == "AAPL"
+        assert events[1]["data"]["accession_number"] == "000032019323000106"
+        assert events[1]["data"]["size"] == len("<html>mock SEC data</html>")
+        assert events[2]["data"]["success"] is True
+        assert events[2]["data"]["result"]["value"] == "383285000000"
+    
+    @patch('src.langgraph_orchestrator.llm')
+    async def test_stream_parse_failure(self, mock_llm):
+        """测试解析失败时只产出最终结果"""
+        mock_llm.invoke.return_value = Mock(content='{"error": "无法理解查询"}')
+        
+        events = [event async for event in stream_query_with_langgraph("无法理解的查询")]
+        
+        assert len(events) == 1
+        assert events[0]["event"] == "result"
+        assert events[0]["data"]["success"] is False
+
+@pytest.mark.asyncio
+class TestBatchProcessing:
+    """测试批量查询"""
+    
+    def setup_method(self):
+        clear_caches()
+    
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    @patch('src.langgraph_orchestrator.extract_facts_from_html')
+    async def test_batch_deduplicates_filings(self, mock_extract_facts, mock_get_filing_html, mock_llm):
+        """测试同一份财报只下载和解析一次"""
+        intents = {
+            "Apple 2023 revenue": '{"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}',
+            "Apple 2023 net income": '{"ticker": "AAPL", "metric": "NetIncome", "year": 2023, "form_type": "10-K"}',
+            "MSFT 2023 revenue": '{"ticker": "MSFT", "metric": "Revenues", "year": 2023, "form_type": "10-K"}',
+        }
+        mock_llm.invoke.side_effect = lambda messages, **kwargs: Mock(content=intents[messages[-1].content])
+        
+        mock_get_filing_html.side_effect = lambda ticker, year, form_type: f"<html>{ticker}</html>"
+        mock_extract_facts.side_effect = lambda html: {
+            "us-gaap:Revenues": {"value": html, "unit": "usd", "context": "c1"},
+            "us-gaap:NetIncomeLoss": {"value": "99803000000", "unit": "usd", "context": "c1"},
+        }
+        
+        results = await process_queries_with_langgraph(list(intents))
+        
+        assert [r["query"] for r in results] == list(intents)
+        assert all(r["success"] for r in results)
+        assert results[0]["result"]["value"] == "<html>AAPL</html>"
+        assert results[1]["result"]["xbrl_tag"] == "us-gaap:NetIncomeLoss"
+        assert results[2]["result"]["value"] == "<html>MSFT</html>"
+        assert mock_get_filing_html.call_count == 2
+        assert mock_extract_facts.call_count == 2
+    
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    async def test_batch_isolates_failures(self, mock_get_filing_html, mock_llm):
+        """测试单个查询失败不影响其他查询"""
+        intents = {
+            "无法理解的查询": '{"error": "无法理解查询"}',
+            "IBM 2023 revenue": '{"ticker": "IBM", "metric": "Revenues", "year": 2023}',
+            "Apple 2023 revenue": '{"ticker": "AAPL", "metric": "Revenues", "year": 2023}',
+        }
+        mock_llm.invoke.side_effect = lambda messages, **kwargs: Mock(content=intents[messages[-1].content])
+        mock_get_filing_html.side_effect = FileNotFoundError("No 10-K found for AAPL in year 2023.")
+        
+        results = await process_queries_with_langgraph(list(intents))
+        
+        assert [r["success"] for r in results] == [False, False, False]
+        assert results[0]["error"] == "无法理解查询"
+        assert "不支持的股票代码" in results[1]["error"]
+        assert "SEC数据检索失败" in results[2]["error"]
+        mock_get_filing_html.assert_called_once_with("AAPL", 2023, "10-K")
+
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_company_facts')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    async def test_batch_routes_series_intents(self, mock_get_filing_html, mock_company_facts, mock_llm):
+        """测试批量查询中的时间序列意图同样走time_series节点"""
+        intents = {
+            "苹果2019到2020财年的收入走势": '{"ticker": "AAPL", "metric": "Revenues", "series": "annual", "start_year": 2019, "end_year": 2020}',
+            "Apple 2023 revenue": '{"ticker": "AAPL", "metric": "Revenues", "year": 2023}',
+        }
+        mock_llm.invoke.side_effect = lambda messages, **kwargs: Mock(content=intents[messages[-1].content])
+        mock_company_facts.return_value = TestTimeSeries.COMPANY_FACTS
+        mock_get_filing_html.side_effect = FileNotFoundError("No 10-K found for AAPL in year 2023.")
+
+        results = await process_queries_with_langgraph(list(intents))
+
+        assert results[0]["success"] is True
+        assert [p["fiscal_year"] for p in results[0]["result"]["points"]] == [2019, 2020]
+        assert "SEC数据检索失败" in results[1]["error"]
+        mock_get_filing_html.assert_called_once_with("AAPL", 2023, "10-K")
+
+@pytest.mark.asyncio
+class TestIntentBatching:
+    """测试意图解析微批处理"""
+    
+    def setup_method(self):
+        clear_caches()
+    
+    @patch('src.langgraph_orchestrator.llm')
+    async def test_concurrent_queries_share_one_llm_call(self, mock_llm):
+        """测试窗口内的多条查询合并成一次LLM调用"""
+        mock_llm.invoke.return_value = Mock(content=(
+            '[{"error": "无法理解查询"}, {"ticker": "IBM", "metric": "Revenues", "year": 2023}]'
+        ))
+        
+        with patch('src.langgraph_orchestrator._intent_batcher', MicroBatcher(_parse_intent_batch, window=0.2)):
+            results = await process_queries_with_langgraph(["今天天气怎么样", "IBM 2023 revenue"])
+        
+        assert mock_llm.invoke.call_count == 1
+        batched_queries = mock_llm.invoke.call_args[0][0][-1].content
+        assert "今天天气怎么样" in batched_queries and "IBM 2023 revenue" in batched_queries
+        assert results[0]["error"] == "无法理解查询"
+        assert "不支持的股票代码: IBM" in results[1]["error"]
+    
+    @patch('src.langgraph_orchestrator.llm')
+    async def test_short_deadline_query_does_not_fail_batch(self, mock_llm):
+        """测试同一批次中截止时间很短的查询超时，不影响截止时间长的查询"""
+        def invoke(messages, **kwargs):
+            time.sleep(0.1)
+            return Mock(content='[{"error": "无法理解查询"}, {"ticker": "IBM", "metric": "Revenues", "year": 2023}]')
+        mock_llm.invoke.side_effect = invoke
+
+        with patch('src.langgraph_orchestrator._intent_batcher', MicroBatcher(_parse_intent_batch, window=0.05)):
+            short, long = await asyncio.gather(
+                process_query_with_langgraph("今天天气怎么样", timeout=0.02),
+                process_query_with_langgraph("IBM 2023 revenue", timeout=30)
+            )
+
+        assert "查询超时" in short["error"]
+        assert "不支持的股票代码: IBM" in long["error"]
+        assert mock_llm.invoke.call_count == 1
+        assert mock_llm.invoke.call_args.kwargs["timeout"] > 20
+
+    @patch('src.langgraph_orchestrator.llm')
+    async def test_invalid_batch_reply_falls_back(self, mock_llm):
+        """测试批量回复无效时退回逐条解析"""
+        replies = {
+            "今天天气怎么样": '{"error": "无法理解查询"}',
+            "IBM 2023 revenue": '{"ticker": "IBM", "metric": "Revenues", "year": 2023}',
+        }
+        mock_llm.invoke.side_effect = lambda messages, **kwargs: Mock(content=replies.get(messages[-1].content, "[]"))
+        
+        assert _parse_intent_batch(list(replies)) == [(json.loads(reply), None) for reply in replies.values()]
+        assert mock_llm.invoke.call_count == 3
+
+@pytest.mark.asyncio
+class TestSpeculativePrefetch:
+    """测试意图解析期间的SEC数据预取"""
+    
+    def setup_method(self):
+        clear_caches()
+    
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    @patch('src.langgraph_orchestrator.extract_metric_from_html')
+    async def test_prefetch_matching_intent(self, mock_extract_metric, mock_get_filing_html, mock_llm, no_speculative_prefetch):
+        """测试从查询文本猜出的公司与解析结果一致时保留预取"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}'
+        )
+        mock_get_filing_html.return_value = "<html>test</html>"
+        mock_extract_metric.return_value = ("383285000000", "usd")
+        
+        result = await process_query_with_langgraph("苹果公司2023年的收入是多少？", include_timings=True)
+        
+        assert result["success"] is True
+        ticker, year, form_type, cancelled = no_speculative_prefetch.call_args[0]
+        assert (ticker, year, form_type) == ("AAPL", 2023, "10-K")
+        parse_span = next(s for s in result["timings"]["spans"] if s["name"] == "parse_intent")
+        assert parse_span["attributes"]["prefetch"] == "used"
+    
+    @patch('src.langgraph_orchestrator.llm')
+    async def test_prefetch_discarded_on_mismatch(self, mock_llm, no_speculative_prefetch):
+        """测试解析结果与猜测不一致时放弃预取"""
+        observed = {}
+        no_speculative_prefetch.side_effect = lambda ticker, year, form_type, cancelled: observed.setdefault("cancelled", cancelled)
+        mock_llm.invoke.return_value = Mock(content='{"ticker": "IBM", "metric": "Revenues", "year": 2023}')
+        
+        result = await process_query_with_langgraph("Apple vs IBM 2023 revenue", include_timings=True)
+        
+        assert result["success"] is False
+        parse_span = next(s for s in result["timings"]["spans"] if s["name"] == "parse_intent")
+        assert parse_span["attributes"]["prefetch"] == "discarded"
+        assert observed["cancelled"]() is True
+    
+    @patch('src.langgraph_orchestrator.llm')
+    async def test_no_prefetch_without_known_company(self, mock_llm, no_speculative_prefetch):
+        """测试查询中没有已知公司时不预取"""
+        mock_llm.invoke.return_value = Mock(content='{"error": "无法理解查询"}')
+        
+        await process_query_with_langgraph("今天天气怎么样")
+        
+        no_speculative_prefetch.assert_not_called()
+
+class TestStructuredIntent:
+    """测试结构化输出的意图解析"""
+    
+    def setup_method(self):
+        clear_caches()
+    
+    @patch('src.langgraph_orchestrator.llm')
+    def test_intent_from_tool_call(self, mock_llm):
+        """测试强制函数调用，意图取自调用参数并记录token用量"""
+        mock_llm.invoke.return_value = AIMessage(
+            content="",
+            tool_calls=[{"name": "record_intent", "args": {"ticker": "AAPL", "metric": "Revenues", "year": 2023}, "id": "call_1"}],
+            usage_metadata={"input_tokens": 120, "output_tokens": 15, "total_tokens": 135}
+        )
+        
+        intent, usage = _invoke_intent_llm("苹果2023年收入")
+        
+        assert intent == {"ticker": "AAPL", "metric": "Revenues", "year": 2023}
+        assert usage == {"input_tokens": 120, "output_tokens": 15, "total_tokens": 135}
+        kwargs = mock_llm.invoke.call_args[1]
+        assert kwargs["tools"][0]["function"]["name"] == "record_intent"
+        assert kwargs["tool_choice"]["function"]["name"] == "record_intent"
+    
+    @patch('src.langgraph_orchestrator.llm')
+    def test_batch_usage_split_per_query(self, mock_llm):
+        """测试批量调用的token用量按条数均摊"""
+        mock_llm.invoke.return_value = AIMessage(
+            content="",
+            tool_calls=[{"name": "record_intents", "args": {"intents": [{"error": "无法理解查询"}, {"error": "无法理解查询"}]}, "id": "call_1"}],
+            usage_metadata={"input_tokens": 200, "output_tokens": 20, "total_tokens": 220}
+        )
+        
+        results = _parse_intent_batch(["a", "b"])
+        
+        assert [usage["total_tokens"] for _, usage in results] == [110, 110]
+    
+    @pytest.mark.asyncio
+    @patch('src.langgraph_orchestrator.llm')
+    async def test_usage_in_result(self, mock_llm):
+        """测试查询结果带有意图解析的token用量"""
+        mock_llm.invoke.return_value = AIMessage(
+            content='{"error": "无法理解查询"}',
+            usage_metadata={"input_tokens": 90, "output_tokens": 8, "total_tokens": 98}
+        )
+        
+        result = await process_query_with_langgraph("今天天气怎么样")
+        
+        assert result["error"] == "无法理解查询"
+        assert result["llm_usage"]["total_tokens"] == 98
+
+@pytest.mark.asyncio
+class TestIntentIndex:
+    """测试相似查询复用已解析的意图"""
+    
+    def setup_method(self):
+        clear_caches()
+    
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    @patch('src.langgraph_orchestrator.extract_metric_from_html')
+    async def test_paraphrase_skips_llm(self, mock_extract_metric, mock_get_filing_html, mock_llm):
+        """测试换个说法的查询不再调用LLM"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}'
+        )
+        mock_get_filing_html.return_value = "<html>test</html>"
+        mock_extract_metric.return_value = ("383285000000", "usd")
+        
+        first = await process_query_with_langgraph("What was Apple's revenue in 2023?")
+        second = await process_query_with_langgraph("what was Apple revenue in 2023", include_timings=True)
+        
+        assert first["success"] is True and second["success"] is True
+        assert second["parsed_intent"] == first["parsed_intent"]
+        assert mock_llm.invoke.call_count == 1
+        lookup_span = next(s for s in second["timings"]["spans"] if s["name"] == "intent_index.lookup")
+        assert lookup_span["attributes"]["hit"] is True
+
+class TestCheckpointing:
+    """测试SEC检索的自动重试和按request_id从失败节点继续"""
+    
+    def setup_method(self):
+        clear_caches()
+    
+    @pytest.fixture(autouse=True)
+    def fast_retries(self):
+        """缩短重试退避，用新的重试策略重新构建工作流"""
+        policy = RetryPolicy(initial_interval=0.01, max_attempts=3, jitter=False, retry_on=is_transient_error)
+        with patch('src.langgraph_orchestrator.SEC_RETRY_POLICY', policy):
+            with patch('src.langgraph_orchestrator.compiled_workflow', build_workflow()):
+                yield
+    
+    @pytest.mark.asyncio
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    @patch('src.langgraph_orchestrator.extract_metric_from_html')
+    async def test_transient_error_retried(self, mock_extract_metric, mock_get_filing_html, mock_llm):
+        """测试暂时性网络错误在节点内自动重试"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}'
+        )
+        mock_get_filing_html.side_effect = [requests.ConnectionError("connection reset"), "<html>test</html>", "<html>test</html>"]
+        mock_extract_metric.return_value = ("383285000000", "usd")
+        
+        result = await process_query_with_langgraph("苹果公司2023年的收入是多少？")
+        
+        assert result["success"] is True
+        # 检索失败一次、重试成功一次，提取节点再从财报缓存读取一次
+        assert mock_get_filing_html.call_count == 3
+    
+    @pytest.mark.asyncio
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    @patch('src.langgraph_orchestrator.extract_metric_from_html')
+    async def test_retry_resumes_from_failed_node(self, mock_extract_metric, mock_get_filing_html, mock_llm):
+        """测试重试次数用完后，同一request_id的再次调用从SEC检索继续，不再调用LLM"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}'
+        )
+        mock_get_filing_html.side_effect = requests.ConnectionError("connection reset")
+        mock_extract_metric.return_value = ("383285000000", "usd")
+        
+        failed = await process_query_with_langgraph("苹果公司2023年的收入是多少？", request_id="req-1")
+        assert failed["success"] is False
+        assert "SEC数据检索失败" in failed["error"]
+        assert mock_get_filing_html.call_count == 3
+        
+        mock_get_filing_html.side_effect = None
+        mock_get_filing_html.return_value = "<html>test</html>"
+        result = await process_query_with_langgraph("苹果公司2023年的收入是多少？", request_id="req-1", include_timings=True)
+        
+        assert result["success"] is True
+        assert result["result"]["value"] == "383285000000"
+        assert mock_llm.invoke.call_count == 1
+        load_span = next(s for s in result["timings"]["spans"] if s["name"] == "checkpoint.load")
+        assert load_span["attributes"]["resumed_from"] == ["retrieve_sec_data"]
+        # 正常结束后检查点被删除
+        assert await _memory_checkpointer.aget_tuple({"configurable": {"thread_id": "req-1"}}) is None
+
+    @pytest.mark.asyncio
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    @patch('src.langgraph_orchestrator.extract_metric_from_html')
+    async def test_checkpoint_keeps_filing_reference_only(self, mock_extract_metric, mock_get_filing_html, mock_llm):
+        """测试检查点中只保存财报元数据，从提取节点恢复时重新读取财报文档"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}'
+        )
+        html = "<html>" + "x" * 100000 + "</html>"
+        mock_get_filing_html.side_effect = [html, requests.ConnectionError("connection reset"), html]
+        mock_extract_metric.return_value = ("383285000000", "usd")
+        
+        failed = await process_query_with_langgraph("苹果公司2023年的收入是多少？", request_id="req-doc")
+        assert failed["success"] is False
+        
+        checkpoint = await _memory_checkpointer.aget_tuple({"configurable": {"thread_id": "req-doc"}})
+        values = checkpoint.checkpoint["channel_values"]
+        assert values["filing"]["size"] == len(html)
+        assert all(html not in str(value) for value in values.values())
+        
+        result = await process_query_with_langgraph("苹果公司2023年的收入是多少？", request_id="req-doc")
+        assert result["success"] is True
+        assert mock_llm.invoke.call_count == 1
+        assert mock_get_filing_html.call_count == 3
+    
+    @pytest.mark.asyncio
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    async def test_failed_checkpoints_are_bounded(self, mock_get_filing_html, mock_llm):
+        """测试失败请求的内存检查点超过数量上限时删除最早的"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}'
+        )
+        mock_get_filing_html.side_effect = requests.ConnectionError("connection reset")
+
+        with patch('src.langgraph_orchestrator.CHECKPOINT_MAX_THREADS', 2):
+            for request_id in ("req-a", "req-b", "req-c"):
+                failed = await process_query_with_langgraph("苹果公司2023年的收入是多少？", request_id=request_id)
+                assert failed["success"] is False
+
+        saved = [
+            await _memory_checkpointer.aget_tuple({"configurable": {"thread_id": request_id}}) is not None
+            for request_id in ("req-a", "req-b", "req-c")
+        ]
+        assert saved == [False, True, True]
+
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    def test_permanent_error_not_retried(self, mock_get_filing_html):
+        """测试非暂时性错误不重试，仍作为检索失败返回"""
+        mock_get_filing_html.side_effect = FileNotFoundError("No 10-K found")
+        state = WorkflowState(
+            query="test", parsed_intent={"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"},
+            filing=None, extracted_value=None, error=None, success=True
+        )
+        
+        result = retrieve_sec_data_node(state)
+        
+        assert result["success"] is False
+        assert "SEC数据检索失败" in result["error"]
+        assert mock_get_filing_html.call_count == 1
+
+@pytest.mark.asyncio
+class TestAdmission:
+    """测试上游过载时的快速拒绝"""
+    
+    def setup_method(self):
+        clear_caches()
+    
+    @patch('src.langgraph_orchestrator.llm')
+    async def test_rejected_when_llm_queue_too_long(self, mock_llm):
+        """测试LLM排队时间超过截止时间时直接拒绝，不调用LLM"""
+        limiter = UpstreamLimiter("llm", max_concurrency=1, max_queue=10, initial_service_time=10.0)
+        limiter.acquire()
+        
+        with patch.dict('src.admission._limiters', {"llm": limiter}):
+            result = await process_query_with_langgraph("苹果公司2023年的收入是多少？", timeout=1)
+        
+        assert result["success"] is False
+        assert result["retry_after"] >= 1
+        assert "服务繁忙" in result["error"]
+        mock_llm.invoke.assert_not_called()
+
+    @patch('src.langgraph_orchestrator.llm')
+    async def test_rejected_stream_does_not_prefetch(self, mock_llm, no_speculative_prefetch):
+        """测试流式查询被拒绝时不启动预取，不访问SEC"""
+        limiter = UpstreamLimiter("sec", max_concurrency=1, max_queue=10, initial_service_time=10.0)
+        limiter.acquire()
+
+        with patch.dict('src.admission._limiters', {"sec": limiter}):
+            events = [event async for event in stream_query_with_langgraph("苹果公司2023年的收入是多少？", timeout=1)]
+        await asyncio.sleep(0)
+
+        assert [event["event"] for event in events] == ["result"]
+        assert "服务繁忙" in events[0]["data"]["error"]
+        no_speculative_prefetch.assert_not_called()
+        mock_llm.invoke.assert_not_called()
+
+@pytest.mark.asyncio
+class TestDeadlines:
+    """测试查询截止时间"""
+    
+    def setup_method(self):
+        clear_caches()
+    
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    async def test_query_times_out_and_cancels_work(self, mock_get_filing_html, mock_llm):
+        """测试超时后立即返回，工作线程中的下载在下一个检查点停止"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}'
+        )
+        stopped = threading.Event()
+        
+        def slow_download(ticker, year, form_type):
+            try:
+                while True:
+                    check_deadline()
+                    time.sleep(0.01)
+            except DeadlineExceeded:
+                stopped.set()
+                raise
+        
+        mock_get_filing_html.side_effect = slow_download
+        
+        start = time.perf_counter()
+        result = await process_query_with_langgraph("Apple 2023 revenue", timeout=0.2)
+        
+        assert time.perf_counter() - start < 1.0
+        assert result["success"] is False
+        assert "查询超时" in result["error"]
+        assert stopped.wait(1.0)
+    
+    @patch('src.langgraph_orchestrator.llm')
+    async def test_llm_timeout_capped_by_deadline(self, mock_llm):
+        """测试LLM请求超时不超过剩余时间"""
+        mock_llm.invoke.return_value = Mock(content='{"error": "无法理解查询"}')
+        
+        await process_query_with_langgraph("今天天气怎么样", timeout=5)
+        
+        assert 0 < mock_llm.invoke.call_args.kwargs["timeout"] <= 5
+    
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    async def test_stream_times_out(self, mock_get_filing_html, mock_llm):
+        """测试流式查询超时时产出失败的result事件"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}'
+        )
+        mock_get_filing_html.side_effect = lambda ticker, year, form_type: time.sleep(1)
+        
+        events = [event async for event in stream_query_with_langgraph("Apple 2023 revenue", timeout=0.2)]
+        
+        assert [event["event"] for event in events] == ["parsed_intent", "result"]
+        assert "查询超时" in events[-1]["data"]["error"]
+
+@pytest.mark.asyncio
+class TestResultCache:
+    """测试查询结果缓存"""
+    
+    def setup_method(self):
+        clear_caches()
+    
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    @patch('src.langgraph_orchestrator.get_cached_filing_metadata')
+    @patch('src.langgraph_orchestrator.find_latest_amendment')
+    @patch('src.langgraph_orchestrator.get_amendment_html')
+    @patch('src.langgraph_orchestrator.extract_metric_from_html')
+    async def test_cache_hit_and_amendment_invalidation(
+        self, mock_extract_metric, mock_amendment_html, mock_amendment, mock_metadata, mock_get_filing_html, mock_llm
+    ):
+        """测试重复查询命中缓存；出现新的修订版后缓存失效，并改用修订版中的数据"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}'
+        )
+        mock_get_filing_html.return_value = "<html>original 10-K</html>"
+        mock_metadata.return_value = {"accession_number": "000032019323000106", "filing_date": "2023-11-03"}
+        mock_amendment.return_value = None
+        mock_amendment_html.side_effect = lambda ticker, amendment: f"<html>{amendment['accession_number']}</html>"
+        values = {
+            "<html>original 10-K</html>": ("383285000000", "usd"),
+            "<html>000032019324000001</html>": ("383933000000", "usd"),
+        }
+        mock_extract_metric.side_effect = lambda html, metric_tag: values.get(html)
+        
+        first = await process_query_with_langgraph("Apple 2023年的收入是多少？")
+        second = await process_query_with_langgraph("Apple 2023年的收入是多少？")
+        
+        assert first["cached"] is False
+        assert second["cached"] is True
+        assert second["result"] == first["result"]
+        assert first["result"]["accession_number"] == "000032019323000106"
+        # 检索和提取各读取一次财报，命中结果缓存的查询不再读取
+        assert mock_get_filing_html.call_count == 2
+        
+        # 出现新的10-K/A后重新检索，值取自修订版
+        mock_amendment.return_value = {"accession_number": "000032019324000001", "filing_date": "2024-01-05"}
+        third = await process_query_with_langgraph("Apple 2023年的收入是多少？")
+        
+        assert third["cached"] is False
+        assert third["result"]["value"] == "383933000000"
+        assert third["result"]["accession_number"] == "000032019324000001"
+        assert (await process_query_with_langgraph("Apple 2023年的收入是多少？"))["cached"] is True
+        
+        # 只修改了部分章节、不含该指标的修订版：退回原始财报中的值
+        mock_amendment.return_value = {"accession_number": "000032019324000002", "filing_date": "2024-02-01"}
+        fourth = await process_query_with_langgraph("Apple 2023年的收入是多少？")
+        
+        assert fourth["cached"] is False
+        assert fourth["result"]["value"] == "383285000000"
+        assert fourth["result"]["accession_number"] == "000032019323000106"
+    
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    @patch('src.langgraph_orchestrator.get_cached_filing_metadata')
+    @patch('src.langgraph_orchestrator.find_latest_amendment')
+    @patch('src.langgraph_orchestrator.get_amendment_html')
+    async def test_batch_prefers_amendment(
+        self, mock_amendment_html, mock_amendment, mock_metadata, mock_get_filing_html, mock_llm
+    ):
+        """测试批量查询同样优先使用修订版中的事实，修订版中没有的指标取自原始财报"""
+        intents = {
+            "Apple 2023 revenue": '{"ticker": "AAPL", "metric": "Revenues", "year": 2023}',
+            "Apple 2023 net income": '{"ticker": "AAPL", "metric": "NetIncome", "year": 2023}',
+        }
+        mock_llm.invoke.side_effect = lambda messages, **kwargs: Mock(content=intents[messages[-1].content])
+        def document(facts):
+            return '<html xmlns:ix="http://www.xbrl.org/2013/inlineXBRL"><body>' + "".join(
+                f'<ix:nonFraction name="{tag}" unitRef="usd">{value}</ix:nonFraction>' for tag, value in facts.items()
+            ) + '</body></html>'
+        
+        mock_get_filing_html.return_value = document({"us-gaap:Revenues": "383285000000", "us-gaap:NetIncomeLoss": "96995000000"})
+        mock_metadata.return_value = {"accession_number": "000032019323000106"}
+        mock_amendment.return_value = {"accession_number": "000032019324000001"}
+        mock_amendment_html.return_value = document({"us-gaap:Revenues": "383933000000"})
+        
+        revenue, net_income = await process_queries_with_langgraph(list(intents))
+        
+        assert (revenue["result"]["value"], revenue["result"]["accession_number"]) == ("383933000000", "000032019324000001")
+        assert (net_income["result"]["value"], net_income["result"]["accession_number"]) == ("96995000000", "000032019323000106")
+        mock_amendment_html.assert_called_once()
+    
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    @patch('src.langgraph_orchestrator.get_cached_filing_metadata')
+    @patch('src.langgraph_orchestrator.find_latest_amendment', return_value=None)
+    @patch('src.langgraph_orchestrator.extract_metric_from_html')
+    async def test_include_timings(self, mock_extract_metric, mock_amendment, mock_metadata, mock_get_filing_html, mock_llm):
+        """测试结果中附带各节点耗时，命中缓存时跳过检索和提取节点"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}'
+        )
+        mock_get_filing_html.return_value = "<html>mock SEC data</html>"
+        mock_metadata.return_value = {"accession_number": "000032019323000106", "filing_date": "2023-11-03"}
+        mock_extract_metric.return_value = ("383285000000", "usd")
+        
+        first = await process_query_with_langgraph("Apple 2023年的收入是多少？", include_timings=True)
+        second = await process_query_with_langgraph("Apple 2023年的收入是多少？", include_timings=True)
+        
+        first_spans = {s["name"]: s for s in first["timings"]["spans"]}
+        assert {"parse_intent", "llm.invoke", "check_result_cache", "retrieve_sec_data", "extract_xbrl_data"} <= set(first_spans)
+        assert first_spans["check_result_cache"]["attributes"]["cache"] == "miss"
+        assert first_spans["extract_xbrl_data"]["attributes"]["tags_tried"] == ["us-gaap:Revenues"]
+        assert first["timings"]["attributes"]["success"] is True
+        
+        second_spans = {s["name"]: s for s in second["timings"]["spans"]}
+        assert second_spans["check_result_cache"]["attributes"]["cache"] == "hit"
+        assert "retrieve_sec_data" not in second_spans
+    
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    @patch('src.langgraph_orchestrator.extract_metric_from_html')
+    async def test_no_cache_without_filing_metadata(self, mock_extract_metric, mock_get_filing_html, mock_llm):
+        """测试来源财报未知时不缓存结果"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}'
+        )
+        mock_get_filing_html.return_value = "<html>mock SEC data</html>"
+        mock_extract_metric.return_value = ("383285000000", "usd")
+        
+        await process_query_with_langgraph("Apple 2023年的收入是多少？")
+        second = await process_query_with_langgraph("Apple 2023年的收入是多少？")
+        
+        assert second["cached"] is False
+        # 每次查询检索和提取各读取一次财报
+        assert mock_get_filing_html.call_count == 4
+
+class TestFanOut:
+    """测试多指标/多年份查询的扇出"""
+    
+    def setup_method(self):
+        clear_caches()
+    
+    def test_expand_intent_single_point(self):
+        """测试单点意图不展开"""
+        intent = {"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"}
+        assert expand_intent(intent) == [intent]
+    
+    def test_expand_intent_metrics_and_year_range(self):
+        """测试多指标与年份区间的笛卡尔积"""
+        intent = {"ticker": "AAPL", "metrics": ["Revenues", "NetIncome"], "start_year": 2019, "end_year": 2023}
+        sub_intents = expand_intent(intent)
+        
+        assert len(sub_intents) == 10
+        assert sub_intents[0] == {"ticker": "AAPL", "metric": "Revenues", "year": 2019, "form_type": "10-K"}
+        assert sub_intents[-1]["metric"] == "NetIncome"
+        assert sub_intents[-1]["year"] == 2023
+    
+    def test_route_after_parse(self):
+        """测试意图解析后的路由"""
+        state = WorkflowState(
+            query="test",
+            parsed_intent={"ticker": "AAPL", "metric": "Revenues", "years": [2022, 2023]},
+            extracted_value=None,
+            error=None,
+            success=True
+        )
+        assert route_after_parse(state) == "fan_out"
+        assert route_after_parse({**state, "parsed_intent": {"ticker": "AAPL", "metric": "Revenues", "year": 2023}}) == "continue"
+        assert route_after_parse({**state, "success": False}) == END
+    
+    @pytest.mark.asyncio
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    @patch('src.langgraph_orchestrator.extract_facts_from_html')
+    async def test_fan_out_returns_table(self, mock_extract_facts, mock_get_filing_html, mock_llm):
+        """测试多年份多指标查询返回一张汇总表，每年的财报只加载一次"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metrics": ["Revenues", "NetIncome"], "start_year": 2022, "end_year": 2023}'
+        )
+        mock_get_filing_html.side_effect = lambda ticker, year, form_type: str(year)
+        mock_extract_facts.side_effect = lambda html: {
+            "us-gaap:Revenues": {"value": f"revenue-{html}", "unit": "usd", "context": "c1"},
+            "us-gaap:NetIncomeLoss": {"value": f"income-{html}", "unit": "usd", "context": "c1"},
+        }
+        
+        result = await process_query_with_langgraph("Apple revenue and net income 2022-2023")
+        
+        assert result["success"] is True
+        table = result["result"]
+        assert table["metrics"] == ["Revenues", "NetIncome"]
+        assert table["years"] == [2022, 2023]
+        assert [row["value"] for row in table["rows"]] == [
+            "revenue-2022", "revenue-2023", "income-2022", "income-2023"
+        ]
+        assert mock_get_filing_html.call_count == 2
+
+class TestComparison:
+    """测试多家公司对比查询"""
+    
+    def setup_method(self):
+        clear_caches()
+    
+    def test_expand_intent_across_tickers(self):
+        """测试按公司展开意图"""
+        sub_intents = expand_intent({"tickers": ["AAPL", "MSFT"], "metric": "Revenues", "year": 2023})
+        
+        assert [(s["ticker"], s["metric"], s["year"]) for s in sub_intents] == [
+            ("AAPL", "Revenues", 2023), ("MSFT", "Revenues", 2023)
+        ]
+        assert route_after_parse({
+            "parsed_intent": {"tickers": ["AAPL", "MSFT"], "metric": "Revenues", "year": 2023},
+            "success": True
+        }) == "fan_out"
+    
+    @pytest.mark.asyncio
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_company_facts')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    async def test_comparison_returns_aligned_table(self, mock_get_filing_html, mock_company_facts, mock_llm):
+        """测试对比查询优先使用公司事实，失败时退回财报，两种来源的数值单位一致，并返回对齐的表格和各公司耗时"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"tickers": ["AAPL", "MSFT", "IBM"], "metric": "Revenues", "year": 2023, "form_type": "10-K"}'
+        )
+        msft_facts = {"facts": {"us-gaap": {"Revenues": {"units": {"USD": [
+            {"start": "2022-07-01", "end": "2023-06-30", "val": 211915000000, "fy": 2023, "fp": "FY",
+             "form": "10-K", "filed": "2023-07-27", "accn": "0000950170-23-035122"}
+        ]}}}}}
+        
+        def company_facts(ticker):
+            if ticker == "AAPL":
+                raise FileNotFoundError("no company facts")
+            return msft_facts
+        
+        mock_company_facts.side_effect = company_facts
+        # 财报中的显示值以百万为单位（scale=6），换算后与公司事实的完整数值可比
+        mock_get_filing_html.return_value = (
+            '<html xmlns:ix="http://www.xbrl.org/2013/inlineXBRL"><body>'
+            '<ix:nonFraction name="us-gaap:Revenues" contextRef="c1" unitRef="usd" scale="6" decimals="-6">383,285</ix:nonFraction>'
+            '</body></html>'
+        )
+        
+        result = await process_query_with_langgraph("Compare revenue of Apple, Microsoft and IBM in 2023")
+        
+        assert result["success"] is True
+        table = result["result"]
+        assert table["tickers"] == ["AAPL", "MSFT", "IBM"]
+        assert table["comparison"] == [{
+            "metric": "Revenues",
+            "year": 2023,
+            "values": {"AAPL": "383285000000", "MSFT": "211915000000", "IBM": None}
+        }]
+        assert table["rows"][1]["source"] == "companyfacts"
+        assert "不支持的股票代码" in table["rows"][2]["error"]
+        assert set(table["timings_ms"]) == {"AAPL", "MSFT", "IBM"}
+        mock_get_filing_html.assert_called_once_with("AAPL", 2023, "10-K")
+
+def _annual_fact(tag_year, val, accn):
+    """一份10-K中当前财年的收入事实"""
+    return {"start": f"{tag_year - 1}-10-01", "end": f"{tag_year}-09-30", "val": val, "fy": tag_year,
+            "fp": "FY", "form": "10-K", "filed": f"{tag_year}-11-01", "accn": accn}
+
+class TestTimeSeries:
+    """测试时间序列查询"""
+    
+    COMPANY_FACTS = {"facts": {"us-gaap": {
+        "Revenues": {"units": {"USD": [
+            _annual_fact(2017, 229, "a-17"),
+            _annual_fact(2018, 265, "a-18"),
+        ]}},
+        "RevenueFromContractWithCustomerExcludingAssessedTax": {"units": {"USD": [
+            _annual_fact(2018, 265, "a-18"),
+            _annual_fact(2019, 260, "a-19"),
+            _annual_fact(2020, 274, "a-20"),
+        ]}},
+    }}}
+    
+    def setup_method(self):
+        clear_caches()
+    
+    @patch('src.langgraph_orchestrator.get_company_facts')
+    def test_series_merges_tags_from_one_load(self, mock_company_facts):
+        """测试只加载一次公司事实，并合并公司在不同年份使用的标签"""
+        mock_company_facts.return_value = self.COMPANY_FACTS
+        
+        series = get_metric_time_series("aapl", "Revenue", 2017, 2019)
+        
+        assert [(p["fiscal_year"], p["value"], p["xbrl_tag"]) for p in series["points"]] == [
+            (2017, "229", "us-gaap:Revenues"),
+            (2018, "265", "us-gaap:Revenues"),
+            (2019, "260", "us-gaap:RevenueFromContractWithCustomerExcludingAssessedTax"),
+        ]
+        assert series["ticker"] == "AAPL"
+        mock_company_facts.assert_called_once_with("AAPL")
+    
+    @patch('src.langgraph_orchestrator.get_company_facts')
+    def test_series_errors(self, mock_company_facts):
+        """测试不支持的股票代码和没有数据的范围"""
+        mock_company_facts.return_value = self.COMPANY_FACTS
+        
+        with pytest.raises(ValueError):
+            get_metric_time_series("IBM", "Revenues")
+        with pytest.raises(FileNotFoundError):
+            get_metric_time_series("AAPL", "Revenues", 2000, 2005)
+    
+    @pytest.mark.asyncio
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_company_facts')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    async def test_series_intent(self, mock_get_filing_html, mock_company_facts, mock_llm):
+        """测试时间序列意图走time_series节点，不下载财报"""
+        mock_llm.invoke.return_value = Mock(
+            content='{"ticker": "AAPL", "metric": "Revenues", "series": "annual", "start_year": 2019, "end_year": 2020}'
+        )
+        mock_company_facts.return_value = self.COMPANY_FACTS
+        
+        result = await process_query_with_langgraph("苹果2019到2020财年的收入走势")
+        
+        assert result["success"] is True
+        assert [p["fiscal_year"] for p in result["result"]["points"]] == [2019, 2020]
+        mock_get_filing_html.assert_not_called()
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"]) 
\ No newline at end of file
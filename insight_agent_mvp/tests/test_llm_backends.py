@@ -0,0 +1,104 @@
+"""
+测试LLM后端 src/llm_backends.py 和规则解析 src/query_hints.py
+"""
+
+import os
+import sys
+import json
+import time
+import pytest
+from langchain.schema import HumanMessage, SystemMessage
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
+
+from src.llm_backends import FakeIntentChatModel, rule_based_intent, create_llm
+from src.query_hints import detect_ticker, detect_years, detect_form_type, detect_metrics
+
+class TestQueryHints:
+    """测试基于规则的查询槽位识别"""
+
+    def test_detect_ticker(self):
+        """测试识别股票代码和公司名称"""
+        assert detect_ticker("AAPL 2023 revenue") == "AAPL"
+        assert detect_ticker("What was Microsoft's net income?") == "MSFT"
+        assert detect_ticker("谷歌2022年的总资产") == "GOOGL"
+        assert detect_ticker("no company here") is None
+
+    def test_detect_years(self):
+        """测试识别年份和年份区间"""
+        assert detect_years("revenue in 2023") == [2023]
+        assert detect_years("2021年和2023年") == [2021, 2023]
+        assert detect_years("from 2019 to 2021") == [2019, 2020, 2021]
+
+    def test_detect_form_type(self):
+        """测试识别财报类型"""
+        assert detect_form_type("Apple 10-Q revenue") == "10-Q"
+        assert detect_form_type("苹果季度收入") == "10-Q"
+        assert detect_form_type("Apple annual revenue") == "10-K"
+
+    def test_detect_metrics(self):
+        """测试识别指标，长别名优先"""
+        assert detect_metrics("Apple net income 2023") == ["NetIncome"]
+        assert detect_metrics("总资产和净利润") == ["TotalAssets", "NetIncome"]
+
+class TestFakeIntentChatModel:
+    """测试离线LLM后端"""
+
+    def test_rule_based_intent(self):
+        """测试规则解析出与提示词相同格式的意图"""
+        assert rule_based_intent("苹果公司2023年的收入是多少？") == {
+            "ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"
+        }
+        assert rule_based_intent("MSFT revenue and net income 2022-2023") == {
+            "ticker": "MSFT", "metrics": ["Revenues", "NetIncome"], "years": [2022, 2023], "form_type": "10-K"
+        }
+        assert "error" in rule_based_intent("今天天气怎么样")
+
+    def test_invoke_uses_last_human_message(self):
+        """测试invoke按用户查询返回JSON"""
+        model = FakeIntentChatModel()
+        response = model.invoke([SystemMessage(content="系统提示"), HumanMessage(content="Tesla net income 2022")])
+
+        assert json.loads(response.content) == {
+            "ticker": "TSLA", "metric": "NetIncome", "year": 2022, "form_type": "10-K"
+        }
+
+    def test_recorded_responses(self):
+        """测试优先返回录制的回复"""
+        model = FakeIntentChatModel(responses={"hello": '{"error": "无法理解查询"}'})
+        assert model.invoke([HumanMessage(content="hello")]).content == '{"error": "无法理解查询"}'
+
+    def test_tool_call_reply(self):
+        """测试传入tools时以函数调用返回意图，并给出token用量"""
+        model = FakeIntentChatModel()
+        tool = {"type": "function", "function": {"name": "record_intent", "parameters": {"type": "object"}}}
+        response = model.invoke([HumanMessage(content="Tesla net income 2022")], tools=[tool])
+
+        assert response.tool_calls[0]["name"] == "record_intent"
+        assert response.tool_calls[0]["args"]["ticker"] == "TSLA"
+        assert response.usage_metadata["total_tokens"] > 0
+
+        batch = model.invoke([HumanMessage(content='["AAPL revenue 2023", "hello"]')], tools=[tool])
+        intents = batch.tool_calls[0]["args"]["intents"]
+        assert intents[0]["ticker"] == "AAPL" and "error" in intents[1]
+
+    def test_synthetic_latency(self):
+        """测试合成延迟"""
+        model = FakeIntentChatModel(latency_median_ms=50, latency_sigma=0)
+        start = time.perf_counter()
+        model.invoke([HumanMessage(content="AAPL revenue 2023")])
+        assert time.perf_counter() - start >= 0.05
+
+        seeded = [FakeIntentChatModel(latency_median_ms=100, seed=7).sample_latency() for _ in range(2)]
+        assert seeded[0] == seeded[1]
+
+    def test_create_llm(self):
+        """测试按后端名称创建模型"""
+        assert isinstance(create_llm("fake"), FakeIntentChatModel)
+        with pytest.raises(ValueError):
+            create_llm("unknown")
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,79 @@
+"""
+测试指标知识库 src/metrics_manager.py
+"""
+
+import os
+import sys
+import pytest
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
+
+from src import metrics_manager
+from src.metrics_manager import (
+    normalize_alias, resolve_metric, get_tags_for_metric, get_time_type,
+    record_tag_hit, add_metric_mapping, list_metrics
+)
+
+class TestMetricsManager:
+    """测试指标别名解析和候选标签排序"""
+
+    def setup_method(self):
+        metrics_manager._tag_hits.clear()
+
+    def test_normalize_alias(self):
+        """测试别名归一化忽略大小写、空白和分隔符"""
+        assert normalize_alias("Net Income") == normalize_alias("net_income") == "netincome"
+        assert normalize_alias("ＮｅｔＩｎｃｏｍｅ") == "netincome"
+
+    def test_resolve_aliases(self):
+        """测试不同写法解析到同一个规范指标"""
+        assert resolve_metric("Revenue") == "Revenues"
+        assert resolve_metric("total assets") == "TotalAssets"
+        assert resolve_metric("净利润") == "NetIncome"
+        assert resolve_metric("SomethingElse") is None
+
+    def test_get_tags_for_known_metric(self):
+        """测试已知指标返回知识库中的候选标签"""
+        tags = get_tags_for_metric("Revenues")
+        assert tags[0] == "us-gaap:Revenues"
+        assert "us-gaap:RevenueFromContractWithCustomerExcludingAssessedTax" in tags
+        assert get_tags_for_metric("NetIncome")[0] == "us-gaap:NetIncomeLoss"
+
+    def test_unknown_metric_is_its_own_tag(self):
+        """测试未知指标原样作为候选标签"""
+        assert get_tags_for_metric("us-gaap:CustomTag") == ["us-gaap:CustomTag"]
+
+    def test_time_type(self):
+        """测试时点/期间类型"""
+        assert get_time_type("TotalAssets") == "instant"
+        assert get_time_type("Revenues") == "duration"
+        assert get_time_type("SomethingElse") is None
+
+    def test_tag_hits_reorder_candidates(self):
+        """测试按公司命中记录调整候选标签顺序"""
+        preferred = "us-gaap:RevenueFromContractWithCustomerExcludingAssessedTax"
+        record_tag_hit("aapl", "Revenue", preferred)
+
+        assert get_tags_for_metric("Revenues", "AAPL")[0] == preferred
+        # 其他公司不受影响
+        assert get_tags_for_metric("Revenues", "MSFT")[0] == "us-gaap:Revenues"
+        assert get_tags_for_metric("Revenues")[0] == "us-gaap:Revenues"
+
+    def test_add_metric_mapping(self):
+        """测试运行时注册新指标"""
+        add_metric_mapping(
+            "ResearchAndDevelopment",
+            ["us-gaap:ResearchAndDevelopmentExpense"],
+            aliases=["R&D", "研发费用"]
+        )
+        try:
+            assert resolve_metric("r&d") == "ResearchAndDevelopment"
+            assert get_tags_for_metric("研发费用") == ["us-gaap:ResearchAndDevelopmentExpense"]
+            assert "ResearchAndDevelopment" in list_metrics()
+        finally:
+            metrics_manager.load_metrics()
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
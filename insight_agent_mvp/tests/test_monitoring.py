@@ -0,0 +1,125 @@
+"""
+测试Prometheus格式指标 src/monitoring.py
+"""
+
+import os
+import sys
+import threading
+import pytest
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
+
+from src import monitoring
+from src.telemetry import start_trace, span, annotate
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    """每个测试从零开始，结束后恢复sink的注册状态"""
+    was_enabled = monitoring.enabled()
+    monitoring.disable()
+    monitoring.reset()
+    yield
+    monitoring.disable()
+    monitoring.reset()
+    if was_enabled:
+        monitoring.enable()
+
+def _sample(text: str, line_prefix: str) -> float:
+    """取出以line_prefix开头的样本值"""
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{line_prefix} not found")
+
+def _trace(spans, duration_ms=1200.0, success=True):
+    """构造Trace.to_dict()格式的追踪数据"""
+    return {
+        "name": "process_query",
+        "attributes": {"success": success},
+        "duration_ms": duration_ms,
+        "spans": [
+            {"id": i, "parent_id": parent, "name": name, "start_ms": 0.0, "duration_ms": ms, "attributes": attrs}
+            for i, (name, parent, ms, attrs) in enumerate(spans, start=1)
+        ],
+    }
+
+class TestRecordTrace:
+    """测试追踪数据到指标的转换"""
+
+    def test_latency_histograms(self):
+        """测试端到端、节点和阶段延迟落入正确的桶"""
+        monitoring.record_trace(_trace([
+            ("parse_intent", None, 300.0, {}),
+            ("llm.invoke", 1, 280.0, {}),
+            ("sec.download", 2, 40.0, {}),
+        ]))
+        text = monitoring.render()
+
+        assert _sample(text, 'insight_request_duration_seconds_bucket{operation="process_query",le="1"}') == 0
+        assert _sample(text, 'insight_request_duration_seconds_bucket{operation="process_query",le="2.5"}') == 1
+        assert _sample(text, 'insight_request_duration_seconds_bucket{operation="process_query",le="+Inf"}') == 1
+        assert _sample(text, 'insight_request_duration_seconds_sum{operation="process_query"}') == pytest.approx(1.2)
+        assert _sample(text, 'insight_requests_total{operation="process_query",success="true"}') == 1
+        assert _sample(text, 'insight_stage_duration_seconds_bucket{stage="llm_parse",le="0.25"}') == 0
+        assert _sample(text, 'insight_stage_duration_seconds_bucket{stage="llm_parse",le="0.5"}') == 1
+        assert _sample(text, 'insight_stage_duration_seconds_count{stage="document_download"}') == 1
+        assert _sample(text, 'insight_node_duration_seconds_count{node="parse_intent"}') == 1
+        # 子span不算作节点
+        assert 'node="llm.invoke"' not in text
+
+    def test_cache_errors_retries_and_bytes(self):
+        """测试缓存命中、上游错误、重试次数和下载字节数"""
+        monitoring.record_trace(_trace([
+            ("intent_index.lookup", None, 1.0, {"hit": False}),
+            ("check_result_cache", None, 1.0, {"cache": "miss"}),
+            ("retrieve_sec_data", None, 10.0, {"error": "ConnectionError"}),
+            ("sec.http", 3, 5.0, {"error": "ConnectionError"}),
+            ("retrieve_sec_data", None, 10.0, {}),
+            ("sec.submissions", 5, 1.0, {"cache": "hit"}),
+            ("sec.http", 5, 5.0, {"status": 200, "bytes": 2048}),
+            ("sec.get_filing_html", 5, 6.0, {"cache": "miss", "bytes": 2048}),
+        ], success=False))
+        text = monitoring.render()
+
+        assert _sample(text, 'insight_cache_requests_total{tier="intent_index",result="miss"}') == 1
+        assert _sample(text, 'insight_cache_requests_total{tier="result",result="miss"}') == 1
+        assert _sample(text, 'insight_cache_requests_total{tier="submissions",result="hit"}') == 1
+        assert _sample(text, 'insight_cache_requests_total{tier="filing",result="miss"}') == 1
+        assert _sample(text, 'insight_upstream_errors_total{upstream="sec",error="ConnectionError"}') == 1
+        assert _sample(text, 'insight_upstream_retries_total{upstream="sec"}') == 1
+        assert _sample(text, "insight_sec_downloaded_bytes_total") == 2048
+        assert _sample(text, 'insight_requests_total{operation="process_query",success="false"}') == 1
+
+    def test_admission_gauges(self):
+        """测试导出准入控制的负载"""
+        text = monitoring.render()
+        assert _sample(text, 'insight_upstream_active{upstream="sec"}') == 0
+        assert "# TYPE insight_upstream_rejected_total counter" in text
+
+    def test_threads_record_to_own_shards(self):
+        """测试多线程并发记录时计数不丢失"""
+        def record():
+            for _ in range(500):
+                monitoring.increment("insight_upstream_retries_total", ("llm",))
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert _sample(monitoring.render(), 'insight_upstream_retries_total{upstream="llm"}') == 2000
+
+    def test_sink_receives_traces(self):
+        """测试enable()后追踪结束时自动记录"""
+        monitoring.enable()
+        with start_trace("get_metric_for_ticker") as trace:
+            with span("sec.submissions"):
+                annotate(cache="hit")
+            trace.attributes["success"] = True
+
+        text = monitoring.render()
+        assert _sample(text, 'insight_requests_total{operation="get_metric_for_ticker",success="true"}') == 1
+        assert _sample(text, 'insight_cache_requests_total{tier="submissions",result="hit"}') == 1
@@ -6,14 +6,16 @@ import os
 import sys
 import pytest
 import json
-from unittest.mock import patch, Mock
+from unittest.mock import patch, Mock, AsyncMock
 from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage
 
-# 添加src目录到路径
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
 
 # 导入FastAPI应用
-from orchestrator import app
+from src.orchestrator import app
 
 # 创建测试客户端
 client = TestClient(app)
@@ -73,8 +75,8 @@ class TestBasicEndpoints:
 class TestStructuredQueries:
     """测试结构化查询"""
     
-    @patch('orchestrator.get_filing_html')
-    @patch('orchestrator.extract_metric_from_html')
+    @patch('src.orchestrator.get_filing_html')
+    @patch('src.orchestrator.extract_metric_from_html')
     def test_get_metric_success(self, mock_extract, mock_get_filing):
         """测试成功的指标查询"""
         # 模拟SEC检索
@@ -117,8 +119,8 @@ class TestStructuredQueries:
         
         assert response.status_code == 422  # Validation error
     
-    @patch('orchestrator.get_latest_10k_html')
-    @patch('orchestrator.extract_revenue_from_html')
+    @patch('src.orchestrator.get_latest_10k_html')
+    @patch('src.orchestrator.extract_revenue_from_html')
     def test_get_revenue_legacy(self, mock_extract, mock_get_html):
         """测试遗留的收入查询端点"""
         # 模拟数据
@@ -136,31 +138,30 @@ class TestStructuredQueries:
 class TestNaturalLanguageQueries:
     """测试自然语言查询"""
     
-    @patch('orchestrator.openai.ChatCompletion.create')
-    @patch('orchestrator.get_metric_for_ticker')
-    def test_query_endpoint_success(self, mock_get_metric, mock_openai):
+    @pytest.fixture(autouse=True)
+    def offline_workflow(self):
+        """有API密钥（LLM由测试替换），不预取SEC数据，每个测试从空缓存开始"""
+        from src.langgraph_orchestrator import clear_caches
+        clear_caches()
+        with patch('src.orchestrator.OPENAI_API_KEY', 'sk-test'), \
+             patch('src.langgraph_orchestrator.prefetch_filing_metadata'):
+            yield
+    
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    @patch('src.langgraph_orchestrator.extract_metric_from_html')
+    def test_query_endpoint_success(self, mock_extract_metric, mock_get_filing_html, mock_llm):
         """测试成功的自然语言查询"""
-        # 模拟OpenAI响应
-        mock_openai.return_value = Mock(
-            choices=[Mock(
-                message=Mock(
-                    tool_calls=[Mock(
-                        function=Mock(
-                            name="get_financial_metric",
-                            arguments='{"ticker": "AAPL", "metric": "Revenues", "year": 2023}'
-                        )
-                    )]
-                )
-            )]
-        )
+        # 模拟LLM以函数调用返回意图
+        mock_llm.invoke.return_value = AIMessage(content="", tool_calls=[{
+            "name": "record_intent",
+            "args": {"ticker": "AAPL", "metric": "Revenues", "year": 2023, "form_type": "10-K"},
+            "id": "call_1"
+        }])
         
-        # 模拟指标检索结果
-        mock_get_metric.return_value = {
-            "ticker": "AAPL",
-            "metric": "Revenues",
-            "value": "383285000000",
-            "unit": "USD"
-        }
+        # 模拟财报检索和指标提取
+        mock_get_filing_html.return_value = "<html>Mock HTML</html>"
+        mock_extract_metric.return_value = ("383285000000", "usd")
         
         response = client.post("/query", json={
             "text": "苹果公司2023年的收入是多少？"
@@ -177,16 +178,15 @@ class TestNaturalLanguageQueries:
         assert parsed["ticker"] == "AAPL"
         assert parsed["metric"] == "Revenues"
         assert parsed["year"] == 2023
+        assert data["result"]["value"] == "383285000000"
+        mock_get_filing_html.assert_called_with("AAPL", 2023, "10-K")
     
-    @patch('orchestrator.openai.ChatCompletion.create')
-    def test_query_endpoint_no_tool_call(self, mock_openai):
+    @patch('src.langgraph_orchestrator.llm')
+    @patch('src.langgraph_orchestrator.get_filing_html')
+    def test_query_endpoint_no_tool_call(self, mock_get_filing_html, mock_llm):
         """测试LLM没有调用工具的情况"""
-        # 模拟OpenAI响应（没有工具调用）
-        mock_openai.return_value = Mock(
-            choices=[Mock(
-                message=Mock(tool_calls=None)
-            )]
-        )
+        # 模拟LLM回复（没有函数调用，正文也不是JSON）
+        mock_llm.invoke.return_value = AIMessage(content="今天天气不错")
         
         response = client.post("/query", json={
             "text": "今天天气怎么样？"
@@ -197,17 +197,36 @@ class TestNaturalLanguageQueries:
         
         assert data["success"] is False
         assert "error" in data
+        mock_get_filing_html.assert_not_called()
     
     def test_query_endpoint_no_openai_key(self):
-        """测试没有OpenAI API密钥的情况"""
-        with patch('orchestrator.OPENAI_API_KEY', None):
+        """测试没有OpenAI API密钥时自然语言查询返回503"""
+        with patch('src.orchestrator.OPENAI_API_KEY', None), \
+             patch('src.orchestrator.LLM_BACKEND', 'openai'), \
+             patch('src.orchestrator.RECORDING_MODE', 'off'):
             response = client.post("/query", json={
                 "text": "苹果公司收入"
             })
             
-            assert response.status_code == 200
+            assert response.status_code == 503
             data = response.json()
             assert data["success"] is False
+            
+            response = client.post("/query/stream", json={"text": "苹果公司收入"})
+            assert response.status_code == 503
+            assert json.loads(response.text.splitlines()[0])["data"]["success"] is False
+    
+    def test_service_starts_without_openai_key(self):
+        """测试没有OpenAI API密钥时服务仍能导入启动，LLM在首次使用时才创建"""
+        import subprocess
+        project_root = os.path.join(os.path.dirname(__file__), '..')
+        env = {key: value for key, value in os.environ.items() if key != "OPENAI_API_KEY"}
+        env["LLM_BACKEND"] = "openai"
+        completed = subprocess.run(
+            [sys.executable, "-c", "from src import orchestrator, langgraph_orchestrator; assert langgraph_orchestrator.llm is None"],
+            cwd=project_root, env=env, capture_output=True, text=True, timeout=120
+        )
+        assert completed.returncode == 0, completed.stderr
     
     def test_query_endpoint_invalid_request(self):
         """测试无效请求格式"""
@@ -217,10 +236,225 @@ class TestNaturalLanguageQueries:
         
         assert response.status_code == 422
 
+class TestHTTPCaching:
+    """测试结构化查询的ETag和缓存头"""
+    
+    @patch('src.orchestrator.get_cached_filing_metadata')
+    @patch('src.orchestrator.get_filing_html')
+    @patch('src.orchestrator.extract_metric_from_html')
+    def test_etag_and_not_modified(self, mock_extract, mock_get_filing, mock_metadata):
+        """测试响应带有强ETag，If-None-Match一致时返回304"""
+        mock_get_filing.return_value = "<html>Mock HTML content</html>"
+        mock_extract.return_value = ("383285000000", "USD")
+        mock_metadata.return_value = {"accession_number": "0000320193-23-000106"}
+        params = {"ticker": "AAPL", "metric": "Revenues", "year": 2023}
+        
+        response = client.get("/get-metric", params=params)
+        etag = response.headers["etag"]
+        assert response.status_code == 200
+        assert etag.startswith('"') and not etag.startswith("W/")
+        assert "max-age=86400" in response.headers["cache-control"]
+        
+        cached = client.get("/get-metric", params=params, headers={"If-None-Match": f'"stale", W/{etag}'})
+        assert cached.status_code == 304
+        assert cached.headers["etag"] == etag
+        
+        mock_metadata.return_value = {"accession_number": "0000320193-24-000001"}
+        amended = client.get("/get-metric", params=params, headers={"If-None-Match": etag})
+        assert amended.status_code == 200
+        assert amended.headers["etag"] != etag
+
+class TestPipelineEndpoints:
+    """测试基于LangGraph工作流的端点"""
+    
+    @patch('src.orchestrator.OPENAI_API_KEY', 'sk-test')
+    @patch('src.orchestrator.process_query_with_langgraph', new_callable=AsyncMock)
+    def test_query_uses_workflow(self, mock_process):
+        """测试自然语言查询交给LangGraph工作流，并透传request_id"""
+        mock_process.return_value = {
+            "query": "苹果公司2023年的收入是多少？",
+            "parsed_intent": {"ticker": "AAPL", "metric": "Revenues", "year": 2023},
+            "result": {"value": "383285000000", "unit": "USD"},
+            "success": True
+        }
+        
+        response = client.post("/query", json={"text": "苹果公司2023年的收入是多少？", "request_id": "req-1"})
+        
+        assert response.status_code == 200
+        assert response.json()["success"] is True
+        mock_process.assert_awaited_once_with("苹果公司2023年的收入是多少？", request_id="req-1")
+    
+    @patch('src.orchestrator.OPENAI_API_KEY', 'sk-test')
+    @patch('src.orchestrator.process_query_with_langgraph', new_callable=AsyncMock)
+    def test_query_overloaded(self, mock_process):
+        """测试上游过载时返回429和Retry-After"""
+        mock_process.return_value = {"query": "q", "error": "服务繁忙", "retry_after": 2.3, "success": False}
+        
+        response = client.post("/query", json={"text": "q"})
+        
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "3"
+    
+    @patch('src.orchestrator.OPENAI_API_KEY', 'sk-test')
+    @patch('src.orchestrator.stream_query_with_langgraph')
+    def test_query_stream_ndjson(self, mock_stream):
+        """测试流式查询逐行返回事件"""
+        async def events(text):
+            yield {"event": "parsed_intent", "data": {"ticker": "AAPL"}}
+            yield {"event": "result", "data": {"success": True}}
+        mock_stream.side_effect = events
+        
+        response = client.post("/query/stream", json={"text": "苹果公司2023年的收入是多少？"})
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["event"] for line in lines] == ["parsed_intent", "result"]
+    
+    @patch('src.orchestrator.get_metric_time_series')
+    def test_time_series(self, mock_series):
+        """测试时间序列端点"""
+        mock_series.return_value = {"ticker": "AAPL", "metric": "Revenues", "points": []}
+        
+        response = client.get("/time-series", params={"ticker": "AAPL", "metric": "Revenues", "start_year": 2020})
+        
+        assert response.status_code == 200
+        mock_series.assert_called_once_with("AAPL", "Revenues", 2020, None, "annual")
+        
+        mock_series.side_effect = ValueError("起始年份不能晚于结束年份")
+        assert client.get("/time-series", params={"ticker": "AAPL", "metric": "Revenues"}).status_code == 400
+
+class TestMetricsEndpoint:
+    """测试Prometheus指标端点"""
+    
+    @patch('src.orchestrator.get_cached_filing_metadata')
+    @patch('src.orchestrator.get_filing_html')
+    @patch('src.orchestrator.extract_metric_from_html')
+    def test_metrics_after_lookup(self, mock_extract, mock_get_filing, mock_metadata):
+        """测试结构化查询被计入端到端延迟直方图"""
+        mock_get_filing.return_value = "<html>Mock HTML content</html>"
+        mock_extract.return_value = ("383285000000", "USD")
+        mock_metadata.return_value = None
+        client.get("/get-metric", params={"ticker": "AAPL", "metric": "Revenues", "year": 2023})
+        
+        response = client.get("/metrics")
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert "# TYPE insight_request_duration_seconds histogram" in response.text
+        assert 'insight_requests_total{operation="get_metric_for_ticker",success="true"}' in response.text
+        assert 'insight_upstream_queued{upstream="sec"} 0' in response.text
+
+class TestBulkEndpoint:
+    """测试批量结构化查询"""
+    
+    @patch('src.orchestrator.get_cached_filing_metadata', return_value=None)
+    @patch('src.orchestrator.load_filing_facts')
+    def test_bulk_lookup_dedupes_filings(self, mock_load_facts, mock_metadata):
+        """测试同一份财报只加载一次，结果逐行返回并带有index"""
+        mock_load_facts.return_value = {
+            "us-gaap:Revenues": {"value": "383285000000", "unit": "USD"},
+            "us-gaap:NetIncomeLoss": {"value": "96995000000", "unit": "USD"},
+        }
+        
+        response = client.post("/bulk/get-metric", json=[
+            {"ticker": "AAPL", "metric": "Revenues", "year": 2023},
+            {"ticker": "aapl", "metric": "net income", "year": 2023},
+            {"ticker": "INVALID", "metric": "Revenues", "year": 2023},
+            {"ticker": "AAPL", "metric": "Revenues"},
+        ])
+        
+        assert response.status_code == 200
+        rows = {row["index"]: row for row in map(json.loads, response.text.splitlines())}
+        assert rows[0]["value"] == "383285000000"
+        assert rows[1]["value"] == "96995000000" and rows[1]["xbrl_tag"] == "us-gaap:NetIncomeLoss"
+        assert rows[2]["status"] == 404 and rows[2]["success"] is False
+        assert rows[3]["status"] == 422
+        mock_load_facts.assert_called_once_with(("AAPL", 2023, "10-K"))
+    
+    @patch('src.orchestrator.load_filing_facts')
+    def test_bulk_ndjson_upload_and_errors(self, mock_load_facts):
+        """测试NDJSON上传，单份财报失败只影响对应的查询"""
+        mock_load_facts.side_effect = FileNotFoundError("No 10-K found for AAPL in year 1990.")
+        body = "\n".join([
+            json.dumps({"ticker": "AAPL", "metric": "Revenues", "year": 1990}),
+            json.dumps({"ticker": "MSFT", "metric": "Bogus", "year": 2023}),
+        ])
+        
+        response = client.post("/bulk/get-metric", content=body, headers={"Content-Type": "application/x-ndjson"})
+        
+        rows = {row["index"]: row for row in map(json.loads, response.text.splitlines())}
+        assert rows[0]["status"] == 404 and "No 10-K found" in rows[0]["error"]
+        assert "不支持的指标" in rows[1]["error"]
+    
+    def test_bulk_invalid_body(self):
+        """测试无法解析的请求体"""
+        response = client.post("/bulk/get-metric", content="not json", headers={"Content-Type": "application/json"})
+        assert response.status_code == 400
+
+class TestJobEndpoints:
+    """测试后台批量任务"""
+    
+    @pytest.fixture
+    def runner(self, tmp_path):
+        """使用临时数据库的任务队列；不启动worker线程，由测试手动执行"""
+        from src.jobs import JobStore, JobRunner
+        from src.orchestrator import _job_filing_rows
+        runner = JobRunner(JobStore(str(tmp_path / "jobs.sqlite"), str(tmp_path / "results")), _job_filing_rows)
+        with patch('src.orchestrator._job_runner_instance', runner):
+            yield runner
+    
+    @patch('src.orchestrator.get_cached_filing_metadata', return_value=None)
+    @patch('src.orchestrator.load_filing_facts')
+    def test_job_lifecycle(self, mock_load_facts, mock_metadata, runner):
+        """测试按 公司×指标×年份 展开的任务：提交、查询进度、下载结果"""
+        mock_load_facts.return_value = {"us-gaap:Revenues": {"value": "100", "unit": "USD"}}
+        
+        response = client.post("/jobs", json={"tickers": ["AAPL", "msft"], "metrics": ["Revenues"], "start_year": 2022, "end_year": 2023})
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        assert response.headers["location"] == f"/jobs/{job_id}"
+        assert response.json()["total"] == 4
+        assert client.get(f"/jobs/{job_id}/result").status_code == 409
+        
+        while runner.run_once():
+            pass
+        
+        status = client.get(f"/jobs/{job_id}").json()
+        assert status["status"] == "completed" and status["done"] == 4
+        assert "result_path" not in status
+        result = client.get(status["result_url"])
+        assert result.status_code == 200
+        rows = [json.loads(line) for line in result.text.splitlines()]
+        assert [(row["ticker"], row["year"]) for row in rows] == [("AAPL", 2022), ("AAPL", 2023), ("MSFT", 2022), ("MSFT", 2023)]
+        assert all(row["value"] == "100" for row in rows)
+        assert mock_load_facts.call_count == 4
+    
+    @patch('src.orchestrator.load_filing_facts')
+    def test_transient_errors_are_retried(self, mock_load_facts, runner):
+        """测试SEC暂时不可用时任务稍后重试，而不是记为失败"""
+        import requests
+        mock_load_facts.side_effect = requests.ConnectionError("connection reset")
+        job_id = client.post("/jobs", json={"requests": [{"ticker": "AAPL", "metric": "Revenues", "year": 2023}]}).json()["job_id"]
+        
+        assert runner.run_once()
+        status = client.get(f"/jobs/{job_id}").json()
+        assert status["status"] == "running" and status["done"] == 0
+    
+    def test_invalid_jobs(self, runner):
+        """测试不支持的公司、缺少年份、不存在的任务和取消"""
+        assert client.post("/jobs", json={"tickers": ["INVALID"], "years": [2023]}).status_code == 422
+        assert client.post("/jobs", json={"tickers": ["AAPL"]}).status_code == 422
+        assert client.get("/jobs/missing").status_code == 404
+        
+        job_id = client.post("/jobs", json={"tickers": ["AAPL"], "metrics": ["Revenues"], "years": [2023]}).json()["job_id"]
+        assert client.delete(f"/jobs/{job_id}").json()["status"] == "cancelled"
+        assert client.delete(f"/jobs/{job_id}").status_code == 409
+
 class TestErrorHandling:
     """测试错误处理"""
     
-    @patch('orchestrator.get_filing_html')
+    @patch('src.orchestrator.get_filing_html')
     def test_sec_retrieval_error(self, mock_get_filing):
         """测试SEC检索错误"""
         mock_get_filing.side_effect = ValueError("Filing not found")
@@ -233,8 +467,8 @@ class TestErrorHandling:
         
         assert response.status_code == 404
     
-    @patch('orchestrator.get_filing_html')
-    @patch('orchestrator.extract_metric_from_html')
+    @patch('src.orchestrator.get_filing_html')
+    @patch('src.orchestrator.extract_metric_from_html')
     def test_xbrl_extraction_error(self, mock_extract, mock_get_filing):
         """测试XBRL提取错误"""
         mock_get_filing.return_value = "<html>Mock HTML</html>"
@@ -0,0 +1,127 @@
+"""
+测试上游流量的录制与回放 src/recording.py
+"""
+
+import os
+import sys
+import time
+import pytest
+import requests
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from src import sec_retriever
+from src import langgraph_orchestrator
+from src.recording import FixtureStore, FixtureMissing, set_fixture_store, replay_http
+from src.llm_backends import FakeIntentChatModel, RecordingChatModel, ReplayChatModel, create_llm
+
+URL = "https://data.sec.gov/submissions/CIK0000320193.json"
+
+@pytest.fixture(autouse=True)
+def store(tmp_path):
+    """每个测试使用独立的录制目录"""
+    store = FixtureStore(str(tmp_path / "recordings"))
+    set_fixture_store(store)
+    yield store
+    set_fixture_store(None)
+
+def _response(status: int, body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.url = URL
+    response.encoding = "utf-8"
+    response.headers["Content-Type"] = "application/json"
+    response._content = body
+    return response
+
+class TestSecReplay:
+    """测试SEC响应的录制和回放"""
+
+    def test_recorded_response_is_replayed_offline(self):
+        """测试录制后断网回放得到相同的响应"""
+        with patch("src.sec_retriever.RECORDING_MODE", "record"), \
+             patch("src.sec_retriever.requests.get", return_value=_response(200, b'{"cik": "320193"}')):
+            assert sec_retriever._sec_get(URL).json() == {"cik": "320193"}
+
+        with patch("src.sec_retriever.RECORDING_MODE", "replay"), \
+             patch("src.sec_retriever.requests.get", side_effect=requests.ConnectionError("offline")) as mock_get:
+            response = sec_retriever._sec_get(URL)
+
+        mock_get.assert_not_called()
+        assert response.status_code == 200
+        assert response.json() == {"cik": "320193"}
+
+    def test_error_status_is_replayed(self):
+        """测试录制的错误状态在回放时同样抛出HTTPError"""
+        with patch("src.sec_retriever.RECORDING_MODE", "record"), \
+             patch("src.sec_retriever.requests.get", return_value=_response(404, b"Not Found")):
+            with pytest.raises(requests.HTTPError):
+                sec_retriever._sec_get(URL)
+
+        with patch("src.sec_retriever.RECORDING_MODE", "replay"):
+            with pytest.raises(requests.HTTPError) as exc_info:
+                sec_retriever._sec_get(URL)
+        assert exc_info.value.response.status_code == 404
+        assert not sec_retriever.is_transient_error(exc_info.value)
+
+    def test_missing_fixture(self):
+        """测试没有录制的请求在回放时报错，且不算可重试的错误"""
+        with patch("src.sec_retriever.RECORDING_MODE", "replay"):
+            with pytest.raises(FixtureMissing) as exc_info:
+                sec_retriever._sec_get(URL)
+        assert not sec_retriever.is_transient_error(exc_info.value)
+
+    def test_injected_latency(self):
+        """测试回放时注入延迟，超过超时时间时像真实请求一样超时"""
+        with patch("src.sec_retriever.RECORDING_MODE", "record"), \
+             patch("src.sec_retriever.requests.get", return_value=_response(200, b"{}")):
+            sec_retriever._sec_get(URL)
+
+        with patch("src.sec_retriever.RECORDING_MODE", "replay"), patch("src.recording.REPLAY_LATENCY", "50"):
+            start = time.monotonic()
+            sec_retriever._sec_get(URL)
+            assert time.monotonic() - start >= 0.05
+
+            with pytest.raises(requests.Timeout):
+                replay_http(URL, timeout=0.01)
+
+class TestLLMReplay:
+    """测试LLM回复的录制和回放"""
+
+    def test_parse_intent_replays_recorded_completion(self):
+        """测试录制的函数调用回复在回放时原样返回"""
+        query = "AAPL 2023 revenue"
+        with patch.object(langgraph_orchestrator, "llm", RecordingChatModel(inner=FakeIntentChatModel())):
+            recorded, _ = langgraph_orchestrator._invoke_intent_llm(query)
+
+        with patch.object(langgraph_orchestrator, "llm", ReplayChatModel()):
+            replayed, usage = langgraph_orchestrator._invoke_intent_llm(query)
+
+        assert replayed == recorded
+        assert replayed["ticker"] == "AAPL"
+        assert usage["total_tokens"] > 0
+
+    def test_missing_completion(self):
+        """测试没有录制的提示词在回放时报错"""
+        messages = [SystemMessage(content="system"), HumanMessage(content="MSFT 2022 net income")]
+        with pytest.raises(FixtureMissing):
+            ReplayChatModel().invoke(messages)
+
+    def test_replay_timeout(self):
+        """测试注入的延迟超过调用超时时抛出TimeoutError"""
+        messages = [HumanMessage(content="MSFT 2022 net income")]
+        RecordingChatModel(inner=FakeIntentChatModel()).invoke(messages)
+        with patch("src.recording.REPLAY_LATENCY", "1000"):
+            with pytest.raises(TimeoutError):
+                ReplayChatModel().invoke(messages, timeout=0.01)
+
+    def test_create_llm_modes(self):
+        """测试回放模式不需要任何后端，录制模式包装所选后端"""
+        assert isinstance(create_llm("openai", recording_mode="replay"), ReplayChatModel)
+        recording = create_llm("fake", recording_mode="record")
+        assert isinstance(recording, RecordingChatModel)
+        assert isinstance(recording.inner, FakeIntentChatModel)
@@ -0,0 +1,102 @@
+"""
+测试评测脚本 evaluation/run_eval.py 的并发执行和阈值检查
+"""
+
+import os
+import sys
+import json
+import asyncio
+import pytest
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
+
+from evaluation.run_eval import LangGraphEvaluator, check_thresholds, main
+
+def _write_dataset(tmp_path, count):
+    """写入count个用例，用例i期望ticker为T{i}"""
+    dataset = [
+        {
+            "id": f"test_{i:03d}",
+            "query": f"T{i} 2023 revenue",
+            "expected_intent": {"ticker": f"T{i}", "metric": "Revenues", "year": 2023},
+            "category": "basic_query",
+        }
+        for i in range(count)
+    ]
+    path = tmp_path / "dataset.json"
+    path.write_text(json.dumps(dataset), encoding="utf-8")
+    return str(path)
+
+def _fake_process(state):
+    """按查询返回成功结果；编号越小耗时越长，使完成顺序与数据集顺序相反"""
+    async def process(query):
+        index = int(query.split()[0][1:])
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        await asyncio.sleep(0.01 * (10 - index))
+        state["active"] -= 1
+        intent = {"ticker": f"T{index}", "metric": "Revenues", "year": 2023, "form_type": "10-K"}
+        return {
+            "success": True,
+            "parsed_intent": intent,
+            "result": {**intent, "value": 1.0, "unit": "USD"},
+        }
+    return process
+
+@pytest.mark.asyncio
+async def test_concurrent_run_keeps_dataset_order(tmp_path):
+    """测试并发数受限，且报告顺序与数据集一致"""
+    state = {"active": 0, "peak": 0}
+    evaluator = LangGraphEvaluator(_write_dataset(tmp_path, 8), concurrency=3)
+    with patch("evaluation.run_eval.process_query_with_langgraph", _fake_process(state)), \
+         patch("evaluation.run_eval.LLM_BACKEND", "fake"):
+        report = await evaluator.run_evaluation()
+
+    assert state["peak"] == 3
+    assert [r["test_id"] for r in report["detailed_results"]] == [f"test_{i:03d}" for i in range(8)]
+    assert report["summary"]["e2e_accuracy"] == 100
+    assert report["summary"]["concurrency"] == 3
+
+@pytest.mark.asyncio
+async def test_overloaded_query_is_retried(tmp_path):
+    """测试被准入控制拒绝的查询等待retry_after后重试"""
+    calls = []
+
+    async def process(query):
+        calls.append(query)
+        if len(calls) == 1:
+            return {"success": False, "error": "服务繁忙", "retry_after": 0.01}
+        return await _fake_process({"active": 0, "peak": 0})(query)
+
+    evaluator = LangGraphEvaluator(_write_dataset(tmp_path, 1), concurrency=1)
+    with patch("evaluation.run_eval.process_query_with_langgraph", process), \
+         patch("evaluation.run_eval.LLM_BACKEND", "fake"):
+        report = await evaluator.run_evaluation()
+
+    assert len(calls) == 2
+    assert report["detailed_results"][0]["end_to_end_correct"]
+
+def test_check_thresholds():
+    """测试准确率低于阈值时返回失败说明"""
+    report = {"summary": {"nlu_accuracy": 90.0, "e2e_accuracy": 70.0}}
+    assert check_thresholds(report) == []
+    assert check_thresholds(report, min_nlu_accuracy=80, min_e2e_accuracy=70) == []
+    failures = check_thresholds(report, min_nlu_accuracy=80, min_e2e_accuracy=80)
+    assert len(failures) == 1 and "端到端" in failures[0]
+    assert check_thresholds({"error": "数据集加载失败"}) == ["数据集加载失败"]
+
+@pytest.mark.asyncio
+async def test_main_exit_code(tmp_path):
+    """测试作为合并检查时的退出码"""
+    dataset = _write_dataset(tmp_path, 2)
+    output = str(tmp_path / "report.json")
+    with patch("evaluation.run_eval.process_query_with_langgraph", _fake_process({"active": 0, "peak": 0})), \
+         patch("evaluation.run_eval.LLM_BACKEND", "fake"):
+        assert await main(["--dataset", dataset, "--output", output, "--min-e2e-accuracy", "95"]) == 0
+        assert os.path.exists(output)
+
+        with patch.object(LangGraphEvaluator, "check_end_to_end_accuracy", return_value=False):
+            assert await main(["--dataset", dataset, "--output", output, "--min-e2e-accuracy", "95"]) == 1
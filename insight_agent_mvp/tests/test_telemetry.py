@@ -0,0 +1,70 @@
+"""
+测试耗时追踪模块 src/telemetry.py
+"""
+
+import os
+import sys
+import pytest
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
+
+from src.telemetry import span, annotate, start_trace, add_sink, remove_sink, current_trace
+
+class TestTelemetry:
+    """测试span记录与导出"""
+    
+    def test_span_is_noop_without_trace(self):
+        """测试未开启追踪时span不记录任何数据"""
+        assert current_trace() is None
+        with span("noop") as record:
+            annotate(bytes=1)
+        assert record is None
+    
+    def test_nested_spans(self):
+        """测试嵌套span的父子关系和属性"""
+        with start_trace("query") as trace:
+            with span("outer", ticker="AAPL") as outer:
+                with span("inner"):
+                    annotate(cache="hit")
+        
+        spans = {s["name"]: s for s in trace.to_dict()["spans"]}
+        assert spans["outer"]["attributes"] == {"ticker": "AAPL"}
+        assert spans["inner"]["attributes"] == {"cache": "hit"}
+        assert spans["inner"]["parent_id"] == outer["id"]
+        assert spans["outer"]["parent_id"] is None
+        assert spans["outer"]["duration_ms"] >= spans["inner"]["duration_ms"]
+    
+    def test_span_records_error(self):
+        """测试异常会记录在span上并继续抛出"""
+        with start_trace("query") as trace:
+            with pytest.raises(ValueError):
+                with span("failing"):
+                    raise ValueError("boom")
+        
+        assert trace.spans[0]["attributes"]["error"] == "ValueError"
+    
+    def test_sink_receives_finished_trace(self):
+        """测试追踪结束后导出到sink，sink异常不影响调用方"""
+        exported = []
+        
+        def failing_sink(trace):
+            raise RuntimeError("sink down")
+        
+        add_sink(exported.append)
+        add_sink(failing_sink)
+        try:
+            with start_trace("query", query="test"):
+                with span("step"):
+                    pass
+        finally:
+            remove_sink(exported.append)
+            remove_sink(failing_sink)
+        
+        assert len(exported) == 1
+        assert exported[0]["attributes"] == {"query": "test"}
+        assert [s["name"] for s in exported[0]["spans"]] == ["step"]
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])